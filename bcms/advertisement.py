@@ -0,0 +1,69 @@
+"""Module to decode IoT data from BLE advertisements"""
+
+import logging
+import time
+from typing import Callable, Dict, List
+
+from .data_types import ADVERTISEMENT_DECODERS, DataType
+
+
+log = logging.getLogger(__name__)
+
+
+def decode_service_data(
+    address: str, service_data: Dict[str, bytes], timestamp: float
+) -> List[DataType]:
+    """
+    Decode advertised service data; one dict lookup per service UUID
+    - decoders are registered with data_types.register_data_type
+    """
+    all_data = []
+    for uuid, raw in service_data.items():
+        decoder = ADVERTISEMENT_DECODERS.get(uuid)
+        if decoder is None:
+            continue
+        value = decoder.decode(raw)
+        log.debug("  - BLE Found %s: %s data: %s", uuid, decoder.data_type.name, value)
+        if decoder.field is not None:
+            value = {decoder.field: value}
+        elif not isinstance(value, dict) or any(
+            field not in value for field in decoder.data_type.fields
+        ):
+            log.warning(
+                "Skipping %s data of %s: expected %s, got %s",
+                decoder.data_type.name,
+                address,
+                decoder.data_type.fields,
+                value,
+            )
+            continue
+        all_data.append(decoder.data_type(value, address, timestamp))
+    return all_data
+
+
+class AdvertisementRate:
+    """
+    Counts received advertisements, to compare capture rate across scan modes
+    - rate() covers wall-clock time since the previous call, including time spent not scanning
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        """count: number of advertisements since start"""
+        self.count = 0
+        self._window_start = clock()
+        self._window_count = 0
+
+    def hit(self):
+        self.count += 1
+
+    def rate(self) -> float:
+        """Advertisements per second since the previous call; starts a new window."""
+        now = self.clock()
+        elapsed = now - self._window_start
+        received = self.count - self._window_count
+        self._window_start = now
+        self._window_count = self.count
+        if elapsed <= 0:
+            return 0.0
+        return received / elapsed
@@ -1,8 +1,13 @@
+import asyncio
+import functools
 import logging
-from typing import Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
 from dataclasses import dataclass
 from px_python_shared.well_known import ApplicationsWellKnown
 import requests
+from requests.adapters import HTTPAdapter
 
 from px_python_shared import (
     get_well_known_by_identifier,
@@ -10,7 +15,17 @@ from px_python_shared import (
     add_scheme_from_auth_host,
 )
 
-from bcms.config import HTTP_TIMEOUT_SECONDS
+from bcms.auth import ExpiringCache, token_expiry
+from bcms.submission import check_compression, compress_body, encode_iot_data
+from bcms.config import (
+    HTTP_TIMEOUT_SECONDS,
+    HTTP_POOL_SIZE,
+    ACCESS_TOKEN_REFRESH_MARGIN,
+    ACCESS_TOKEN_DEFAULT_TTL,
+    WELL_KNOWN_TTL,
+    SUBMISSION_COMPRESSION,
+    SUBMISSION_COMPRESSION_MIN_BYTES,
+)
 
 log = logging.getLogger(__name__)
 
@@ -40,13 +55,30 @@ class IotDeviceCreateResponse:
 
 
 class BackendAPI:
+    """
+    Backend API client
+    - requests go through one pooled, keep-alive session
+    - async methods run the blocking requests in a small thread pool, off the event loop
+    - the access token is cached until shortly before it expires; well known for WELL_KNOWN_TTL
+    - privileges are checked once, on the first call to ready_api()
+    - submitted data is compressed (gzip, zstd) if at least compression_min_bytes, in the thread pool
+    """
+
     auth_host: Union[None, str]
     app_host: Union[None, str]
     identifier: Union[None, str]
 
     well_known: Union[None, dict]
 
-    def __init__(self, identifier: Union[str, None]) -> None:
+    def __init__(
+        self,
+        identifier: Union[str, None],
+        compression: str = SUBMISSION_COMPRESSION,
+        compression_min_bytes: int = SUBMISSION_COMPRESSION_MIN_BYTES,
+    ) -> None:
+        check_compression(compression)
+        self.compression = compression
+        self.compression_min_bytes = compression_min_bytes
         self.auth_host = None
         self.app_host = None
         # no identifier: offline use
@@ -57,20 +89,49 @@ class BackendAPI:
             log.info("Loading API with identifier %s ...", identifier)
 
         self.well_known = None
-            
+        self._privileges_checked = False
+        self._token = ExpiringCache(
+            self._fetch_access_token_and_host, refresh_margin=ACCESS_TOKEN_REFRESH_MARGIN
+        )
+        self._well_known = ExpiringCache(self._fetch_well_known)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=HTTP_POOL_SIZE, thread_name_prefix="bcms-api"
+        )
+
+    async def run_in_executor(self, fn: Callable, *args, **kwargs):
+        """Run a blocking API call in the API thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    def close(self) -> None:
+        """Close pooled connections, and stop the thread pool"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
     def ready_api(self) -> None:
         """Check if identifier is set and refresh well known if necessary"""
-        from px_device_identity import is_superuser_or_quit
-        is_superuser_or_quit()
+        if not self._privileges_checked:
+            from px_device_identity import is_superuser_or_quit
+            is_superuser_or_quit()
+            self._privileges_checked = True
         
         if not self.identifier:
             raise ValueError("Well known identifier is not set")
         
-        if self.well_known is None:
-            self.refresh_well_known()
+        self._well_known.get()
     
     def access_token_and_host(self) -> tuple:
-        """Get access token and host"""
+        """Get access token and host; cached until shortly before the token expires"""
+        return self._token.get()
+
+    def _fetch_access_token_and_host(self) -> tuple:
         from px_device_identity import Device
 
         device = Device()
@@ -78,8 +139,9 @@ class BackendAPI:
             raise ValueError("Device is not initiated: Has it been registered yet?")
         
         result = device.get_access_token()
+        expires_at = token_expiry(result, time.time(), ACCESS_TOKEN_DEFAULT_TTL)
 
-        return result["access_token"], device.properties.host
+        return (result["access_token"], device.properties.host), expires_at
 
     def access_token(self) -> str:
         """Get access token"""
@@ -89,6 +151,10 @@ class BackendAPI:
 
     def refresh_well_known(self) -> ApplicationsWellKnown:
         """Refresh well known"""
+        self._well_known.invalidate()
+        return self._well_known.get()
+
+    def _fetch_well_known(self) -> tuple:
         access_token, idp_host = self.access_token_and_host()
         
         self.well_known = get_well_known_by_identifier(
@@ -99,35 +165,48 @@ class BackendAPI:
             self.well_known.hostname, idp_host
         )
         
-        return self.well_known
+        return self.well_known, time.time() + WELL_KNOWN_TTL
+
+    def _raise_for_status(self, res: requests.Response) -> None:
+        """Raise on error; drop the cached token if it was rejected"""
+        if res.status_code == 401:
+            self._token.invalidate()
+        res.raise_for_status()
 
     async def submit_iot_data(self, data: list):
         """Submit iot data to server"""
-        log.debug("Submitting iot data %s", data)
-        self.ready_api()
-
-        url = f"{self.app_host}/api/iot-devices/data/submit"
-        res = requests.post(
-            url,
-            json={"data": data},
-            headers=make_bearer_headers(self.access_token()),
-            timeout=HTTP_TIMEOUT_SECONDS,
-        )
-        res.raise_for_status()
+        await self.run_in_executor(self.submit_iot_data_sync, data)
 
     def submit_iot_data_sync(self, data: list):
         """Submit iot data to server"""
         log.debug("Submitting iot data %s", data)
+        self.submit_encoded_iot_data_sync(encode_iot_data(data))
+
+    async def submit_encoded_iot_data(self, body: bytes):
+        """Submit iot data to server, already encoded with encode_iot_data"""
+        await self.run_in_executor(self.submit_encoded_iot_data_sync, body)
+
+    def submit_encoded_iot_data_sync(self, body: bytes):
+        """Submit iot data to server, already encoded with encode_iot_data"""
         self.ready_api()
 
         url = f"{self.app_host}/api/iot-devices/data/submit"
-        res = requests.post(
+        headers = {
+            **make_bearer_headers(self.access_token()),
+            "Content-Type": "application/json",
+        }
+        size = len(body)
+        body, encoding = compress_body(body, self.compression, self.compression_min_bytes)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            log.debug("Submitting %s bytes; %s bytes with %s", size, len(body), encoding)
+        res = self.session.post(
             url,
-            json={"data": data},
-            headers=make_bearer_headers(self.access_token()),
+            data=body,
+            headers=headers,
             timeout=HTTP_TIMEOUT_SECONDS,
         )
-        res.raise_for_status()
+        self._raise_for_status(res)
 
     def iot_device_exists(self, address: str):
         """Check if iot device exists"""
@@ -135,13 +214,13 @@ class BackendAPI:
         self.ready_api()
 
         url = f"{self.app_host}/api/iot-devices/exists"
-        res = requests.post(
+        res = self.session.post(
             url,
             json={"hardwareIdentifier": address},
             headers=make_bearer_headers(self.access_token()),
             timeout=HTTP_TIMEOUT_SECONDS,
         )
-        res.raise_for_status()
+        self._raise_for_status(res)
         data = res.json()
 
         exists = "exists" in data and data["exists"] is True
@@ -183,13 +262,13 @@ class BackendAPI:
         
         log.info("Creating iot device with data %s", data)
         
-        res = requests.post(
+        res = self.session.post(
             url,
             json=data,
             headers=make_bearer_headers(self.access_token()),
             timeout=HTTP_TIMEOUT_SECONDS,
         )
-        res.raise_for_status()
+        self._raise_for_status(res)
         data = res.json()
 
         return IotDeviceCreateResponse(
@@ -216,16 +295,22 @@ class BackendAPI:
             return self.create_iot_device(address)
 
     async def last_iot_device_data_submission(self, iot_device_id: str) -> int:
+        """Get last iot device data submission timestamp"""
+        return await self.run_in_executor(
+            self.last_iot_device_data_submission_sync, iot_device_id
+        )
+
+    def last_iot_device_data_submission_sync(self, iot_device_id: str) -> int:
         """Get last iot device data submission timestamp"""
         self.ready_api()
 
         url = f"{self.app_host}/api/iot-devices/{iot_device_id}/last-data-submission"
-        res = requests.get(
+        res = self.session.get(
             url,
             headers=make_bearer_headers(self.access_token()),
             timeout=HTTP_TIMEOUT_SECONDS,
         )
-        res.raise_for_status()
+        self._raise_for_status(res)
         # returns { timestamp: int, createdAt: Date }
         data = res.json()
         
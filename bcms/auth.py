@@ -0,0 +1,89 @@
+"""Module to cache access tokens, and other values that expire"""
+
+import base64
+import json
+import logging
+import threading
+import time
+from typing import Callable, Generic, Tuple, TypeVar, Union
+
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def token_expiry(result: dict, now: float, default_ttl: float) -> float:
+    """
+    When a token expires, as Unix timestamp
+    - from expires_at or expires_in, if the token response has them
+    - otherwise from the exp claim of a JWT access token
+    - otherwise default_ttl seconds from now
+    """
+    if result.get("expires_at"):
+        return float(result["expires_at"])
+    if result.get("expires_in"):
+        return now + float(result["expires_in"])
+    token = result.get("access_token") or ""
+    parts = token.split(".")
+    if len(parts) == 3:
+        try:
+            payload = parts[1] + "=" * (-len(parts[1]) % 4)
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            if "exp" in claims:
+                return float(claims["exp"])
+        except ValueError:
+            pass
+    return now + default_ttl
+
+
+class ExpiringCache(Generic[T]):
+    """
+    Holds one value until it expires
+    - fetch() returns the value, and when it expires as Unix timestamp
+    - the value is renewed refresh_margin seconds before it expires
+    - single flight: while one thread renews, others wait for its result instead of fetching too
+    - value and expiry are held as one tuple, so a concurrent invalidate() can't split them
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Tuple[T, float]],
+        refresh_margin: float = 0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        """_entry: (value, expires_at); replaced as a whole"""
+        self._entry: Tuple[Union[T, None], float] = (None, 0.0)
+        self._lock = threading.Lock()
+        """hits / fetches: lookups served from the cache / that fetched"""
+        self.hits = 0
+        self.fetches = 0
+
+    def _fresh(self, entry: Tuple[Union[T, None], float]) -> bool:
+        return self.clock() < entry[1] - self.refresh_margin
+
+    def get(self) -> T:
+        entry = self._entry
+        if self._fresh(entry):
+            self.hits += 1
+            return entry[0]
+        with self._lock:
+            # renewed while waiting for the lock
+            entry = self._entry
+            if self._fresh(entry):
+                self.hits += 1
+                return entry[0]
+            value, expires_at = self.fetch()
+            self.fetches += 1
+            self._entry = (value, expires_at)
+            log.debug("Renewed; valid for %.0fs", expires_at - self.clock())
+            return value
+
+    def invalidate(self):
+        self._entry = (None, 0.0)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "fetches": self.fetches}
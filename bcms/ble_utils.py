@@ -1,34 +1,52 @@
 import time
-from typing import List
 import asyncio
 import struct
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Union
 from bleak import BleakClient, BleakGATTCharacteristic
+from bleak.exc import BleakError
 from bleak.backends.scanner import AdvertisementData
 from bleak.backends.device import BLEDevice
 
-from .data_types import (
-    BloodPressureData,
-    DataType,
-    TemperatureData,
-    BatteryLevelData,
-    HeartRateData,
-    PressureData,
-    AlertData,
+from .advertisement import decode_service_data
+from .codecs import decode_blood_pressure_reading, decode_sfloat
+from .config import (
+    NOTIFICATION_IDLE_TIMEOUT,
+    NOTIFICATION_MAX_WAIT,
+    GATT_CONNECT_TIMEOUT,
+    GATT_RETRY_ATTEMPTS,
+    GATT_RETRY_BASE_DELAY,
+    GATT_RETRY_MAX_DELAY,
+    GATT_RETRY_DEADLINE,
+    CLOCK_SYNC_THRESHOLD,
+)
+from .connections import NotificationWaiter
+from .data_types import BloodPressureData
+from .retry import RetryPolicy
+from .clock_sync import ClockDriftModel
+from .gatt_cache import (
+    BLOOD_PRESSURE_MEASUREMENT_UUID,
+    DATE_TIME_UUID,
+    GattCache,
+    GattProfile,
 )
 
 
 log = logging.getLogger(__name__)
 
+# Connection attempts, when process_supported_device isn't given a policy
+default_retry_policy = RetryPolicy(
+    attempts=GATT_RETRY_ATTEMPTS,
+    base_delay=GATT_RETRY_BASE_DELAY,
+    max_delay=GATT_RETRY_MAX_DELAY,
+    deadline=GATT_RETRY_DEADLINE,
+    retry_on=(asyncio.TimeoutError, BleakError, OSError),
+)
+
 
 def _read_sfloat_le(buffer, index):
-    data = struct.unpack_from("<H", buffer, index)[0]
-    mantissa = data & 0x0FFF
-    if (mantissa & 0x0800) > 0:
-        mantissa = -1 * (~(mantissa - 0x01) & 0x0FFF)
-    exponential = data >> 12
-    return mantissa * pow(10, exponential)
+    return decode_sfloat(struct.unpack_from("<H", buffer, index)[0])
 
 
 def decode_data(data, battery):
@@ -84,14 +102,122 @@ def decode_data(data, battery):
     return result
 
 
+async def sync_device_time(
+    client: BleakClient,
+    device: BLEDevice,
+    handle: int,
+    notify_callback=None,
+    clock_model: Union[ClockDriftModel, None] = None,
+):
+    """
+    Read the device's date time characteristic, and set it if it's off by more than CLOCK_SYNC_THRESHOLD
+    - with clock_model, the read is skipped while the predicted offset is well within the threshold
+    """
+    now = time.time()
+    if clock_model is not None and not clock_model.needs_check(device.address, now):
+        log.debug("Skipping time check on %s; predicted to be in sync", device.address)
+        return
+
+    value = await client.read_gatt_char(handle)
+    year, month, day, hour, minute, second = struct.unpack("<HBBBBB", value[:7])
+    log.debug(
+        "Got time: %s-%s-%s %s:%s:%s",
+        year,
+        month,
+        day,
+        hour,
+        minute,
+        second,
+    )
+
+    device_time = datetime(year, month, day, hour, minute, second)
+    system_time = datetime.now()
+    offset = (device_time - system_time).total_seconds()
+    corrected = abs(offset) > CLOCK_SYNC_THRESHOLD
+
+    if corrected:
+        log.debug("Time is not up to date. Updating ...")
+        if notify_callback:
+            notify_callback(
+                "Updating time",
+                f"Updating time on {device.name} ({device.address}).",
+                5000,
+            )
+        new_time = struct.pack(
+            "<HBBBBB",
+            system_time.year,
+            system_time.month,
+            system_time.day,
+            system_time.hour,
+            system_time.minute,
+            system_time.second,
+        )
+        await client.write_gatt_char(handle, new_time)
+        if clock_model is not None:
+            clock_model.record(device.address, now, offset, corrected=True)
+        log.info("Updated time on %s (%s)", device.name, device.address)
+        if notify_callback:
+            notify_callback(
+                "Time updated",
+                f"Time updated on {device.name} ({device.address}).",
+                10000,
+            )
+        await asyncio.sleep(0.1)
+    elif clock_model is not None:
+        clock_model.record(device.address, now, offset, corrected=False)
+
+
 async def process_supported_device(
     device: BLEDevice,
     notify_callback=None,
     disconnected_callback=None,
     store_data_callback=None,
-    retry_count=0,
+    notification_idle=NOTIFICATION_IDLE_TIMEOUT,
+    notification_max_wait=NOTIFICATION_MAX_WAIT,
+    gatt_cache: Union[GattCache, None] = None,
+    retry_policy: Union[RetryPolicy, None] = None,
+    clock_model: Union[ClockDriftModel, None] = None,
 ):
+    """Connect to a device, sync its time, and collect readings; retried with retry_policy"""
+    if retry_policy is None:
+        retry_policy = default_retry_policy
+    await retry_policy.run(
+        lambda: _process_supported_device_once(
+            device,
+            notify_callback=notify_callback,
+            disconnected_callback=disconnected_callback,
+            store_data_callback=store_data_callback,
+            notification_idle=notification_idle,
+            notification_max_wait=notification_max_wait,
+            gatt_cache=gatt_cache,
+            clock_model=clock_model,
+        ),
+        name=f"Session with {device.address}",
+    )
+
+
+async def _process_supported_device_once(
+    device: BLEDevice,
+    notify_callback=None,
+    disconnected_callback=None,
+    store_data_callback=None,
+    notification_idle=NOTIFICATION_IDLE_TIMEOUT,
+    notification_max_wait=NOTIFICATION_MAX_WAIT,
+    gatt_cache: Union[GattCache, None] = None,
+    clock_model: Union[ClockDriftModel, None] = None,
+):
+    # Readings end with the device disconnecting, or going quiet
+    waiter = NotificationWaiter(idle=notification_idle, max_wait=notification_max_wait)
+
+    def on_disconnect(client: BleakClient):
+        waiter.disconnected()
+        if disconnected_callback:
+            disconnected_callback(client)
+
     def create_received_data_callback(sender: BleakGATTCharacteristic, data: bytearray):
+        waiter.notified()
+        # stored as it arrives, so it's in the window of its own timestamp
+        store_reading(time.time(), bytes(data))
         log.info("Received data from %s BPM service.", client.address)
         if notify_callback:
             notify_callback(
@@ -99,111 +225,64 @@ async def process_supported_device(
                 f"Received data from %s BPM service {client.address}.",
                 10000,
             )
-        decoded = decode_data(data, ["100"])
-
-        if store_data_callback:
-            if "SystolicPressure_kPa" in decoded and "DiastolicPressure_kPa" in decoded:
-                store_data_callback(
-                    BloodPressureData(
-                        data={
-                            "sys": decoded["SystolicPressure_kPa"],
-                            "dias": decoded["DiastolicPressure_kPa"],
-                        },
-                        address=device.address,
-                        timestamp=time.time(),
-                    )
-                )
 
-            if (
-                "SystolicPressure_mmHg" in decoded
-                and "DiastolicPressure_mmHg" in decoded
-            ):
-                store_data_callback(
-                    BloodPressureData(
-                        data={
-                            "sys": decoded["SystolicPressure_mmHg"],
-                            "dias": decoded["DiastolicPressure_mmHg"],
-                        },
-                        address=device.address,
-                        timestamp=time.time(),
-                    )
-                )
+    def store_reading(timestamp: float, data: bytes):
+        if store_data_callback is None:
+            return
+        reading = decode_blood_pressure_reading(data)
+        if reading is None:
+            log.warning("Skipped BPM record without a valid reading from %s", device.address)
+            return
+        systolic, diastolic = reading
+        store_data_callback(
+            BloodPressureData(
+                data={"sys": systolic, "dias": diastolic},
+                address=device.address,
+                timestamp=timestamp,
+            )
+        )
 
+    profile = None
+    if gatt_cache is not None:
+        profile = gatt_cache.get(device.address, device.name)
     try:
         async with BleakClient(
             device,
-            disconnected_callback=disconnected_callback,
+            disconnected_callback=on_disconnect,
+            # with a cached profile, only resolve the services we use
+            services=profile.services if profile else None,
+            timeout=GATT_CONNECT_TIMEOUT,
         ) as client:
-            for service in client.services:
-                for char in service.characteristics:
-                    if "read" in char.properties:
-                        if char.uuid == "00002a19-0000-1000-8000-00805f9b34fb":
-                            value = bytes(await client.read_gatt_char(char.uuid))
-                            log.debug("battery", value)
-                        elif char.uuid == "00002a35-0000-1000-8000-00805f9b34fb":
-                            value = bytes(await client.read_gatt_char(char.uuid))
-                            log.debug("serial", value)
-
-                    if char.uuid == "00002a08-0000-1000-8000-00805f9b34fb":
-                        value = await client.read_gatt_char(char.uuid)
-                        year, month, day, hour, minute, second = struct.unpack(
-                            "<HBBBBB", value
-                        )
-                        log.debug(
-                            "Got time: %s-%s-%s %s:%s:%s",
-                            year,
-                            month,
-                            day,
-                            hour,
-                            minute,
-                            second,
-                        )
-
-                        device_time = datetime(year, month, day, hour, minute, second)
-                        system_time = datetime.now()
-
-                        if abs(device_time - system_time) > timedelta(seconds=60):
-                            log.debug("Time is not up to date. Updating ...")
-                            if notify_callback:
-                                notify_callback(
-                                    "Updating time",
-                                    f"Updating time on {device.name} ({device.address}).",
-                                    5000,
-                                )
-                            new_time = struct.pack(
-                                "<HBBBBB",
-                                system_time.year,
-                                system_time.month,
-                                system_time.day,
-                                system_time.hour,
-                                system_time.minute,
-                                system_time.second,
-                            )
-                            await client.write_gatt_char(
-                                "00002a08-0000-1000-8000-00805f9b34fb", new_time
-                            )
-                            log.info(
-                                "Updated time on %s (%s)", device.name, device.address
-                            )
-                            if notify_callback:
-                                notify_callback(
-                                    "Time updated",
-                                    f"Time updated on {device.name} ({device.address}).",
-                                    10000,
-                                )
-                            await asyncio.sleep(0.1)
-
-                    if char.uuid == "00002a35-0000-1000-8000-00805f9b34fb":
-                        log.debug("Found BPM service: %s", char.uuid)
-                        if notify_callback:
-                            notify_callback(
-                                "Blood Presure Measurement",
-                                f"Subscribing on {device.name} ({device.address}).",
-                                10000,
-                            )
-                        await client.start_notify(char, create_received_data_callback)
-                        await asyncio.sleep(5.0)
-                        # await client.stop_notify(char)
+            if profile is None:
+                profile = GattProfile.discover(client.services)
+                log.debug("Discovered %s: %s", device.address, profile)
+                if gatt_cache is not None:
+                    gatt_cache.put(device.address, device.name, profile)
+
+            if profile.has(DATE_TIME_UUID, "read"):
+                await sync_device_time(
+                    client,
+                    device,
+                    profile.handles[DATE_TIME_UUID],
+                    notify_callback,
+                    clock_model,
+                )
+
+            if profile.has(BLOOD_PRESSURE_MEASUREMENT_UUID):
+                log.debug("Found BPM service: %s", BLOOD_PRESSURE_MEASUREMENT_UUID)
+                if notify_callback:
+                    notify_callback(
+                        "Blood Presure Measurement",
+                        f"Subscribing on {device.name} ({device.address}).",
+                        10000,
+                    )
+                waiter.start()
+                await client.start_notify(
+                    profile.handles[BLOOD_PRESSURE_MEASUREMENT_UUID],
+                    create_received_data_callback,
+                )
+                await waiter.wait()
+                # await client.stop_notify(char)
 
             if notify_callback:
                 notify_callback(
@@ -212,7 +291,6 @@ async def process_supported_device(
                     10000,
                 )
 
-    # if timeout error, retry max 3 times
     except asyncio.TimeoutError as err:
         log.error("TimeoutError: %s", err)
         if notify_callback:
@@ -221,21 +299,13 @@ async def process_supported_device(
                 f"TimeoutError on {device.name} ({device.address}).",
                 10000,
             )
-        if retry_count < 3:
-            log.debug("Retrying connection...%d", retry_count)
-            await asyncio.sleep(0.1)
-            await process_supported_device(
-                device,
-                notify_callback=notify_callback,
-                disconnected_callback=disconnected_callback,
-                store_data_callback=store_data_callback,
-                retry_count=retry_count + 1,
-            )
-        else:
-            raise err
+        raise err
 
     except Exception as err:
         log.error("Exception: %s", err)
+        # cached handles may be stale; discover again next time
+        if gatt_cache is not None:
+            gatt_cache.invalidate(device.address)
         raise err
 
 
@@ -245,101 +315,16 @@ def iot_advertisement_data_callback_wrapper(
     def iot_advertisement_data_callback(
         sender: BLEDevice, advertisement_data: AdvertisementData
     ):
-        all_data: List[DataType] = []
-        TYPE_KEY_DICT = {
-            "HEART_RATE": "00002a37-0000-1000-8000-00805f9b34fb",
-            "PRESSURE": "00002a6d-0000-1000-8000-00805f9b34fb",
-            "TEMPERATURE": "00002a6e-0000-1000-8000-00805f9b34fb",
-            "BATTERY_LEVEL": "0000180f-0000-1000-8000-00805f9b34fb",
-            "ALERT": "00002a46-0000-1000-8000-00805f9b34fb",
-        }
-
-        if advertisement_data:
-            for data_type, uuid in TYPE_KEY_DICT.items():
-                # starts with ...
-                match = False
-                for key in advertisement_data.service_data.keys():
-                    if key.startswith(uuid):
-                        match = True
-                        break
-
-                if match:
-
-                    def signed():
-                        return int.from_bytes(
-                            advertisement_data.service_data[uuid],
-                            byteorder="little",
-                            signed=True,
-                        )
-
-                    def unsigned():
-                        return int.from_bytes(
-                            advertisement_data.service_data[uuid],
-                            byteorder="little",
-                            signed=False,
-                        )
-
-                    def bytes_to_utf8():
-                        try:
-                            return advertisement_data.service_data[uuid].decode("utf-8")
-                        except UnicodeDecodeError as err:
-                            log.error(
-                                "Failed to decode bytes to utf-8: %s",
-                                err,
-                                exc_info=True,
-                            )
-                            return None
-
-                    data = None
-                    if data_type == "HEART_RATE":
-                        data_value = signed()
-                        log.debug(
-                            "  - BLE Found %s: Heart rate data: %s", uuid, data_value
-                        )
-                        data = HeartRateData(
-                            {"rate": data_value}, sender.address, time.time()
-                        )
-                    elif data_type == "PRESSURE":
-                        data_value = unsigned()
-                        log.debug(
-                            "  - BLE Found %s: Pressure data: %s", uuid, data_value
-                        )
-                        data = PressureData(
-                            {"level": data_value}, sender.address, time.time()
-                        )
-                    elif data_type == "TEMPERATURE":
-                        data_value = signed()
-                        log.debug(
-                            "  - BLE Found %s: Temperature data: %s", uuid, data_value
-                        )
-                        data = TemperatureData(
-                            {"level": data_value}, sender.address, time.time()
-                        )
-                    elif data_type == "BATTERY_LEVEL":
-                        data_value = signed()
-                        log.debug(
-                            "  - BLE Found %s: Battery level data: %s", uuid, data_value
-                        )
-                        data = BatteryLevelData(
-                            {"level": data_value}, sender.address, time.time()
-                        )
-                    elif data_type == "ALERT":
-                        data_value = bytes_to_utf8()
-                        log.debug("  - BLE Found %s: Alert data: %s", uuid, data_value)
-                        data = AlertData(
-                            {"id": data_value}, sender.address, time.time()
-                        )
-                    all_data.append(data)
+        if advertisement_data and store_data_callback is not None:
+            for d in decode_service_data(
+                sender.address, advertisement_data.service_data, time.time()
+            ):
+                store_data_callback(d)
 
         # Check for manufacturer data
         # if advertisement_data.manufacturer_data:
         #     print(f"  Manufacturer data: {advertisement_data.manufacturer_data}")
 
-        if len(all_data) > 0:
-            if store_data_callback is not None:
-                for d in all_data:
-                    store_data_callback(d)
-
         if track_device_callback is not None:
             track_device_callback(sender)
 
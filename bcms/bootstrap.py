@@ -4,18 +4,42 @@ import logging
 from bleak.exc import BleakDeviceNotFoundError
 
 from .queue import AsyncQueue
+from .ingest import IngestBuffer
+from .gatt_cache import GattCache
+from .clock_sync import ClockDriftModel
 from .paired_devices import get_paired_devices
 from .devices_memory import BCMDeviceMemory
 from .data_store import BCMSDeviceDataDB
 from .devices_classes import BCMSDeviceInfo
+from .config import (
+    DATA_STORE_BATCH_SIZE,
+    DATA_STORE_FLUSH_INTERVAL,
+    DATA_STORE_MAX_ROWS,
+    KNOWN_DEVICES_SAVE_INTERVAL,
+    INGEST_BUFFER_SIZE,
+    CLOCK_SYNC_THRESHOLD,
+    CLOCK_CHECK_MAX_AGE,
+)
 
 log = logging.getLogger(__name__)
 
 
 # Devices in range
-devices_mem = BCMDeviceMemory()
+devices_mem = BCMDeviceMemory(save_interval=KNOWN_DEVICES_SAVE_INTERVAL)
 # Devices data
-devices_data = BCMSDeviceDataDB()
+# - in memory, until main() opens the file selected with --data-store
+devices_data = BCMSDeviceDataDB(
+    batch_size=DATA_STORE_BATCH_SIZE,
+    flush_interval=DATA_STORE_FLUSH_INTERVAL,
+    max_rows=DATA_STORE_MAX_ROWS,
+)
+# Devices data, not yet written to devices_data
+ingest_buffer = IngestBuffer(maxlen=INGEST_BUFFER_SIZE)
+
+# Resolved characteristics of connected devices
+gatt_cache = GattCache()
+# Clock drift of connected devices
+clock_drift = ClockDriftModel(threshold=CLOCK_SYNC_THRESHOLD, max_age=CLOCK_CHECK_MAX_AGE)
 
 # Devices runtime data
 # - auth_host
@@ -36,14 +60,11 @@ def list_devices(max_age_s=60, only_approved=False):
         paired = []
 
     log.debug("Found devices %s", len(devices))
+    paired_addresses = {pd.address for pd in paired or []}
     filtered_devices = []
     for device in devices:
-        if paired:
-            for pd in paired:
-                if pd.address == device.address:
-                    device.approved = True
-                    device.paired = True
-                    break
+        if device.address in paired_addresses:
+            devices_mem.mark_paired(device.address)
         if only_approved:
             if not device.approved or device.paired:
                 log.debug(" - Skipping (only_approved) %s", device.address)
@@ -225,6 +246,8 @@ async def unpair_device(device_address: str, notify_callback=None):
                 await unpair_subprocess(device_address)
 
                 devices_mem.remove(device_address)
+                gatt_cache.invalidate(device_address)
+                clock_drift.forget(device_address)
                 log.debug("Removed %s", device_address)
 
                 if notify_callback:
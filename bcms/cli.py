@@ -1,7 +1,13 @@
 import argparse
 from .config import (
     BLUETOOTH_SCAN_INTERVAL,
+    BLUETOOTH_SCAN_MODE,
+    BLUETOOTH_SCAN_MODES,
+    GATT_CONNECTION_LIMIT,
     DATA_SUBMISSION_INTERVAL,
+    DATA_STORE_MAX_ROWS,
+    SUBMISSION_COMPRESSION,
+    SUBMISSION_COMPRESSION_METHODS,
 )
 
 
@@ -33,6 +39,21 @@ def parse_cli_params():
         default=BLUETOOTH_SCAN_INTERVAL,
         help="Sleep time in seconds between checks",
     )
+    parser.add_argument(
+        "-sm",
+        "--scan-mode",
+        type=str,
+        choices=BLUETOOTH_SCAN_MODES,
+        default=BLUETOOTH_SCAN_MODE,
+        help="cycle: restart the BLE scan every --sleep seconds; continuous: keep scanning, and connect to devices every --sleep seconds",
+    )
+    parser.add_argument(
+        "-cl",
+        "--connection-limit",
+        type=int,
+        default=GATT_CONNECTION_LIMIT,
+        help="Maximum number of devices to connect to at once",
+    )
     parser.add_argument(
         "-sd",
         "--sleep-data",
@@ -40,6 +61,14 @@ def parse_cli_params():
         default=DATA_SUBMISSION_INTERVAL,
         help="Sleep time in seconds between API submission",
     )
+    parser.add_argument(
+        "-sc",
+        "--submission-compression",
+        type=str,
+        choices=SUBMISSION_COMPRESSION_METHODS,
+        default=SUBMISSION_COMPRESSION,
+        help="Compress submitted data; the backend has to accept the Content-Encoding. zstd needs the zstandard package",
+    )
     # TODO: Deprecated
     parser.add_argument(
         "-di",
@@ -55,6 +84,20 @@ def parse_cli_params():
         default=None,
         help="Identify remote server to register ble devices with and log to. To be used with --use_device_identity",
     )
+    parser.add_argument(
+        "-ds",
+        "--data-store",
+        type=str,
+        default=None,
+        help="Keep collected data in this file, until submitted, to survive restarts. Default: in memory",
+    )
+    parser.add_argument(
+        "-dsm",
+        "--data-store-max-rows",
+        type=int,
+        default=DATA_STORE_MAX_ROWS,
+        help="Maximum number of collected data entries to keep; the oldest are dropped first",
+    )
     parser.add_argument(
         "-d",
         "--debug",
@@ -70,8 +113,13 @@ def parse_cli_params():
         "username": args.username,
         "notify": args.notify,
         "sleep": args.sleep,
+        "scan_mode": args.scan_mode,
+        "connection_limit": args.connection_limit,
         "sleep_data": args.sleep_data,
+        "submission_compression": args.submission_compression,
         "use_device_identity": args.use_device_identity,
         "application_identifier": args.application_identifier,
         "debug": args.debug,
+        "data_store": args.data_store,
+        "data_store_max_rows": args.data_store_max_rows,
     }
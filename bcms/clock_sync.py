@@ -0,0 +1,105 @@
+"""Module to predict device clock drift, to skip unneeded clock reads and writes"""
+
+import logging
+from typing import Dict, Union
+
+
+log = logging.getLogger(__name__)
+
+
+class ClockState:
+    """Clock of one device, as of the last read"""
+
+    def __init__(self, checked: float, offset: float, rate: Union[float, None] = None):
+        """checked: host time of the last read; offset: device minus host time, in seconds, after it"""
+        self.checked = checked
+        self.offset = offset
+        """rate: drift in seconds per second, once measured"""
+        self.rate = rate
+        """since / since_offset: start of the current rate measurement"""
+        self.since = checked
+        self.since_offset = offset
+
+    def predict(self, now: float) -> Union[float, None]:
+        """Predicted offset at now; None if the rate isn't known yet."""
+        if self.rate is None:
+            return None
+        return self.offset + self.rate * (now - self.checked)
+
+
+class ClockDriftModel:
+    """
+    Tells whether a device clock needs to be read, from its previous reads
+    - a device is read until its drift rate is known; then only once the predicted offset may exceed threshold
+    - margin is added to the prediction: clocks have 1 second resolution
+    - the rate is measured across reads at least min_interval seconds apart, and smoothed
+    - a device is read at least every max_age seconds regardless, to notice a reset clock
+    """
+
+    def __init__(
+        self,
+        threshold: float = 60,
+        margin: float = 2,
+        min_interval: float = 600,
+        max_age: float = 24 * 60 * 60,
+        smoothing: float = 0.5,
+    ):
+        self.threshold = threshold
+        self.margin = margin
+        self.min_interval = min_interval
+        self.max_age = max_age
+        self.smoothing = smoothing
+        self._clocks: Dict[str, ClockState] = {}
+        """checked / skipped: connections with / without reading the clock"""
+        self.checked = 0
+        self.skipped = 0
+
+    def needs_check(self, address: str, now: float) -> bool:
+        clock = self._clocks.get(address)
+        if clock is None or now - clock.checked >= self.max_age:
+            needed = True
+        else:
+            predicted = clock.predict(now)
+            needed = predicted is None or abs(predicted) + self.margin > self.threshold
+        if needed:
+            self.checked += 1
+        else:
+            self.skipped += 1
+        return needed
+
+    def record(self, address: str, now: float, offset: float, corrected: bool):
+        """
+        Record a clock read: offset is device minus host time, in seconds, as read
+        - corrected: the clock was set to host time right after
+        """
+        clock = self._clocks.get(address)
+        if clock is None:
+            clock = self._clocks[address] = ClockState(now, offset)
+        elif now - clock.since >= self.min_interval:
+            measured = (offset - clock.since_offset) / (now - clock.since)
+            if clock.rate is None:
+                clock.rate = measured
+            else:
+                clock.rate = self.smoothing * measured + (1 - self.smoothing) * clock.rate
+            clock.since = now
+            clock.since_offset = offset
+        clock.checked = now
+        clock.offset = offset
+        if corrected:
+            # measure from the corrected clock on
+            clock.offset = clock.since_offset = 0.0
+            clock.since = now
+        rate = clock.rate
+        log.debug(
+            "Clock of %s: offset %.1fs%s, drift %s s/day",
+            address,
+            offset,
+            " (corrected)" if corrected else "",
+            "unknown" if rate is None else round(rate * 24 * 60 * 60, 2),
+        )
+
+    def forget(self, address: str):
+        self._clocks.pop(address, None)
+
+    def stats(self) -> dict:
+        return {"checked": self.checked, "skipped": self.skipped}
@@ -0,0 +1,289 @@
+"""Module to decode raw values read from BLE devices"""
+
+import logging
+import math
+import struct
+from array import array
+from typing import Dict, Iterable, List, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+log = logging.getLogger(__name__)
+
+# Bluetooth base UUID; 16-bit and 32-bit UUIDs are short forms of it
+BASE_UUID_SUFFIX = "-0000-1000-8000-00805f9b34fb"
+
+
+def normalize_uuid(uuid: str) -> str:
+    """Full, lower-case 128-bit UUID; expands short forms like "2a37" or "00002a37"."""
+    uuid = uuid.lower()
+    if len(uuid) == 4:
+        return f"0000{uuid}{BASE_UUID_SUFFIX}"
+    if len(uuid) == 8:
+        return f"{uuid}{BASE_UUID_SUFFIX}"
+    return uuid
+
+
+def decode_signed(raw: bytes) -> int:
+    """Little-endian signed integer"""
+    return int.from_bytes(raw, byteorder="little", signed=True)
+
+
+def decode_unsigned(raw: bytes) -> int:
+    """Little-endian unsigned integer"""
+    return int.from_bytes(raw, byteorder="little", signed=False)
+
+
+def decode_utf8(raw: bytes) -> Union[str, None]:
+    """UTF-8 string; None if it can't be decoded"""
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError as err:
+        log.error("Failed to decode bytes to utf-8: %s", err, exc_info=True)
+        return None
+
+
+# IEEE 11073-20601 SFLOAT: 4-bit signed exponent, 12-bit signed mantissa; reserved mantissas with exponent 0
+SFLOAT_SPECIAL_VALUES = {
+    0x07FE: math.inf,
+    0x07FF: math.nan,
+    0x0800: math.nan,  # not at this resolution
+    0x0801: math.nan,  # reserved
+    0x0802: -math.inf,
+}
+
+_sfloat_table = None
+_sfloat_table_np = None
+
+
+def sfloat_table() -> array:
+    """Value of every SFLOAT, by its raw 16-bit value; built on first use"""
+    global _sfloat_table
+    if _sfloat_table is None:
+        table = array("d", bytes(8 * 0x10000))
+        for raw in range(0x10000):
+            mantissa = raw & 0x0FFF
+            if mantissa >= 0x0800:
+                mantissa -= 0x1000
+            exponent = raw >> 12
+            if exponent >= 0x8:
+                exponent -= 0x10
+            # divide for negative exponents; 1234 / 10 is exactly 123.4, 1234 * 0.1 isn't
+            if exponent >= 0:
+                table[raw] = float(mantissa * 10**exponent)
+            else:
+                table[raw] = mantissa / 10**-exponent
+        for raw, value in SFLOAT_SPECIAL_VALUES.items():
+            table[raw] = value
+        _sfloat_table = table
+    return _sfloat_table
+
+
+def decode_sfloat(raw: int) -> float:
+    """Little-endian SFLOAT, from its raw 16-bit value"""
+    return sfloat_table()[raw]
+
+
+# Blood Pressure Measurement (2a35) flags
+BPM_FLAG_KPA = 0x01
+BPM_FLAG_TIMESTAMP = 0x02
+BPM_FLAG_PULSE_RATE = 0x04
+BPM_FLAG_USER_ID = 0x08
+BPM_FLAG_STATUS = 0x10
+_BPM_FLAGS = 0x1F
+# Systolic and diastolic pressure; the first two fields after the flags, whatever the flags
+_BPM_PRESSURES = struct.Struct("<HH")
+
+
+def _bpm_layout(flags: int) -> List[Tuple[str, str]]:
+    """Fields of a record with these flags, in order, with their struct format"""
+    layout = [
+        ("flags", "B"),
+        ("systolic", "H"),
+        ("diastolic", "H"),
+        ("mean_arterial", "H"),
+    ]
+    if flags & BPM_FLAG_TIMESTAMP:
+        layout += [
+            ("year", "H"),
+            ("month", "B"),
+            ("day", "B"),
+            ("hour", "B"),
+            ("minute", "B"),
+            ("second", "B"),
+        ]
+    if flags & BPM_FLAG_PULSE_RATE:
+        layout.append(("pulse_rate", "H"))
+    if flags & BPM_FLAG_USER_ID:
+        layout.append(("user_id", "B"))
+    if flags & BPM_FLAG_STATUS:
+        layout.append(("status", "H"))
+    return layout
+
+
+_bpm_structs: Dict[int, Tuple[struct.Struct, List[str]]] = {}
+
+
+def _bpm_struct(flags: int) -> Tuple[struct.Struct, List[str]]:
+    layout = _bpm_structs.get(flags)
+    if layout is None:
+        fields = _bpm_layout(flags)
+        layout = _bpm_structs[flags] = (
+            struct.Struct("<" + "".join(fmt for _, fmt in fields)),
+            [name for name, _ in fields],
+        )
+    return layout
+
+
+class BloodPressureRecords:
+    """
+    Decoded Blood Pressure Measurement records, one array per field, in record order
+    - NumPy arrays if NumPy is installed, array.array otherwise
+    - pressures and pulse rate are NaN when absent; date fields and status are 0 when absent
+    - kpa: 1 where pressures are in kPa, 0 where in mmHg
+    - records too short for their flags are skipped, and counted in invalid; positions has
+      the index of every decoded record in the input
+    """
+
+    FLOAT_FIELDS = ("systolic", "diastolic", "mean_arterial", "pulse_rate")
+    INT_FIELDS = (
+        ("kpa", "B"),
+        ("year", "H"),
+        ("month", "B"),
+        ("day", "B"),
+        ("hour", "B"),
+        ("minute", "B"),
+        ("second", "B"),
+        ("user_id", "B"),
+        ("status", "H"),
+    )
+
+    def __init__(self, columns: dict, invalid: int = 0):
+        self.systolic = columns["systolic"]
+        self.diastolic = columns["diastolic"]
+        self.mean_arterial = columns["mean_arterial"]
+        self.pulse_rate = columns["pulse_rate"]
+        self.kpa = columns["kpa"]
+        self.year = columns["year"]
+        self.month = columns["month"]
+        self.day = columns["day"]
+        self.hour = columns["hour"]
+        self.minute = columns["minute"]
+        self.second = columns["second"]
+        self.user_id = columns["user_id"]
+        self.status = columns["status"]
+        self.positions = columns["positions"]
+        self.invalid = invalid
+
+    def __len__(self):
+        return len(self.systolic)
+
+
+def decode_blood_pressure_records(
+    records: Iterable[bytes], use_numpy: Union[bool, None] = None
+) -> BloodPressureRecords:
+    """
+    Decode many Blood Pressure Measurement records at once
+    - records with the same flags share a layout; each layout is decoded in one go
+    - use_numpy: None to use NumPy if installed
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy and np is None:
+        raise ValueError("NumPy is not installed")
+
+    groups: Dict[int, List[bytes]] = {}
+    order: Dict[int, List[int]] = {}
+    positions = []
+    count = 0
+    invalid = 0
+    for position, record in enumerate(records):
+        if len(record) == 0:
+            invalid += 1
+            continue
+        # bits above the status flag are reserved
+        flags = record[0] & _BPM_FLAGS
+        size = _bpm_struct(flags)[0].size
+        if len(record) < size:
+            invalid += 1
+            continue
+        groups.setdefault(flags, []).append(record[:size])
+        order.setdefault(flags, []).append(count)
+        positions.append(position)
+        count += 1
+
+    if use_numpy:
+        columns = _decode_bpm_numpy(groups, order, count)
+        columns["positions"] = np.asarray(positions, dtype=np.int64)
+    else:
+        columns = _decode_bpm_python(groups, order, count)
+        columns["positions"] = array("q", positions)
+    return BloodPressureRecords(columns, invalid)
+
+
+def decode_blood_pressure_reading(record: bytes) -> Union[Tuple[float, float], None]:
+    """
+    Systolic and diastolic pressure of one Blood Pressure Measurement record, as it arrives
+    - decoded in place; decode_blood_pressure_records is for many records at once
+    - None if the record is too short for its flags, or a pressure is a special value (NaN, infinity)
+    """
+    if len(record) == 0 or len(record) < _bpm_struct(record[0] & _BPM_FLAGS)[0].size:
+        return None
+    table = sfloat_table()
+    raw_systolic, raw_diastolic = _BPM_PRESSURES.unpack_from(record, 1)
+    systolic, diastolic = table[raw_systolic], table[raw_diastolic]
+    if not (math.isfinite(systolic) and math.isfinite(diastolic)):
+        return None
+    return systolic, diastolic
+
+
+def _decode_bpm_python(groups, order, count) -> dict:
+    table = sfloat_table()
+    columns = {name: array("d", [math.nan]) * count for name in BloodPressureRecords.FLOAT_FIELDS}
+    for name, typecode in BloodPressureRecords.INT_FIELDS:
+        columns[name] = array(typecode, [0]) * count
+    for flags, group in groups.items():
+        unpack, names = _bpm_struct(flags)
+        kpa = flags & BPM_FLAG_KPA
+        targets = [
+            (position, columns[name], name in BloodPressureRecords.FLOAT_FIELDS)
+            for position, name in enumerate(names)
+            if name != "flags"
+        ]
+        for index, record in zip(order[flags], group):
+            values = unpack.unpack(record)
+            for position, column, is_sfloat in targets:
+                value = values[position]
+                column[index] = table[value] if is_sfloat else value
+            columns["kpa"][index] = kpa
+    return columns
+
+
+def _decode_bpm_numpy(groups, order, count) -> dict:
+    global _sfloat_table_np
+    if _sfloat_table_np is None:
+        _sfloat_table_np = np.frombuffer(sfloat_table(), dtype=np.float64)
+    table = _sfloat_table_np
+    columns = {
+        name: np.full(count, np.nan) for name in BloodPressureRecords.FLOAT_FIELDS
+    }
+    for name, typecode in BloodPressureRecords.INT_FIELDS:
+        columns[name] = np.zeros(count, dtype=np.uint16 if typecode == "H" else np.uint8)
+    for flags, group in groups.items():
+        layout = _bpm_layout(flags)
+        dtype = np.dtype([(name, "<u2" if fmt == "H" else "u1") for name, fmt in layout])
+        raw = np.frombuffer(b"".join(group), dtype=dtype)
+        indexes = np.asarray(order[flags])
+        for name, _ in layout:
+            if name == "flags":
+                continue
+            if name in BloodPressureRecords.FLOAT_FIELDS:
+                columns[name][indexes] = table[raw[name]]
+            else:
+                columns[name][indexes] = raw[name]
+        columns["kpa"][indexes] = flags & BPM_FLAG_KPA
+    return columns
@@ -4,8 +4,55 @@ import os
 
 
 DATA_SUBMISSION_INTERVAL = 30.0
+# Submit one sample per device, type and DATA_SAMPLE_INTERVAL seconds
+# - strategy: first, last, mean, min or max
+DATA_SAMPLE_INTERVAL = 2
+DATA_SAMPLE_STRATEGY = "first"
 CLEAR_IOT_DATA_CACHE_INTERVAL = 180.0
 BLUETOOTH_SCAN_INTERVAL = 5.0
+# Bluetooth scan mode
+# - cycle: start and stop a scanner every BLUETOOTH_SCAN_INTERVAL seconds
+# - continuous: keep one scanner running; connect and process the queue every BLUETOOTH_SCAN_INTERVAL seconds
+BLUETOOTH_SCAN_MODE = "cycle"
+BLUETOOTH_SCAN_MODES = ["cycle", "continuous"]
+
+# Data store: buffer samples, and write them in batches
+DATA_STORE_BATCH_SIZE = 100
+DATA_STORE_FLUSH_INTERVAL = 1.0
+# Ingest buffer between BLE callbacks and the data store
+# - when full, the oldest samples are dropped
+INGEST_BUFFER_SIZE = 10000
+INGEST_BATCH_SIZE = 500
+INGEST_INTERVAL = 0.5
+# Data store: upper bound of kept samples; the oldest are evicted first
+DATA_STORE_MAX_ROWS = 1000000
+
+# Notifications: stop waiting NOTIFICATION_IDLE_TIMEOUT seconds after the last one (once one arrived),
+# or NOTIFICATION_MAX_WAIT seconds after subscribing; whichever comes first
+NOTIFICATION_IDLE_TIMEOUT = 2.0
+NOTIFICATION_MAX_WAIT = 5.0
+# GATT sessions: at most GATT_CONNECTION_LIMIT at once, each cancelled after GATT_SESSION_TIMEOUT seconds
+# - most adapters handle a few concurrent connections; raise with care
+GATT_CONNECTION_LIMIT = 2
+GATT_SESSION_TIMEOUT = 60.0
+# GATT sessions: connecting gives up after GATT_CONNECT_TIMEOUT seconds; an attempt takes at most
+# about GATT_ATTEMPT_TIME: connect, then discovery and clock sync (as long again), then notifications
+GATT_CONNECT_TIMEOUT = 10.0
+GATT_ATTEMPT_TIME = 2 * GATT_CONNECT_TIMEOUT + NOTIFICATION_MAX_WAIT
+# GATT sessions: retry with exponential backoff and jitter; no retry starts after GATT_RETRY_DEADLINE
+# seconds, so the last attempt ends before GATT_SESSION_TIMEOUT
+GATT_RETRY_ATTEMPTS = 4
+GATT_RETRY_BASE_DELAY = 0.5
+GATT_RETRY_MAX_DELAY = 8.0
+GATT_RETRY_DEADLINE = GATT_SESSION_TIMEOUT - GATT_ATTEMPT_TIME
+# Skip a device for GATT_CIRCUIT_BREAKER_COOLDOWN scan cycles, after GATT_CIRCUIT_BREAKER_THRESHOLD failed sessions in a row
+# - sessions cancelled at GATT_SESSION_TIMEOUT count as failed
+GATT_CIRCUIT_BREAKER_THRESHOLD = 3
+GATT_CIRCUIT_BREAKER_COOLDOWN = 5
+# Device clocks: set when off by more than CLOCK_SYNC_THRESHOLD seconds
+# - read only when the drift, predicted from previous reads, may exceed it; at least every CLOCK_CHECK_MAX_AGE seconds
+CLOCK_SYNC_THRESHOLD = 60
+CLOCK_CHECK_MAX_AGE = 24 * 60 * 60
 
 SUPPORTED_DEVICES = ["A&D_UA-651BLE_", "BLESmart_", "X4 Smart"]
 
@@ -20,6 +67,31 @@ device_capnp = pimstore_capnp.BCMSDeviceInfo
 working_mode_capnp = pimstore_capnp.BCMSWorkingMode
 
 HTTP_TIMEOUT_SECONDS = 10
+# Backend API: pooled keep-alive connections, and threads running requests off the event loop
+HTTP_POOL_SIZE = 4
+# Backend API: renew access tokens this many seconds before they expire;
+# tokens without a known expiry are kept for ACCESS_TOKEN_DEFAULT_TTL seconds
+ACCESS_TOKEN_REFRESH_MARGIN = 60
+ACCESS_TOKEN_DEFAULT_TTL = 300
+# Backend API: re-resolve the application host (well known) after this many seconds
+WELL_KNOWN_TTL = 60 * 60
+# Backend API: concurrent last submission lookups, on the first submission after start
+WATERMARK_LOOKUP_CONCURRENCY = HTTP_POOL_SIZE
+# Backend API: submit data in chunks of at most this many samples / bytes (before compression), a few at once
+SUBMISSION_MAX_SAMPLES = 1000
+SUBMISSION_MAX_BYTES = 512 * 1024
+SUBMISSION_MAX_IN_FLIGHT = 2
+# Backend API: read at most this many samples per submission cycle; after an outage, the backlog
+# is submitted over several cycles, back to back, resuming from the watermarks
+SUBMISSION_MAX_CYCLE_SAMPLES = 20 * SUBMISSION_MAX_SAMPLES
+# Backend API: compress submitted data (none, gzip, zstd), if the body is at least this many bytes.
+# The backend has to accept Content-Encoding on requests; zstd needs the zstandard package
+SUBMISSION_COMPRESSION = "none"
+SUBMISSION_COMPRESSION_METHODS = ("none", "gzip", "zstd")
+SUBMISSION_COMPRESSION_MIN_BYTES = 1024
+
+# Coalesce writes of the known devices file for this many seconds
+KNOWN_DEVICES_SAVE_INTERVAL = 5.0
 
 # LEGACY
 KNOWN_DEVICES_FILE = os.path.expanduser(
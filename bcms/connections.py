@@ -0,0 +1,165 @@
+"""Module to schedule GATT sessions within adapter limits, and to tell when a session is done"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict
+
+
+log = logging.getLogger(__name__)
+
+
+class SessionStats:
+    """Durations of one device's sessions, in seconds"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.last = 0.0
+
+    def add(self, duration: float):
+        self.sessions += 1
+        self.total += duration
+        self.last = duration
+        if duration > self.longest:
+            self.longest = duration
+
+    def to_dict(self) -> dict:
+        return {
+            "sessions": self.sessions,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "mean": round(self.total / self.sessions, 3) if self.sessions else 0.0,
+            "longest": round(self.longest, 3),
+            "last": round(self.last, 3),
+        }
+
+
+class ConnectionScheduler:
+    """
+    Runs GATT sessions concurrently, at most limit at a time
+    - a session that takes longer than timeout seconds is cancelled
+    - one session per device at a time; a device that's already connected is skipped
+    - durations are recorded per device; see report()
+    """
+
+    def __init__(self, limit: int = 2, timeout: float = 60.0):
+        if limit < 1:
+            raise ValueError(f"Connection limit must be at least 1: {limit}")
+        self.limit = limit
+        self.timeout = timeout
+        self.stats: Dict[str, SessionStats] = {}
+        self._semaphore = asyncio.Semaphore(limit)
+        self._active = set()
+
+    async def run(self, address: str, session: Callable[[], Awaitable]) -> bool:
+        """Run a session once a slot is free; returns False if it was skipped, failed or timed out."""
+        if address in self._active:
+            log.debug("Session with %s already running; skipping", address)
+            return False
+        self._active.add(address)
+        stats = self.stats.setdefault(address, SessionStats())
+        try:
+            async with self._semaphore:
+                start = time.monotonic()
+                try:
+                    await asyncio.wait_for(session(), self.timeout)
+                    return True
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                    log.warning("Session with %s timed out after %ss", address, self.timeout)
+                except Exception as err:
+                    stats.failures += 1
+                    log.error("Session with %s failed: %s", address, err)
+                finally:
+                    stats.add(time.monotonic() - start)
+                return False
+        finally:
+            self._active.discard(address)
+
+    async def run_all(self, sessions: Dict[str, Callable[[], Awaitable]]) -> Dict[str, bool]:
+        """Run sessions by device address, concurrently within the limit."""
+        addresses = list(sessions.keys())
+        results = await asyncio.gather(
+            *(self.run(address, sessions[address]) for address in addresses)
+        )
+        return dict(zip(addresses, results))
+
+    def report(self) -> Dict[str, dict]:
+        """Session durations and outcomes, by device address"""
+        return {address: stats.to_dict() for address, stats in self.stats.items()}
+
+
+class NotificationWaiter:
+    """
+    Waits until a device is done sending notifications
+    - ends when the device disconnects, or done() is called
+    - ends after idle seconds without a notification, counted from the first one;
+      devices may take a while to start sending
+    - ends after max_wait seconds at the latest, counted from start(), or creation
+    """
+
+    def __init__(self, idle: float = 2.0, max_wait: float = 5.0):
+        self.idle = idle
+        self.max_wait = max_wait
+        """notifications: number received; reason: why wait() returned"""
+        self.notifications = 0
+        self.reason = None
+        self._done = asyncio.Event()
+        self._done_reason = None
+        self._started = time.monotonic()
+        self._last = None
+
+    def start(self):
+        """Call once subscribed to notifications."""
+        self._started = time.monotonic()
+
+    def notified(self):
+        """Call on every notification."""
+        self.notifications += 1
+        self._last = time.monotonic()
+
+    def disconnected(self):
+        """Call when the device disconnects."""
+        self.done("disconnected")
+
+    def done(self, reason: str = "done"):
+        if self._done_reason is None:
+            self._done_reason = reason
+        self._done.set()
+
+    async def wait(self) -> str:
+        """Wait until done, idle or max_wait; returns the reason."""
+        deadline = self._started + self.max_wait
+        while True:
+            if self._done.is_set():
+                self.reason = self._done_reason
+                break
+            now = time.monotonic()
+            if now >= deadline:
+                self.reason = "max_wait"
+                break
+            if self._last is None:
+                # nothing received yet: only max_wait applies; look again in idle seconds
+                wake = now + self.idle
+            else:
+                wake = self._last + self.idle
+                if now >= wake:
+                    self.reason = "idle"
+                    break
+            try:
+                await asyncio.wait_for(
+                    self._done.wait(), min(deadline, wake) - now
+                )
+            except asyncio.TimeoutError:
+                pass
+        log.debug(
+            "Notifications done (%s): %s received in %.1fs",
+            self.reason,
+            self.notifications,
+            time.monotonic() - self._started,
+        )
+        return self.reason
@@ -1,11 +1,15 @@
+import os
 import sqlite3
-import json
 import logging
+import time
 from datetime import datetime
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Union
 
 from .devices_classes import BCMSDeviceInfoWithLastSeen
+from .sampling import downsample
 from .data_types import (
+    DATA_TYPES,
+    MAX_FIELDS,
     DataType,
     BatteryLevelData,
     HeartRateData,
@@ -18,31 +22,155 @@ from .data_types import (
 
 log = logging.getLogger(__name__)
 
+# Number of value columns; a data type has at most this many fields
+VALUE_COLUMNS = MAX_FIELDS
+_VALUE_COLUMN_NAMES = tuple(f"value_{i + 1}" for i in range(VALUE_COLUMNS))
+_VALUES = ", ".join(_VALUE_COLUMN_NAMES)
+_VALUE_PLACEHOLDERS = ", ".join("?" * VALUE_COLUMNS)
+_PADDING = tuple((None,) * (VALUE_COLUMNS - n) for n in range(VALUE_COLUMNS + 1))
+
 
 class BCMSDeviceDataDB:
-    def __init__(self):
-        self.conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+    """
+    Stores IoT data samples until they have been submitted
+    - batch_size=1 commits every sample right away
+    - batch_size>1 buffers samples and writes them with a single executemany,
+      once batch_size samples are pending or flush_interval seconds have passed
+    - reads and deletes always flush pending samples first
+
+    Samples are stored as type_id plus one value column per field (see DataType.fields).
+    Value columns have no declared type, so ints, floats and strings round-trip unchanged.
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        batch_size: int = 1,
+        flush_interval: float = 1.0,
+        max_rows: Union[int, None] = None,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.conn = None
+        self.open(path, max_rows)
+
+    def open(self, path: str = ":memory:", max_rows: Union[int, None] = None):
+        """
+        (Re-)open the store
+        - path=":memory:" keeps samples in memory only
+        - any other path is a file that survives restarts (WAL, synchronous=NORMAL)
+        - max_rows bounds the number of samples; the oldest are evicted first
+        """
+        if self.conn is not None:
+            self.close()
+
+        self.path = path
+        self.max_rows = max_rows
+        if self.persistent:
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+        if self.persistent:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
         self.conn.execute(
-            """
-            CREATE TABLE data (
+            f"""
+            CREATE TABLE IF NOT EXISTS data (
                 id INTEGER PRIMARY KEY,
-                type TEXT,
-                data TEXT,
+                type_id INTEGER NOT NULL,
                 address TEXT,
-                timestamp INTEGER
+                timestamp INTEGER,
+                {_VALUES}
             )
         """
         )
-
-    def add(self, data: DataType):
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS data_address_timestamp ON data (address, timestamp)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS data_timestamp ON data (timestamp)")
         self.conn.execute(
             """
-            INSERT INTO data (type, data, address, timestamp) VALUES (?, ?, ?, ?)
+            CREATE TABLE IF NOT EXISTS watermarks (
+                address TEXT PRIMARY KEY,
+                submitted_until INTEGER NOT NULL
+            )
+        """
+        )
+        self.conn.commit()
+        self.row_count = self.conn.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+        log.debug("Opened data store %s with %s entries", self.path, self.row_count)
+        # for ex. of a plugin that's no longer installed, or failed to load
+        for type_id, count in self.conn.execute(
+            f"SELECT type_id, COUNT(*) FROM data WHERE NOT {_known_types()} GROUP BY type_id"
+        ):
+            log.warning("Ignoring %s stored entries of unknown data type %s", count, type_id)
+        self._evict()
+
+    @property
+    def persistent(self) -> bool:
+        """Whether samples are kept on disk"""
+        return self.path != ":memory:"
+
+    def close(self):
+        """Flush pending samples and close the store"""
+        self.flush()
+        self.conn.close()
+        self.conn = None
+
+    def add(self, data: DataType):
+        self.add_many((data,))
+
+    def add_many(self, data: Iterable[DataType]):
+        """Add samples; written once batch_size is reached or flush_interval has passed"""
+        pending = self.pending
+        for d in data:
+            try:
+                values = d.values()
+            except KeyError as err:
+                log.error("Skipping %s sample of %s without field %s", d.name, d.address, err)
+                continue
+            pending.append(
+                (d.type_id, d.address, d.timestamp) + values + _PADDING[len(values)]
+            )
+        if (
+            len(self.pending) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write all pending samples in a single transaction"""
+        self.last_flush = time.monotonic()
+        if len(self.pending) == 0:
+            return
+        self.conn.executemany(
+            f"""
+            INSERT INTO data (type_id, address, timestamp, {_VALUES})
+            VALUES (?, ?, ?, {_VALUE_PLACEHOLDERS})
         """,
-            (type(data).__name__, json.dumps(data.data), data.address, data.timestamp),
+            self.pending,
         )
+        self.row_count += len(self.pending)
+        self.pending = []
+        self._evict()
         self.conn.commit()
 
+    def _evict(self):
+        """Evict the oldest samples, if there are more than max_rows"""
+        if self.max_rows is None or self.row_count <= self.max_rows:
+            return
+        excess = self.row_count - self.max_rows
+        cursor = self.conn.execute(
+            "DELETE FROM data WHERE id IN"
+            " (SELECT id FROM data ORDER BY timestamp, id LIMIT ?)",
+            (excess,),
+        )
+        self.row_count -= cursor.rowcount
+        self.conn.commit()
+        log.warning("Data store is full; evicted %s oldest entries", cursor.rowcount)
+
     def get(
         self,
         from_time: int = None,
@@ -50,139 +178,286 @@ class BCMSDeviceDataDB:
         device_address: str = None,
         limit: int = 50,
     ):
-        query = "SELECT * FROM data WHERE 1"
-        params = []
-        if from_time is not None:
-            query += " AND timestamp >= ?"
-            params.append(round(from_time))
-        if to_time is not None:
-            query += " AND timestamp <= ?"
-            params.append(round(to_time))
-        if device_address is not None:
-            query += " AND address = ?"
-            params.append(device_address)
-        query += " ORDER BY timestamp DESC LIMIT ?"
+        self.flush()
+        where, params = _where(from_time, to_time, device_address)
+        query = (
+            f"SELECT type_id, address, timestamp, {_VALUES}"
+            f" FROM data WHERE {where} ORDER BY timestamp DESC, id ASC LIMIT ?"
+        )
         params.append(limit)
         cursor = self.conn.execute(query, params)
 
-        data_objects = []
-        for row in cursor.fetchall():
-            id, type, data, address, timestamp = row
-            if type == "BatteryLevelData":
-                data_objects.append(
-                    BatteryLevelData(json.loads(data), address, timestamp)
-                )
-            elif type == "HeartRateData":
-                data_objects.append(HeartRateData(json.loads(data), address, timestamp))
-            elif type == "TemperatureData":
-                data_objects.append(
-                    TemperatureData(json.loads(data), address, timestamp)
-                )
-            elif type == "PressureData":
-                data_objects.append(PressureData(json.loads(data), address, timestamp))
-            elif type == "BloodPressureData":
-                data_objects.append(
-                    BloodPressureData(json.loads(data), address, timestamp)
+        return [_restore(row) for row in cursor]
+
+    def iter_window(
+        self,
+        from_time: int = None,
+        to_time: int = None,
+        device_address: str = None,
+        page_size: int = 500,
+    ) -> Iterator[DataType]:
+        """
+        Iterate over all samples in a window, in ascending timestamp order
+        - keyset pagination on (timestamp, id); at most page_size rows are held at a time
+        - unlike get(), there's no limit
+        """
+        self.flush()
+        where, params = _where(from_time, to_time, device_address)
+        query = (
+            f"SELECT type_id, address, timestamp, {_VALUES}, id"
+            f" FROM data WHERE {where}"
+        )
+        first_page = query + " ORDER BY timestamp, id LIMIT ?"
+        next_page = query + " AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?"
+
+        rows = self.conn.execute(first_page, params + [page_size]).fetchall()
+        while True:
+            for row in rows:
+                yield _restore(row)
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1][2], rows[-1][-1])
+            rows = self.conn.execute(
+                next_page, params + [*cursor, page_size]
+            ).fetchall()
+
+    def get_buckets(
+        self,
+        from_time: int = None,
+        to_time: int = None,
+        interval: int = 2,
+        strategy: str = "first",
+        device_address: str = None,
+        intervals: Union[Dict[str, int], None] = None,
+        windows: Union[Dict[str, Union[int, None]], None] = None,
+        limit: Union[int, None] = None,
+    ) -> List[DataType]:
+        """
+        Downsample a window in SQL; one sample per address, type and bucket of interval seconds
+        - strategy "first" / "last": the earliest / latest sample of each bucket;
+          of samples within the same second, any may be picked
+        - strategy "mean" / "min" / "max": each value column aggregated; non-numeric values
+          (for ex. alert ids) take the largest value; the timestamp is the bucket's earliest
+        - intervals overrides interval per data type name, for ex. {"heart_rate": 10}
+        - windows limits the query to these devices, each from its own from_time (None: no lower
+          bound), for ex. {"00:09:1F:8A:BC:21": 1700000000}; one query for all of them
+        - ascending timestamp order; limit: at most this many samples, the earliest. All samples
+          before the last one's timestamp are included, of that timestamp maybe not all
+        """
+        self.flush()
+        if windows is not None and len(windows) > _MAX_WINDOWS:
+            items = list(windows.items())
+            result = []
+            for i in range(0, len(items), _MAX_WINDOWS):
+                result.extend(
+                    self.get_buckets(
+                        from_time,
+                        to_time,
+                        interval,
+                        strategy,
+                        device_address,
+                        intervals,
+                        dict(items[i : i + _MAX_WINDOWS]),
+                        limit,
+                    )
                 )
-            elif type == "AlertData":
-                data_objects.append(AlertData(json.loads(data), address, timestamp))
-            else:
-                raise Exception(f"Unknown data type: {type}")
+            result.sort(key=lambda d: d.timestamp)
+            return result if limit is None else result[:limit]
 
-        return data_objects
+        with_windows = ""
+        source = "data"
+        if windows is not None:
+            if device_address is not None:
+                windows = {a: t for a, t in windows.items() if a == device_address}
+                device_address = None
+            if len(windows) == 0:
+                return []
+            # windows drive the join, so each device is one range scan of the address index
+            values = ", ".join("(?, ?)" for _ in windows)
+            with_windows = f"WITH windows(address, from_time) AS (VALUES {values}) "
+            source = (
+                "windows CROSS JOIN data ON data.address = windows.address"
+                " AND data.timestamp >= windows.from_time"
+            )
+            window_params = []
+            for address, window_from in windows.items():
+                # no lower bound; timestamps are never negative
+                window_params.extend([address, -1 if window_from is None else round(window_from)])
+        where, params = _where(from_time, to_time, device_address)
+        if windows is not None:
+            params = window_params + params
 
-    def clear_old_data(self, seconds: int):
+        bucket = "?"
+        bucket_params = [interval]
+        if intervals:
+            type_ids = {
+                data_type.name: type_id for type_id, data_type in DATA_TYPES.items()
+            }
+            bucket = "CASE type_id"
+            bucket_params = []
+            for name, seconds in intervals.items():
+                bucket += " WHEN ? THEN ?"
+                bucket_params.extend([type_ids[name], seconds])
+            bucket += " ELSE ? END"
+            bucket_params.append(interval)
+
+        if strategy in ("first", "last"):
+            timestamp = "MIN(timestamp)" if strategy == "first" else "MAX(timestamp)"
+            # SQLite takes bare columns from the row that holds the MIN() / MAX()
+            columns = f"{timestamp}, {_VALUES}"
+        elif strategy == "mean":
+            columns = "MIN(timestamp), " + ", ".join(
+                f"COALESCE(AVG(CASE WHEN typeof({column}) IN ('integer', 'real')"
+                f" THEN {column} END), MAX({column}))"
+                for column in _VALUE_COLUMN_NAMES
+            )
+        elif strategy in ("min", "max"):
+            columns = "MIN(timestamp), " + ", ".join(
+                f"{strategy.upper()}({column})" for column in _VALUE_COLUMN_NAMES
+            )
+        else:
+            raise ValueError(f"Unknown sampling strategy: {strategy}")
+
+        query = (
+            f"{with_windows}SELECT type_id, data.address, {columns} FROM {source} WHERE {where}"
+            f" GROUP BY data.address, type_id, timestamp / ({bucket}) ORDER BY 3"
+        )
+        params = params + bucket_params
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor = self.conn.execute(query, params)
+
+        return [_restore(row) for row in cursor]
+
+    def clear_old_data(self, seconds: int, keep_unsubmitted: bool = False):
+        """
+        Delete samples older than the given seconds
+        - keep_unsubmitted=True only deletes samples below their device's watermark;
+          samples of devices without one (not registered) are deleted by age
+        """
+        self.flush()
         current_time = int(datetime.now().timestamp())
         threshold_time = current_time - seconds
-        self.conn.execute("DELETE FROM data WHERE timestamp < ?", (threshold_time,))
+        query = "DELETE FROM data WHERE timestamp < ?"
+        params = (threshold_time,)
+        if keep_unsubmitted:
+            query += (
+                " AND timestamp < COALESCE((SELECT submitted_until FROM watermarks"
+                " WHERE watermarks.address = data.address), ?)"
+            )
+            params = (threshold_time, threshold_time)
+        cursor = self.conn.execute(query, params)
+        self.row_count -= cursor.rowcount
         self.conn.commit()
 
     def clear(self):
+        self.pending = []
         self.conn.execute("DELETE FROM data")
         self.conn.commit()
+        self.row_count = 0
+
+    def get_watermark(self, address: str) -> Union[int, None]:
+        """Timestamp up to which data of a device has been submitted"""
+        row = self.conn.execute(
+            "SELECT submitted_until FROM watermarks WHERE address = ?", (address,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_watermarks(self) -> Dict[str, int]:
+        """Timestamps up to which data has been submitted, by device address"""
+        return dict(self.conn.execute("SELECT address, submitted_until FROM watermarks"))
+
+    def set_watermarks(self, watermarks: Dict[str, int]):
+        """Record timestamps up to which data has been submitted, by device address"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO watermarks (address, submitted_until) VALUES (?, ?)",
+            [(address, round(timestamp)) for address, timestamp in watermarks.items()],
+        )
+        self.conn.commit()
+
+
+# Devices per windowed query; keeps parameters well below SQLite's limit
+_MAX_WINDOWS = 400
+
+
+def _where(from_time: int = None, to_time: int = None, device_address: str = None):
+    """Build the WHERE clause and parameters of a window query; only registered data types"""
+    where = _known_types()
+    params = []
+    if from_time is not None:
+        where += " AND timestamp >= ?"
+        params.append(round(from_time))
+    if to_time is not None:
+        where += " AND timestamp <= ?"
+        params.append(round(to_time))
+    if device_address is not None:
+        where += " AND address = ?"
+        params.append(device_address)
+    return where, params
+
+
+def _known_types() -> str:
+    """SQL condition on registered data types; rows of others can't be restored"""
+    return f"type_id IN ({', '.join(str(int(type_id)) for type_id in DATA_TYPES)})"
+
+
+def _restore(row: tuple) -> DataType:
+    """Restore a data type from a (type_id, address, timestamp, *values) row"""
+    type_id, address, timestamp = row[0], row[1], row[2]
+    data_type = DATA_TYPES.get(type_id)
+    if data_type is None:
+        raise Exception(f"Unknown data type: {type_id}")
+    return data_type.from_values(row[3 : 3 + VALUE_COLUMNS], address, timestamp)
 
 
 def dump_iot_data_for_api_submission(
-    input_data: List[DataType], registered_devices: list[BCMSDeviceInfoWithLastSeen]
+    input_data: Iterable[DataType], registered_devices: list[BCMSDeviceInfoWithLastSeen]
 ):
-    registered_addresses = [d.address for d in registered_devices]
+    """
+    Group data by device and type, in the API submission format
+    - data of unregistered devices is skipped
+    - single pass; devices are looked up by address, in a dict built once per call
+    """
+    device_ids = {}
+    for d in registered_devices:
+        device_ids.setdefault(d.address, d.id)
 
-    # sort data by device
+    # address -> type name -> samples
     data_by_device = {}
+    skipped = set()
     for d in input_data:
-        # check if address is registered
-        if d.address not in registered_addresses:
-            log.debug("Skipping unregistered device %s", d.address)
-            continue
-
-        if d.address not in data_by_device:
-            data_by_device[d.address] = []
-        data_by_device[d.address].append(d)
-
-    # sort data by device and type
-    data_by_device_and_type = []
-
-    # loop through data by device
-    for address, data in data_by_device.items():
-        # get device ID for later assignment
-        device_id = None
-        for d in registered_devices:
-            if d.address == address:
-                device_id = d.id
-                break
-
-        data_by_type = {}
-        for d in data:
-            if d.name not in data_by_type:
-                data_by_type[d.name] = []
+        data_by_type = data_by_device.get(d.address)
+        if data_by_type is None:
+            # check if address is registered
+            if d.address not in device_ids:
+                if d.address not in skipped:
+                    log.debug("Skipping unregistered device %s", d.address)
+                    skipped.add(d.address)
+                continue
+            data_by_type = data_by_device[d.address] = {}
 
-            data_by_type[d.name].append({"timestamp": d.timestamp, "data": d.data})
-        for type, data in data_by_type.items():
-            data_by_device_and_type.append(
-                {"iotDeviceId": device_id, "dataType": type, "data": data}
-            )
+        data = data_by_type.get(d.name)
+        if data is None:
+            data = data_by_type[d.name] = []
+        data.append({"timestamp": d.timestamp, "data": d.data})
 
-    return data_by_device_and_type
+    return [
+        {"iotDeviceId": device_ids[address], "dataType": type, "data": data}
+        for address, data_by_type in data_by_device.items()
+        for type, data in data_by_type.items()
+    ]
 
 
 def limit_iot_data_sample_rate(
-    data: List[DataType], samples_every_seconds=2
+    data: Iterable[DataType],
+    samples_every_seconds=2,
+    strategy="gap",
+    intervals: Union[Dict[str, int], None] = None,
 ) -> List[DataType]:
     """
     Limit the number of samples per second, per type and address
     - for ex. samples_every_seconds=2 means that only one sample per type and address, every 2 seconds, will be kept
+    - see sampling.downsample for strategies and per-type intervals
     """
-    if len(data) == 0:
-        return data
-
-    # sort data by device
-    data_by_device = {}
-    for d in data:
-        if d.address not in data_by_device:
-            data_by_device[d.address] = []
-        data_by_device[d.address].append(d)
-
-    # sort data by device and type
-    data_by_device_and_type = {}
-    for address, data in data_by_device.items():
-        data_by_type = {}
-        for d in data:
-            if d.__class__.__name__ not in data_by_type:
-                data_by_type[d.__class__.__name__] = []
-            data_by_type[d.__class__.__name__].append(d)
-        data_by_device_and_type[address] = data_by_type
-
-    # filter data
-    filtered_data = []
-    for address, data_by_type in data_by_device_and_type.items():
-        for type, data in data_by_type.items():
-            last_timestamp = None
-            for d in data:
-                if (
-                    last_timestamp is None
-                    or d.timestamp - last_timestamp > samples_every_seconds
-                ):
-                    filtered_data.append(d)
-                    last_timestamp = d.timestamp
-
-    return filtered_data
+    return downsample(data, samples_every_seconds, strategy, intervals)
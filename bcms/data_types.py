@@ -1,5 +1,20 @@
 """Data types related to collection and submission"""
 
+import logging
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+from typing import Any, Callable, Dict, Type, Union
+
+from .codecs import decode_signed, decode_unsigned, decode_utf8, normalize_uuid
+
+
+log = logging.getLogger(__name__)
+
+# Entry point group of plugins that register data types
+PLUGINS_ENTRY_POINT_GROUP = "bcms.data_types"
+# Number of values a data type can store; see DataType.fields
+MAX_FIELDS = 3
+
 
 class DataType:
     """Generic type"""
@@ -8,6 +23,11 @@ class DataType:
     timestamp: int
     name: str
 
+    """type_id: stable integer id, used as storage key"""
+    type_id: int
+    """fields: keys of data, in storage order"""
+    fields: tuple = ()
+
     def __init__(self, data: dict, address: str, timestamp: int, name: str):
         self.data = data
         self.address = address
@@ -15,44 +35,123 @@ class DataType:
         """name of the data type"""
         self.name = name
 
+    def values(self) -> tuple:
+        """Field values, in storage order"""
+        return tuple(self.data[field] for field in self.fields)
+
+    @classmethod
+    def from_values(cls, values, address: str, timestamp: int) -> "DataType":
+        """Restore from field values, in storage order"""
+        return cls(dict(zip(cls.fields, values)), address, timestamp)
+
+
+@dataclass(frozen=True)
+class AdvertisementDecoder:
+    """Decodes the advertised service data of one UUID into a data type"""
+
+    decode: Callable[[bytes], Any]
+    data_type: Type[DataType]
+    """field: data key the decoded value is stored as; None: decode returns the data dict"""
+    field: Union[str, None]
+
+
+# Data type classes by type_id
+DATA_TYPES: Dict[int, Type[DataType]] = {}
+# Advertisement decoders by full, lower-case service UUID
+ADVERTISEMENT_DECODERS: Dict[str, AdvertisementDecoder] = {}
+
+
+def register_data_type(
+    type_id: int,
+    name: str,
+    fields: tuple,
+    uuid: Union[str, None] = None,
+    decode: Union[Callable[[bytes], Any], None] = None,
+):
+    """
+    Class decorator; registers a data type with the store, advertisement decoding and submission
+    - type_id: stable storage id; never reuse one. Plugins should use 1000 and up
+    - name: type name, as submitted to the API
+    - fields: data keys, in storage order; at most MAX_FIELDS
+    - uuid, decode: advertised service UUID (short forms like "2a37" are fine) and the
+      function that decodes its service data; with one field, the value is stored as it,
+      with more, decode returns a dict with every field
+    """
+    if len(fields) == 0 or len(fields) > MAX_FIELDS:
+        raise ValueError(f"Data type {name} needs 1 to {MAX_FIELDS} fields")
+    if (uuid is None) != (decode is None):
+        raise ValueError(f"Data type {name} needs both uuid and decode, or neither")
+
+    def register(data_type: Type[DataType]) -> Type[DataType]:
+        if type_id in DATA_TYPES:
+            raise ValueError(
+                f"Data type id {type_id} of {name} is taken by {DATA_TYPES[type_id].name}"
+            )
+        data_type.type_id = type_id
+        data_type.name = name
+        data_type.fields = tuple(fields)
+        DATA_TYPES[type_id] = data_type
+        if uuid is not None:
+            ADVERTISEMENT_DECODERS[normalize_uuid(uuid)] = AdvertisementDecoder(
+                decode, data_type, fields[0] if len(fields) == 1 else None
+            )
+        return data_type
+
+    return register
+
+
+def load_plugins():
+    """Import modules registered under the bcms.data_types entry point group"""
+    for entry_point in entry_points(group=PLUGINS_ENTRY_POINT_GROUP):
+        try:
+            entry_point.load()
+            log.info("Loaded data type plugin %s", entry_point.name)
+        except Exception as err:
+            log.error("Failed to load data type plugin %s: %s", entry_point.name, err)
+
 
+@register_data_type(1, "battery_level", ("level",), uuid="180f", decode=decode_signed)
 class BatteryLevelData(DataType):
     """Battery level data type"""
 
     def __init__(self, data: dict, address: str, timestamp: int):
-        super().__init__(data, address, timestamp, "battery_level")
+        super().__init__(data, address, timestamp, self.name)
         self.level = data["level"]
 
 
+@register_data_type(2, "heart_rate", ("rate",), uuid="2a37", decode=decode_signed)
 class HeartRateData(DataType):
     """Heart rate data type"""
 
     def __init__(self, data: dict, address: str, timestamp: int):
-        super().__init__(data, address, timestamp, "heart_rate")
+        super().__init__(data, address, timestamp, self.name)
         self.rate = data["rate"]
 
 
+@register_data_type(3, "temperature", ("level",), uuid="2a6e", decode=decode_signed)
 class TemperatureData(DataType):
     """Temperature data type"""
 
     def __init__(self, data: dict, address: str, timestamp: int):
-        super().__init__(data, address, timestamp, "temperature")
+        super().__init__(data, address, timestamp, self.name)
         self.level = data["level"]
 
 
+@register_data_type(4, "pressure", ("level",), uuid="2a6d", decode=decode_unsigned)
 class PressureData(DataType):
     """Pressure data type"""
 
     def __init__(self, data: dict, address: str, timestamp: int):
-        super().__init__(data, address, timestamp, "pressure")
+        super().__init__(data, address, timestamp, self.name)
         self.level = data["level"]
 
 
+@register_data_type(5, "blood_pressure", ("sys", "dias"))
 class BloodPressureData(DataType):
     """Blood pressure data type"""
 
     def __init__(self, data: dict, address: str, timestamp: int):
-        super().__init__(data, address, timestamp, "blood_pressure")
+        super().__init__(data, address, timestamp, self.name)
         self.sys = data["sys"]
         self.dias = data["dias"]
 
@@ -67,17 +166,19 @@ class BloodPressureData(DataType):
         return False
 
 
+@register_data_type(6, "humidity", ("level",), uuid="2a6f", decode=decode_unsigned)
 class HumidityData(DataType):
     """Humidity data type"""
 
     def __init__(self, data: dict, address: str, timestamp: int):
-        super().__init__(data, address, timestamp, "humidity")
+        super().__init__(data, address, timestamp, self.name)
         self.level = data["level"]
 
 
+@register_data_type(7, "alert", ("id",), uuid="2a46", decode=decode_utf8)
 class AlertData(DataType):
     """Alert data type"""
 
     def __init__(self, data: dict, address: str, timestamp: int):
-        super().__init__(data, address, timestamp, "alert")
+        super().__init__(data, address, timestamp, self.name)
         self.id = data["id"]
@@ -5,9 +5,10 @@ import os
 import json
 import time
 import logging
-from typing import List, Union
+from typing import Dict, List, Union
 
 from .config import KNOWN_DEVICES_FILE
+from .file_writer import DebouncedJSONWriter
 from .devices_classes import BCMSDeviceInfo, BCMSDeviceInfoWithLastSeen
 
 
@@ -15,14 +16,27 @@ log = logging.getLogger(__name__)
 
 
 class BCMDeviceMemory:
-    """Tracks devices that have been approved or paired with the BCM service."""
-
-    devices: List[BCMSDeviceInfoWithLastSeen]
-
-    def __init__(self, file_path=KNOWN_DEVICES_FILE, skip_load=False):
-        self.devices = []
+    """
+    Tracks devices that have been approved or paired with the BCM service.
+    - devices are indexed by address, in insertion order
+    - registered, and approved or paired devices are kept as separate views
+    """
+
+    _devices: Dict[str, BCMSDeviceInfoWithLastSeen]
+    _registered: Dict[str, BCMSDeviceInfoWithLastSeen]
+    _approved_or_paired: Dict[str, BCMSDeviceInfoWithLastSeen]
+
+    def __init__(self, file_path=KNOWN_DEVICES_FILE, skip_load=False, save_interval=0):
+        """save_interval: seconds to coalesce saves for; 0 saves right away"""
+        self._devices = {}
+        self._registered = {}
+        self._approved_or_paired = {}
         self.skip_load = skip_load
         self.filepath = os.path.expanduser(file_path)
+        self.writer = DebouncedJSONWriter(self.filepath, self._dump, save_interval)
+        """updates_applied / updates_skipped: updates that changed a field / changed nothing"""
+        self.updates_applied = 0
+        self.updates_skipped = 0
         self.load()
 
     def load(self):
@@ -56,9 +70,7 @@ class BCMDeviceMemory:
                     is_legacy = True
 
                 for device in data:
-                    self.devices.append(
-                        BCMSDeviceInfoWithLastSeen(**device, last_seen=None)
-                    )
+                    self._insert(BCMSDeviceInfoWithLastSeen(**device, last_seen=None))
 
                 if is_legacy:
                     self.save()
@@ -66,40 +78,68 @@ class BCMDeviceMemory:
             pass
 
     def save(self):
-        """Save devices to file."""
+        """Save devices to file; see save_interval."""
         if self.skip_load:
             log.debug("Skipping save of devices memory")
             return
 
-        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
-        with open(self.filepath, "w", encoding="utf-8") as file:
-            data = []
-            for device in self.devices:
-                if device.paired or device.approved:
-                    log.debug("Saving device %s", device.address)
-                    data.append(
-                        dataclasses.asdict(
-                            BCMSDeviceInfo(
-                                address=device.address,
-                                name=device.name,
-                                approved=device.approved,
-                                paired=device.paired,
-                                id=device.id,
-                                is_registered=device.is_registered,
-                            )
+        self.writer.schedule()
+
+    def flush(self):
+        """Write pending changes to file now."""
+        if self.skip_load:
+            return
+
+        self.writer.flush()
+
+    def _dump(self) -> list:
+        """Approved or paired devices, as saved to file."""
+        data = []
+        for device in self._devices.values():
+            if device.paired or device.approved:
+                log.debug("Saving device %s", device.address)
+                data.append(
+                    dataclasses.asdict(
+                        BCMSDeviceInfo(
+                            address=device.address,
+                            name=device.name,
+                            approved=device.approved,
+                            paired=device.paired,
+                            id=device.id,
+                            is_registered=device.is_registered,
                         )
                     )
-                else:
-                    log.debug("Skipping device %s", device.address)
-
-            json.dump(data, file)
+                )
+            else:
+                log.debug("Skipping device %s", device.address)
+
+        return data
+
+    @property
+    def devices(self) -> List[BCMSDeviceInfoWithLastSeen]:
+        """All devices, in insertion order"""
+        return list(self._devices.values())
+
+    def _insert(self, device: BCMSDeviceInfoWithLastSeen):
+        """Add device to the index and views; moves an existing address to the end."""
+        address = device.address
+        self._devices.pop(address, None)
+        self._devices[address] = device
+        self._index_views(device)
+
+    def _index_views(self, device: BCMSDeviceInfoWithLastSeen):
+        """Add device to, or drop it from, the registered and approved or paired views."""
+        address = device.address
+        self._registered.pop(address, None)
+        self._approved_or_paired.pop(address, None)
+        if device.is_registered:
+            self._registered[address] = device
+        if device.approved or device.paired:
+            self._approved_or_paired[address] = device
 
     def exists(self, address) -> bool:
         """Check if device exists in memory."""
-        for device in self.devices:
-            if device.address == address:
-                return True
-        return False
+        return address in self._devices
 
     def add(self, device: BCMSDeviceInfo):
         """Add device to memory."""
@@ -112,40 +152,76 @@ class BCMDeviceMemory:
     ):
         """Replace device in memory and save."""
         log.debug("= Device %s, %s", device.name, device.address)
-        exists = self.get(device.address)
-        if exists:
-            self.remove(device.address)
-        self.devices.append(
+        exists = self._devices.get(device.address)
+        self._insert(
             BCMSDeviceInfoWithLastSeen(
                 *device.__dict__.values(),
                 last_seen=round(time.time()),
                 last_checked_timestamp=round(time.time()),
             )
         )
-        if device.paired or device.approved:
+        if exists is not None and exists.device_info() == device:
+            # nothing changed that would be saved
+            self.updates_skipped += 1
+            return
+        self.updates_applied += 1
+        was_saved = exists is not None and (exists.paired or exists.approved)
+        if device.paired or device.approved or was_saved:
             self.save()
 
+    def update(self, address: str, **fields) -> bool:
+        """
+        Update fields of a device in memory, and save if anything changed.
+        - always updates last seen time
+        - returns True if any field changed
+        """
+        device = self._devices.get(address)
+        if device is None:
+            return False
+
+        device.last_seen = round(time.time())
+        changed = {k: v for k, v in fields.items() if getattr(device, k) != v}
+        if not changed:
+            self.updates_skipped += 1
+            return False
+
+        log.debug("~ Device %s: %s", address, changed)
+        was_saved = device.paired or device.approved
+        for key, value in changed.items():
+            setattr(device, key, value)
+        self._index_views(device)
+        self.updates_applied += 1
+        if device.paired or device.approved or was_saved:
+            self.save()
+        return True
+
+    def mark_paired(self, address: str):
+        """Mark device as approved and paired, without saving; for ex. when paired on the OS."""
+        device = self._devices.get(address)
+        if device:
+            device.approved = True
+            device.paired = True
+            self._index_views(device)
+
     def update_last_seen(self, address: str):
         """Update last seen time for device."""
-        device = self.get(address)
+        device = self._devices.get(address)
         if device:
             device.last_seen = round(time.time())
 
     def remove(self, address: str):
         """Remove device from memory and save."""
-        exists = self.get(address)
+        exists = self._devices.pop(address, None)
         if exists:
-            self.devices = [x for x in self.devices if x.address != address]
+            self._registered.pop(address, None)
+            self._approved_or_paired.pop(address, None)
 
             if exists.paired or exists.approved:
                 self.save()
 
     def get(self, address: str) -> Union[BCMSDeviceInfoWithLastSeen, None]:
         """Get device from memory."""
-        for device in self.devices:
-            if device.address == address:
-                return device
-        return None
+        return self._devices.get(address)
 
     def get_all(self) -> list[BCMSDeviceInfoWithLastSeen]:
         """Get all devices from memory."""
@@ -153,10 +229,10 @@ class BCMDeviceMemory:
 
     def get_registered(self) -> list[BCMSDeviceInfoWithLastSeen]:
         """Get all registered devices from memory."""
-        return [x for x in self.devices if x.is_registered]
+        return list(self._registered.values())
 
     def get_approved_or_paired(
         self,
     ) -> list[BCMSDeviceInfoWithLastSeen]:
         """Get all approved or paired devices from memory."""
-        return [x for x in self.devices if (x.approved or x.paired)]
+        return list(self._approved_or_paired.values())
@@ -0,0 +1,117 @@
+"""Module to write JSON files atomically, and to coalesce frequent writes"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Callable
+
+
+log = logging.getLogger(__name__)
+
+
+def write_json_atomic(path: str, data: Any):
+    """Write JSON to a temporary file next to path, then move it in place."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DebouncedJSONWriter:
+    """
+    Coalesces writes of a JSON file
+    - schedule() marks the file dirty; it's written once, interval seconds later
+    - the snapshot is taken on the event loop; the write happens in the default executor
+    - with interval=0, or without a running event loop, schedule() writes right away
+    - unchanged snapshots are not written again
+    - flush() writes pending changes now; call it on shutdown
+    """
+
+    def __init__(self, path: str, snapshot: Callable[[], Any], interval: float = 0):
+        self.path = path
+        self.snapshot = snapshot
+        self.interval = interval
+        """writes: number of times the file has been written"""
+        self.writes = 0
+        self._dirty = False
+        self._handle = None
+        self._last_snapshot = None
+        self._sequence = 0
+        self._written_sequence = 0
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        """Mark the file dirty, and write it once the interval has passed."""
+        self._dirty = True
+        if self.interval <= 0:
+            self.flush()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._handle is None:
+            self._handle = loop.call_later(self.interval, self._write_behind, loop)
+
+    def flush(self):
+        """Write pending changes now."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        taken = self._take()
+        if taken is not None:
+            self._write(*taken)
+
+    def _take(self):
+        """Snapshot dirty state; None if there's nothing new to write."""
+        if not self._dirty:
+            return None
+        self._dirty = False
+        data = self.snapshot()
+        if data == self._last_snapshot:
+            return None
+        self._last_snapshot = data
+        self._sequence += 1
+        return self._sequence, data
+
+    def _write(self, sequence: int, data: Any):
+        with self._lock:
+            # an older snapshot must not replace a newer one
+            if sequence <= self._written_sequence:
+                return
+            write_json_atomic(self.path, data)
+            self._written_sequence = sequence
+            self.writes += 1
+
+    def _write_behind(self, loop: asyncio.AbstractEventLoop):
+        self._handle = None
+        taken = self._take()
+        if taken is None:
+            return
+        future = loop.run_in_executor(None, self._write, *taken)
+        future.add_done_callback(self._written)
+
+    def _written(self, future: asyncio.Future):
+        if future.cancelled():
+            return
+        err = future.exception()
+        if err is not None:
+            log.error("Failed to write %s: %s", self.path, err)
+            # try again with the next change, or on flush
+            self._last_snapshot = None
+            self._dirty = True
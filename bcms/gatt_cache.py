@@ -0,0 +1,89 @@
+"""Module to remember, per device, where the characteristics we use are"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Tuple, Union
+
+from .config import SUPPORTED_DEVICES
+
+
+log = logging.getLogger(__name__)
+
+# Characteristics used during a session
+DATE_TIME_UUID = "00002a08-0000-1000-8000-00805f9b34fb"
+BLOOD_PRESSURE_MEASUREMENT_UUID = "00002a35-0000-1000-8000-00805f9b34fb"
+CHARACTERISTIC_UUIDS = (DATE_TIME_UUID, BLOOD_PRESSURE_MEASUREMENT_UUID)
+
+
+@dataclass
+class GattProfile:
+    """Resolved characteristics of one device"""
+
+    """services: UUIDs of the services holding the characteristics; to limit discovery on reconnect"""
+    services: List[str] = field(default_factory=list)
+    """handles: characteristic UUID -> handle"""
+    handles: Dict[str, int] = field(default_factory=dict)
+    """properties: characteristic UUID -> properties, like read, write, indicate"""
+    properties: Dict[str, List[str]] = field(default_factory=dict)
+
+    @classmethod
+    def discover(cls, services: Iterable) -> "GattProfile":
+        """Walk discovered services (bleak's client.services) once."""
+        profile = cls()
+        for service in services:
+            for char in service.characteristics:
+                if char.uuid not in CHARACTERISTIC_UUIDS or char.uuid in profile.handles:
+                    continue
+                profile.handles[char.uuid] = char.handle
+                profile.properties[char.uuid] = list(char.properties)
+                if service.uuid not in profile.services:
+                    profile.services.append(service.uuid)
+        return profile
+
+    def has(self, uuid: str, capability: Union[str, None] = None) -> bool:
+        if uuid not in self.handles:
+            return False
+        return capability is None or capability in self.properties[uuid]
+
+
+def device_model(name: Union[str, None]) -> Union[str, None]:
+    """Model prefix from SUPPORTED_DEVICES, or None."""
+    if name is None:
+        return None
+    for supported in SUPPORTED_DEVICES:
+        if name.startswith(supported):
+            return supported
+    return None
+
+
+class GattCache:
+    """
+    Resolved characteristics by device address and model
+    - a device that reports a different model is discovered again
+    - invalidate() on failure; the next connection walks the services again
+    """
+
+    def __init__(self):
+        self._profiles: Dict[Tuple[str, Union[str, None]], GattProfile] = {}
+        """hits / misses: lookups that could / couldn't skip discovery"""
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, address: str, name: Union[str, None]) -> Union[GattProfile, None]:
+        profile = self._profiles.get((address, device_model(name)))
+        if profile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return profile
+
+    def put(self, address: str, name: Union[str, None], profile: GattProfile):
+        self.invalidate(address)
+        self._profiles[(address, device_model(name))] = profile
+
+    def invalidate(self, address: str):
+        for key in [key for key in self._profiles if key[0] == address]:
+            del self._profiles[key]
+
+    def __len__(self):
+        return len(self._profiles)
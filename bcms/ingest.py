@@ -0,0 +1,73 @@
+"""Module to buffer collected data between the BLE callbacks and the data store"""
+
+import logging
+from collections import deque
+from typing import List, Union
+
+from .data_types import DataType
+
+
+log = logging.getLogger(__name__)
+
+
+class IngestBuffer:
+    """
+    Bounded buffer between the BLE callbacks and the data store
+    - put() is cheap and never blocks; when full, the oldest or the newest sample is dropped
+    - drain() takes samples in arrival order, for a batched write to the store
+    """
+
+    def __init__(self, maxlen: int = 10000, drop: str = "oldest"):
+        if drop not in ("oldest", "newest"):
+            raise ValueError(f"Unknown drop policy: {drop}")
+        self.maxlen = maxlen
+        self.drop = drop
+        self.queue = deque()
+        """accepted / dropped / drained: number of samples; high_watermark: largest backlog"""
+        self.accepted = 0
+        self.dropped = 0
+        self.drained = 0
+        self.high_watermark = 0
+
+    def put(self, data: DataType) -> bool:
+        """Add a sample; returns False if a sample had to be dropped."""
+        queue = self.queue
+        if len(queue) >= self.maxlen:
+            self.dropped += 1
+            if self.drop == "newest":
+                return False
+            queue.popleft()
+            queue.append(data)
+            self.accepted += 1
+            return False
+
+        queue.append(data)
+        self.accepted += 1
+        if len(queue) > self.high_watermark:
+            self.high_watermark = len(queue)
+        return True
+
+    def drain(self, batch_size: Union[int, None] = None) -> List[DataType]:
+        """Take up to batch_size samples, or all of them, in arrival order."""
+        queue = self.queue
+        if batch_size is None or batch_size >= len(queue):
+            batch = list(queue)
+            queue.clear()
+        else:
+            popleft = queue.popleft
+            batch = [popleft() for _ in range(batch_size)]
+        self.drained += len(batch)
+        return batch
+
+    def stats(self) -> dict:
+        """Counters, for logging"""
+        return {
+            "pending": len(self.queue),
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "drained": self.drained,
+            "high_watermark": self.high_watermark,
+        }
+
+    def __len__(self):
+        return len(self.queue)
@@ -2,6 +2,7 @@
 
 import asyncio
 import getpass
+import signal
 import time
 import socket
 import logging
@@ -12,7 +13,6 @@ from bleak import BleakScanner
 from px_python_shared import send_alert
 from px_device_identity import Device
 from bcms.api import BackendAPI
-from bcms.data_store import limit_iot_data_sample_rate
 from . import log as _log
 from .cli import parse_cli_params
 from .config import (
@@ -20,19 +20,46 @@ from .config import (
     RPC_PORT,
     SUPPORTED_DEVICES,
     BLUETOOTH_SCAN_INTERVAL,
+    BLUETOOTH_SCAN_MODE,
+    GATT_CONNECTION_LIMIT,
+    GATT_SESSION_TIMEOUT,
+    GATT_CIRCUIT_BREAKER_THRESHOLD,
+    GATT_CIRCUIT_BREAKER_COOLDOWN,
     CLEAR_IOT_DATA_CACHE_INTERVAL,
     DATA_SUBMISSION_INTERVAL,
+    DATA_SAMPLE_INTERVAL,
+    DATA_SAMPLE_STRATEGY,
+    INGEST_BATCH_SIZE,
+    INGEST_INTERVAL,
+    WATERMARK_LOOKUP_CONCURRENCY,
+    SUBMISSION_MAX_SAMPLES,
+    SUBMISSION_MAX_BYTES,
+    SUBMISSION_MAX_IN_FLIGHT,
+    SUBMISSION_MAX_CYCLE_SAMPLES,
+    SUBMISSION_COMPRESSION,
 )
 from .devices_classes import BCMSDeviceInfo
 from .data_types import (
     DataType,
+    load_plugins,
 )
 from .data_store import dump_iot_data_for_api_submission
-from .ble_utils import process_supported_device, iot_advertisement_data_callback_wrapper
+from .advertisement import AdvertisementRate
+from .connections import ConnectionScheduler
+from .submission import SubmissionPipeline
+from .retry import CircuitBreaker
+from .ble_utils import (
+    default_retry_policy,
+    process_supported_device,
+    iot_advertisement_data_callback_wrapper,
+)
 from .rpc_server import new_rpc_connection
 from .bootstrap import (
     devices_mem,
     devices_data,
+    ingest_buffer,
+    gatt_cache,
+    clock_drift,
     async_queue,
     pair_device,
     unpair_device,
@@ -46,7 +73,10 @@ class BCMS:
     notify = False
     username = None
     sleep = BLUETOOTH_SCAN_INTERVAL
+    scan_mode = BLUETOOTH_SCAN_MODE
+    connection_limit = GATT_CONNECTION_LIMIT
     sleep_data = DATA_SUBMISSION_INTERVAL
+    submission_compression = SUBMISSION_COMPRESSION
 
     def __init__(
         self,
@@ -55,12 +85,28 @@ class BCMS:
         username=None,
         sleep=BLUETOOTH_SCAN_INTERVAL,
         sleep_data=DATA_SUBMISSION_INTERVAL,
+        scan_mode=BLUETOOTH_SCAN_MODE,
+        connection_limit=GATT_CONNECTION_LIMIT,
+        submission_compression=SUBMISSION_COMPRESSION,
     ):
-        self.backend_api = BackendAPI(application_identifier)
+        self.backend_api = BackendAPI(
+            application_identifier, compression=submission_compression
+        )
         self.notify = notify
         self.username = username
         self.sleep = sleep
+        self.scan_mode = scan_mode
+        self.connection_limit = connection_limit
         self.sleep_data = sleep_data
+        self.submission_compression = submission_compression
+        # tasks started from callbacks; referenced until done
+        self.background_tasks = set()
+        self.submission = SubmissionPipeline(
+            self.backend_api.submit_encoded_iot_data,
+            max_samples=SUBMISSION_MAX_SAMPLES,
+            max_bytes=SUBMISSION_MAX_BYTES,
+            max_in_flight=SUBMISSION_MAX_IN_FLIGHT,
+        )
         
         if application_identifier:
             self.backend_api.ready_api()
@@ -72,41 +118,66 @@ class BCMS:
 
         await asyncio.gather(
             self.device_discovery_loop(notify_callback, self.sleep),
+            self.ingest_loop(),
             self.cache_clear_old_data_loop(),
             self.rpc_server_loop(),
             self.api_data_submission_loop(self.sleep_data),
             self.register_devices_loop(),
         )
+
+    async def run(self):
+        """Run until SIGTERM / SIGINT; returns normally, so the caller can flush and close"""
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        stopping = []
+
+        def stop(signum: int):
+            log.info("Received %s; stopping", signal.Signals(signum).name)
+            stopping.append(signum)
+            task.cancel()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop, signum)
+        try:
+            await self.start()
+        except asyncio.CancelledError:
+            if not stopping:
+                raise
+        finally:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
     
 
     async def device_discovery_loop(
         self, notify_callback, scan_interval: int
     ):
-        """Discover devices and store BLE data"""
+        """
+        Discover devices and store BLE data
+        - cycle: start a scanner, scan for scan_interval, stop it, then connect to paired devices
+        - continuous: keep one scanner running; every scan_interval, connect to paired devices seen since
+        """
+        advertisements = AdvertisementRate()
+        connections = ConnectionScheduler(self.connection_limit, GATT_SESSION_TIMEOUT)
+        circuit_breaker = CircuitBreaker(
+            GATT_CIRCUIT_BREAKER_THRESHOLD, GATT_CIRCUIT_BREAKER_COOLDOWN
+        )
+        # Paired devices seen since the last connection round, by address
+        seen_paired = {}
 
         def store_data(data: DataType):
             """If device exists in memory, store data"""
             if devices_mem.exists(data.address):
-                devices_data.add(data)
+                ingest_buffer.put(data)
 
         def track_device(device: BLEDevice):
             """If device is known, update last seen time, otherwise add it to memory"""
-            exists_mem = devices_mem.get(device.address)
-            if exists_mem is not None and exists_mem.name is not device.name:
-                # Update device name if it has changed
-                devices_mem.replace(
-                    BCMSDeviceInfo(
-                        address=device.address,
-                        name=device.name,
-                        approved=exists_mem.approved,
-                        paired=exists_mem.paired,
-                        id=exists_mem.id,
-                        is_registered=exists_mem.is_registered,
-                    )
-                )
-            elif exists_mem is not None:
-                # Update last seen time if device is already known
-                devices_mem.update_last_seen(device.address)
+            advertisements.hit()
+            in_memory = devices_mem.get(device.address)
+            if in_memory:
+                # Update last seen time, and device name only if it has changed
+                devices_mem.update(device.address, name=device.name)
+                if in_memory.paired is True:
+                    seen_paired[device.address] = device
             else:
                 devices_mem.add(
                     BCMSDeviceInfo(
@@ -121,6 +192,9 @@ class BCMS:
             """Connect to device to update time and retrieve data"""
             for supported in SUPPORTED_DEVICES:
                 if device.name.startswith(supported):
+                    if not circuit_breaker.allow(device.address):
+                        log.debug("=> Skipping %s after repeated failures", device)
+                        break
                     log.debug("=> Connecting to %s", device)
                     notify_callback("Connecting", f"Connecting to {device.name}", 10000)
                     try:
@@ -128,8 +202,16 @@ class BCMS:
                             device,
                             notify_callback=notify_callback,
                             store_data_callback=store_data,
+                            gatt_cache=gatt_cache,
+                            clock_model=clock_drift,
                         )
+                        circuit_breaker.success(device.address)
+                    except asyncio.CancelledError:
+                        # timed out by the connection scheduler (or shutting down)
+                        circuit_breaker.failure(device.address)
+                        raise
                     except Exception as err:
+                        circuit_breaker.failure(device.address)
                         log.error("Failed with error on %s: %s", device.name, err)
                         if notify_callback:
                             notify_callback(
@@ -137,30 +219,94 @@ class BCMS:
                             )
                     break
 
-        while True:
-            scanner = BleakScanner(
-                detection_callback=iot_advertisement_data_callback_wrapper(
-                    store_data_callback=store_data, track_device_callback=track_device
-                )
+        def log_scan_stats():
+            log.debug(
+                "   Advertisements: %.1f/s (%s mode, %s total); device updates: %s applied, %s skipped",
+                advertisements.rate(),
+                self.scan_mode,
+                advertisements.count,
+                devices_mem.updates_applied,
+                devices_mem.updates_skipped,
+            )
+
+        async def connect_seen_paired():
+            """Connect to paired devices seen since the last round; several at once"""
+            if len(seen_paired) == 0:
+                return
+            devices = list(seen_paired.values())
+            seen_paired.clear()
+            await connections.run_all(
+                {device.address: (lambda d=device: connect_device(d)) for device in devices}
+            )
+            log.debug(
+                "   GATT sessions: %s; retries: %s; skipped devices: %s; cached profiles: %s hits, %s misses; clock checks: %s",
+                connections.report(),
+                default_retry_policy.stats(),
+                circuit_breaker.stats(),
+                gatt_cache.hits,
+                gatt_cache.misses,
+                clock_drift.stats(),
             )
 
+        detection_callback = iot_advertisement_data_callback_wrapper(
+            store_data_callback=store_data, track_device_callback=track_device
+        )
+
+        if self.scan_mode == "continuous":
+            scanner = BleakScanner(detection_callback=detection_callback)
+            log.debug("=> Starting continuous BLE scan")
+            await scanner.start()
+            try:
+                while True:
+                    await asyncio.sleep(scan_interval)
+                    log_scan_stats()
+                    await connect_seen_paired()
+                    await self.process_async_queue(notify_callback=notify_callback)
+            finally:
+                await scanner.stop()
+
+        while True:
+            scanner = BleakScanner(detection_callback=detection_callback)
+
             log.debug("=> Starting BLE scan")
+            seen_paired.clear()
             await scanner.start()
             await asyncio.sleep(scan_interval)
             await scanner.stop()
-
-            discovered = scanner.discovered_devices
+            log_scan_stats()
 
             # Connect to devices
-            for device in discovered:
-                in_memory = devices_mem.get(device.address)
-                if in_memory and in_memory.paired is True:
-                    await connect_device(device)
+            await connect_seen_paired()
 
             await asyncio.sleep(1)
             await self.process_async_queue(notify_callback=notify_callback)
 
 
+    async def ingest_loop(
+        self, interval=INGEST_INTERVAL, batch_size=INGEST_BATCH_SIZE
+    ):
+        """Write collected data to the data store, in batches"""
+        dropped = 0
+        while True:
+            batch = ingest_buffer.drain(batch_size)
+            if len(batch) > 0:
+                devices_data.add_many(batch)
+
+            if ingest_buffer.dropped > dropped:
+                log.warning(
+                    "Ingest buffer full; dropped %s entries %s",
+                    ingest_buffer.dropped - dropped,
+                    ingest_buffer.stats(),
+                )
+                dropped = ingest_buffer.dropped
+
+            # Keep draining while there's a backlog, but let BLE callbacks run in between
+            if len(ingest_buffer) >= batch_size:
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(interval)
+
+
     async def rpc_server_loop(self):
         """Start RPC server"""
         server = await asyncio.start_server(
@@ -176,7 +322,10 @@ class BCMS:
         """Clear old data every 60 seconds"""
         while True:
             log.debug("=> Clearing old data")
-            devices_data.clear_old_data(max_age)
+            # file-backed store: keep data that hasn't been submitted yet
+            devices_data.clear_old_data(
+                max_age, keep_unsubmitted=devices_data.persistent
+            )
             await asyncio.sleep(interval)
 
 
@@ -198,10 +347,15 @@ class BCMS:
                 else:
                     from_time = round(time.time() - 60)
                 to_time = round(time.time())
+                # samples collected before to_time must be in the store before it's read
+                devices_data.add_many(ingest_buffer.drain())
                 log.debug("=> Fetching data from %s to %s", from_time, to_time)
-                data = devices_data.get(from_time=from_time, to_time=to_time)
-                log.debug("   Found %s entries", len(data))
-                sample_data = limit_iot_data_sample_rate(data)
+                sample_data = devices_data.get_buckets(
+                    from_time=from_time,
+                    to_time=to_time,
+                    interval=DATA_SAMPLE_INTERVAL,
+                    strategy=DATA_SAMPLE_STRATEGY,
+                )
                 log.debug("   Found %s entries - SAMPLED", len(sample_data))
                 formatted_data = dump_iot_data_for_api_submission(
                     sample_data, registered_devices
@@ -215,100 +369,143 @@ class BCMS:
                 await asyncio.sleep(data_submission_interval)
                 continue
 
-            # Backend API loaded; Submit data
+            # Backend API loaded; Submit data of each device since its last submission
+            started = time.perf_counter()
+            windows = await self.last_submissions(
+                [device for device in registered_devices if device.id is not None]
+            )
+            looked_up = time.perf_counter()
+
+            to_time = round(time.time())
+            # samples collected before to_time must be in the store before watermarks pass them
+            devices_data.add_many(ingest_buffer.drain())
+            log.debug("=> Fetching data for %s devices, until %s", len(windows), to_time)
+            sample_data = devices_data.get_buckets(
+                to_time=to_time,
+                interval=DATA_SAMPLE_INTERVAL,
+                strategy=DATA_SAMPLE_STRATEGY,
+                windows=windows,
+                limit=SUBMISSION_MAX_CYCLE_SAMPLES,
+            )
+            backlog = len(sample_data) >= SUBMISSION_MAX_CYCLE_SAMPLES
+            if backlog:
+                # the rest is read next cycle, from the watermarks; to_time is inclusive, so
+                # samples of the last timestamp that didn't fit are read again then
+                to_time = int(sample_data[-1].timestamp)
+                log.info("   Backlog: submitting %s entries, until %s", len(sample_data), to_time)
             if last_submission is None:
-                last_submissions = []
-
-                # If we haven't submitted before, determine last timestamp
-                known_devices = devices_mem.get_all()
-                for device in known_devices:
-                    if device.approved is True:
-                        if device.id is None:
-                            continue
-
-                        last_data_timestamp = await self.backend_api.last_iot_device_data_submission(
-                            device.id
-                        )
-                        last_submissions.append(
-                            {"address": device.address, "last_submission": last_data_timestamp}
-                        )
-                        log.debug("   Last submission for %s: %s", device, last_data_timestamp)
-
-                filtered_data = []
-                to_time = round(time.time())
-
-                for device in last_submissions:
-                    log.debug(
-                        "=> Fetching data for %s, from %s to %s",
-                        device,
-                        device["last_submission"],
-                        to_time,
-                    )
-                    from_time = device["last_submission"]
-                    data = devices_data.get(
-                        from_time=from_time,
-                        to_time=to_time,
-                        device_address=device["address"],
-                    )
-                    log.debug("   Found %s entries", len(data))
-                    filtered_data.extend(data)
+                log.info(
+                    "   Warm-up: %s devices; last submissions in %.2fs, data in %.2fs",
+                    len(windows),
+                    looked_up - started,
+                    time.perf_counter() - looked_up,
+                )
+            log.debug("   Found %s entries - SAMPLED", len(sample_data))
 
-                sample_data = limit_iot_data_sample_rate(filtered_data)
-                log.debug("   Found %s entries - SAMPLED", len(sample_data))
-                formatted_data = dump_iot_data_for_api_submission(
-                    sample_data, registered_devices
+            if len(sample_data) > 0:
+                log.debug("=> Submitting %s entries to API", len(sample_data))
+            else:
+                log.debug("=> Submitting entries to API: Nothing to submit")
+            # Only acknowledged chunks move watermarks; the rest is submitted again next time.
+            # Devices without a window (lookup failed), or past to_time (backlog), keep their watermark
+            result = await self.submission.run(
+                sample_data,
+                [
+                    device
+                    for device in registered_devices
+                    if device.address in windows
+                    and (windows[device.address] is None or windows[device.address] <= to_time)
+                ],
+                to_time,
+            )
+            if result.failed > 0:
+                log.error(
+                    "   Submitted %s of %s chunks; will retry the rest",
+                    result.acknowledged,
+                    result.chunks,
+                )
+            elif result.chunks > 0:
+                log.debug(
+                    "   Submitted %s entries in %s chunks, %s bytes",
+                    result.samples,
+                    result.chunks,
+                    result.bytes,
                 )
-                if len(sample_data) > 0:
-                    log.debug("=> Submitting %s entries to API", len(sample_data))
-                    await self.backend_api.submit_iot_data(formatted_data)
-                else:
-                    log.debug("=> Submitting entries to API: Nothing to submit")
 
-                last_submission = to_time
+            devices_data.set_watermarks(result.watermarks)
+            last_submission = to_time
 
+            # catch up on a backlog right away, unless submitting is failing
+            if backlog and result.failed == 0:
+                await asyncio.sleep(0)
             else:
-                # If we know the last submission, only submit data since then
-                to_time = round(time.time())
-                log.debug("=> Fetching data from %s to %s", last_submission, to_time)
-                data = devices_data.get(from_time=last_submission, to_time=to_time)
-                log.debug("   Found %s entries", len(data))
-                sample_data = limit_iot_data_sample_rate(data)
-                log.debug("   Found %s entries - SAMPLED", len(sample_data))
-                formatted_data = dump_iot_data_for_api_submission(
-                    sample_data, registered_devices
-                )
-                if len(sample_data) > 0:
-                    log.debug("=> Submitting %s entries to API", len(sample_data))
-                    await self.backend_api.submit_iot_data(formatted_data)
-                else:
-                    log.debug("=> Submitting entries to API: Nothing to submit")
+                await asyncio.sleep(data_submission_interval)
 
-                last_submission = to_time
 
-            await asyncio.sleep(data_submission_interval)
+    async def last_submissions(
+        self, devices: list, concurrency: int = WATERMARK_LOOKUP_CONCURRENCY
+    ) -> dict:
+        """
+        Timestamp up to which each device's data was submitted, by address
+        - the local watermark if there is one; otherwise asks the backend, concurrency at a time
+        - devices whose lookup failed are left out; they're looked up again next cycle
+        """
+        watermarks = devices_data.get_watermarks()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def lookup(device):
+            if device.address in watermarks:
+                return watermarks[device.address]
+            async with semaphore:
+                return await self.backend_api.last_iot_device_data_submission(device.id)
+
+        timestamps = await asyncio.gather(
+            *(lookup(device) for device in devices), return_exceptions=True
+        )
+        result = {}
+        for device, timestamp in zip(devices, timestamps):
+            if isinstance(timestamp, BaseException):
+                log.error("Failed to look up last submission of %s: %s", device.address, timestamp)
+                continue
+            log.debug("   Last submission for %s: %s", device, timestamp)
+            result[device.address] = timestamp
+        log.debug(
+            "   Last submissions: %s from local watermarks, %s from the backend",
+            sum(1 for device in devices if device.address in watermarks),
+            sum(1 for device in devices if device.address not in watermarks),
+        )
+        return result
 
 
     async def process_async_queue(self, notify_callback=None):
         """Process async queue"""
 
+        async def register_paired(address: str, name: str = None):
+            try:
+                result = await self.backend_api.run_in_executor(
+                    self.backend_api.create_iot_device_if_not_exists, address
+                )
+                if result and result.id:
+                    devices_mem.replace(
+                        BCMSDeviceInfo(
+                            address=address,
+                            name=name,
+                            approved=True,
+                            paired=True,
+                            id=result.id,
+                            is_registered=True,
+                        )
+                    )
+            except Exception as err:
+                log.error("Failed to create iot device %s: %s", address, err)
+
         def pairing_success_callback(address: str, name: str = None):
             log.debug("Pair success %s", address)
             if self.backend_api.identifier is not None:
-                try:
-                    result = self.backend_api.create_iot_device_if_not_exists(address)
-                    if result and result.id:
-                        devices_mem.replace(
-                            BCMSDeviceInfo(
-                                address=address,
-                                name=name,
-                                approved=True,
-                                paired=True,
-                                id=result.id,
-                                is_registered=True,
-                            )
-                        )
-                except Exception as err:
-                    log.error("Failed to create iot device %s: %s", address, err)
+                # registering takes up to a few backend requests; don't hold up the event loop
+                task = asyncio.create_task(register_paired(address, name))
+                self.background_tasks.add(task)
+                task.add_done_callback(self.background_tasks.discard)
 
         if len(async_queue) > 0:
             item = async_queue.get()
@@ -351,7 +548,9 @@ class BCMS:
                         continue
 
                     try:
-                        result = self.backend_api.create_iot_device_if_not_exists(device.address)
+                        result = await self.backend_api.run_in_executor(
+                            self.backend_api.create_iot_device_if_not_exists, device.address
+                        )
                         log.debug("Result: %s", result)
 
                         if (
@@ -397,9 +596,14 @@ def main():
     username = params["username"]
     notify = params["notify"]
     sleep = params["sleep"]
+    scan_mode = params["scan_mode"]
+    connection_limit = params["connection_limit"]
     sleep_data = params["sleep_data"]
+    submission_compression = params["submission_compression"]
     application_identifier = params["application_identifier"]
     debug = params["debug"]
+    data_store = params["data_store"]
+    data_store_max_rows = params["data_store_max_rows"]
 
     if getpass.getuser() != "root":
         _log.set_nonroot_logging()
@@ -422,17 +626,34 @@ def main():
         server_name=sentry_device_identifier,
     )
 
+    # Plugin data types must be registered before stored data is read
+    load_plugins()
+
+    if data_store:
+        log.info("Keeping collected data in %s", data_store)
+    devices_data.open(data_store or ":memory:", max_rows=data_store_max_rows)
+
     bcms = BCMS(
         application_identifier=application_identifier,
         notify=notify,
         username=username,
         sleep=sleep,
         sleep_data=sleep_data,
+        scan_mode=scan_mode,
+        connection_limit=connection_limit,
+        submission_compression=submission_compression,
     )
 
-    asyncio.run(
-        bcms.start()
-    )
+    # SIGTERM (systemd stop) ends run() normally, so this finally flushes too
+    try:
+        asyncio.run(
+            bcms.run()
+        )
+    finally:
+        bcms.backend_api.close()
+        devices_mem.flush()
+        devices_data.add_many(ingest_buffer.drain())
+        devices_data.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+"""Module to retry flaky operations with backoff, and to skip devices that keep failing"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Tuple, Type, Union
+
+
+log = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """
+    Retries an operation with exponential backoff and jitter
+    - attempt n (from 0) is followed by a delay of base_delay * 2^n, at most max_delay
+    - jitter: fraction of the delay that's randomized; 0.5 means between 50% and 100% of it
+    - no retry is started if its delay would end past deadline seconds after the first attempt
+    - only exceptions in retry_on are retried; others are raised right away
+    """
+
+    def __init__(
+        self,
+        attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        jitter: float = 0.5,
+        deadline: Union[float, None] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+        sleep: Callable[[float], Awaitable] = asyncio.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if attempts < 1:
+            raise ValueError(f"Attempts must be at least 1: {attempts}")
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"Jitter must be between 0 and 1: {jitter}")
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.sleep = sleep
+        self.clock = clock
+        """calls / succeeded / gave_up: operations; retries: attempts after the first"""
+        self.calls = 0
+        self.succeeded = 0
+        self.gave_up = 0
+        self.retries = 0
+
+    def delay(self, attempt: int) -> float:
+        """Delay after the given failed attempt, from 0."""
+        delay = min(self.max_delay, self.base_delay * (2**attempt))
+        return delay * (1 - self.jitter * random.random())
+
+    async def run(self, operation: Callable[[], Awaitable], name: str = "operation"):
+        """Await operation() until it succeeds; raises the last error when giving up."""
+        self.calls += 1
+        start = self.clock()
+        attempt = 0
+        while True:
+            try:
+                result = await operation()
+                self.succeeded += 1
+                return result
+            except self.retry_on as err:
+                delay = self.delay(attempt)
+                attempt += 1
+                if attempt >= self.attempts:
+                    reason = f"{attempt} attempts"
+                elif self.deadline is not None and self.clock() + delay - start > self.deadline:
+                    reason = f"deadline of {self.deadline}s"
+                else:
+                    log.debug(
+                        "%s failed (%s); retry %s in %.2fs", name, err, attempt, delay
+                    )
+                    self.retries += 1
+                    await self.sleep(delay)
+                    continue
+                self.gave_up += 1
+                log.debug("%s failed (%s); giving up after %s", name, err, reason)
+                raise
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "succeeded": self.succeeded,
+            "gave_up": self.gave_up,
+            "retries": self.retries,
+        }
+
+
+class CircuitBreaker:
+    """
+    Skips a device for a number of cycles after repeated failures
+    - threshold failures in a row open the circuit; success resets the count
+    - while open, allow() returns False for the next cooldown calls, one per cycle
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: int = 5):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: Dict[str, int] = {}
+        self._skip: Dict[str, int] = {}
+        """opened: times a circuit opened; skipped: calls to allow() that returned False"""
+        self.opened = 0
+        self.skipped = 0
+
+    def allow(self, key: str) -> bool:
+        remaining = self._skip.get(key, 0)
+        if remaining <= 0:
+            return True
+        if remaining == 1:
+            del self._skip[key]
+        else:
+            self._skip[key] = remaining - 1
+        self.skipped += 1
+        return False
+
+    def success(self, key: str):
+        self._failures.pop(key, None)
+
+    def failure(self, key: str):
+        failures = self._failures.get(key, 0) + 1
+        if failures < self.threshold:
+            self._failures[key] = failures
+            return
+        del self._failures[key]
+        self._skip[key] = self.cooldown
+        self.opened += 1
+        log.warning(
+            "%s failed %s times in a row; skipping it for %s cycles",
+            key,
+            failures,
+            self.cooldown,
+        )
+
+    def stats(self) -> dict:
+        return {
+            "opened": self.opened,
+            "skipped": self.skipped,
+            "open": sorted(self._skip.keys()),
+        }
@@ -0,0 +1,140 @@
+"""Module to downsample IoT data before submission"""
+
+from typing import Dict, Iterable, List, Union
+
+from .data_types import DataType
+
+
+_NUMBERS = {int, float}
+
+
+class FirstInBucket:
+    """
+    Keep the earliest sample of each bucket
+    - strategies fold a bucket's samples into a state: start(), merge(), result()
+    - input order doesn't matter; samples are compared by timestamp
+    """
+
+    def start(self, sample: DataType):
+        return sample
+
+    def merge(self, kept: DataType, sample: DataType):
+        return sample if sample.timestamp < kept.timestamp else kept
+
+    def result(self, kept: DataType) -> DataType:
+        return kept
+
+
+class LastInBucket(FirstInBucket):
+    """Keep the latest sample of each bucket"""
+
+    def merge(self, kept: DataType, sample: DataType):
+        return sample if sample.timestamp >= kept.timestamp else kept
+
+
+class AggregateBucket:
+    """
+    Reduce each numeric field of a bucket's samples to one value
+    - non-numeric fields (for ex. alert ids) keep the value of the latest sample
+    - the result carries the timestamp of the earliest sample
+    """
+
+    def __init__(self, reduce):
+        self.reduce = reduce
+
+    def start(self, sample: DataType):
+        # [first timestamp, last timestamp, count, values, sample]
+        return [sample.timestamp, sample.timestamp, 1, list(sample.values()), sample]
+
+    def merge(self, state: list, sample: DataType):
+        values = state[3]
+        is_latest = sample.timestamp >= state[1]
+        for i, value in enumerate(sample.values()):
+            if type(value) in _NUMBERS and type(values[i]) in _NUMBERS:
+                values[i] = self.reduce(values[i], value)
+            elif is_latest:
+                values[i] = value
+        if sample.timestamp < state[0]:
+            state[0] = sample.timestamp
+        if is_latest:
+            state[1] = sample.timestamp
+        state[2] += 1
+        return state
+
+    def result(self, state: list) -> DataType:
+        first_timestamp, _, _, values, sample = state
+        return type(sample).from_values(values, sample.address, first_timestamp)
+
+
+class MeanOfBucket(AggregateBucket):
+    """Average each numeric field of a bucket's samples"""
+
+    def __init__(self):
+        super().__init__(lambda a, b: a + b)
+
+    def result(self, state: list) -> DataType:
+        count = state[2]
+        state[3] = [v / count if type(v) in _NUMBERS else v for v in state[3]]
+        return super().result(state)
+
+
+# Bucket strategies by name; "gap" is handled by downsample() itself
+STRATEGIES = {
+    "first": FirstInBucket(),
+    "last": LastInBucket(),
+    "mean": MeanOfBucket(),
+    "min": AggregateBucket(min),
+    "max": AggregateBucket(max),
+}
+
+
+def downsample(
+    data: Iterable[DataType],
+    interval: int = 2,
+    strategy: Union[str, FirstInBucket, AggregateBucket] = "gap",
+    intervals: Union[Dict[str, int], None] = None,
+) -> List[DataType]:
+    """
+    Downsample data per address and type, in a single pass
+    - interval: seconds; intervals overrides it per data type name, for ex. {"heart_rate": 10}
+    - strategy "gap": keep a sample if it's more than interval seconds away from the last kept one;
+      works on ascending and descending input, and keeps the input order
+    - any other strategy: one sample per interval-aligned bucket, in ascending order;
+      a name from STRATEGIES, or an object with start(), merge() and result()
+    """
+    intervals = intervals or {}
+
+    if strategy == "gap":
+        last_kept = {}
+        result = []
+        for sample in data:
+            key = (sample.address, type(sample))
+            last_timestamp = last_kept.get(key)
+            if (
+                last_timestamp is None
+                or abs(sample.timestamp - last_timestamp)
+                > intervals.get(sample.name, interval)
+            ):
+                result.append(sample)
+                last_kept[key] = sample.timestamp
+        return result
+
+    if isinstance(strategy, str):
+        strategy = STRATEGIES[strategy]
+
+    buckets = {}
+    for sample in data:
+        key = (
+            sample.address,
+            type(sample),
+            sample.timestamp // intervals.get(sample.name, interval),
+        )
+        state = buckets.get(key)
+        if state is None:
+            buckets[key] = strategy.start(sample)
+        else:
+            buckets[key] = strategy.merge(state, sample)
+
+    result = [strategy.result(state) for state in buckets.values()]
+    result.sort(key=lambda sample: sample.timestamp)
+    return result
@@ -0,0 +1,254 @@
+"""Module to submit collected data to the backend in chunks, and to track what was acknowledged"""
+
+import asyncio
+import gzip
+import json
+import logging
+import math
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .config import SUBMISSION_COMPRESSION_METHODS
+from .data_store import dump_iot_data_for_api_submission
+from .data_types import DataType
+from .devices_classes import BCMSDeviceInfoWithLastSeen
+
+
+log = logging.getLogger(__name__)
+
+
+# Default level per compression method; favour speed, repeated keys compress well either way
+COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def encode_iot_data(data: list, use_orjson: Union[bool, None] = None) -> bytes:
+    """
+    Request body of a data submission
+    - use_orjson: None to use orjson if installed; it writes NaN as null, where json writes NaN
+    """
+    if use_orjson is None:
+        use_orjson = orjson is not None
+    if use_orjson:
+        if orjson is None:
+            raise ValueError("orjson is not installed")
+        return orjson.dumps({"data": data})
+    return json.dumps({"data": data}, separators=(",", ":")).encode("utf-8")
+
+
+# HTTP statuses that reject a request for its body: bad request, too large, unprocessable.
+# Others (for ex. 403, 404, 415) say nothing about the data, and are retried like server errors
+PERMANENT_REJECTION_STATUSES = (400, 413, 422)
+
+
+def is_permanent_rejection(err: Exception) -> bool:
+    """Whether the backend rejected a request for its content; see PERMANENT_REJECTION_STATUSES"""
+    response = getattr(err, "response", None)
+    return getattr(response, "status_code", None) in PERMANENT_REJECTION_STATUSES
+
+
+def check_compression(method: str):
+    """Raise ValueError if method is unknown, or its module isn't installed."""
+    if method not in SUBMISSION_COMPRESSION_METHODS:
+        raise ValueError(f"Unknown compression: {method}")
+    if method == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs zstandard: pip install bcms[zstd]")
+
+
+def compress_body(
+    body: bytes, method: str, min_bytes: int = 0, level: Union[int, None] = None
+) -> Tuple[bytes, Union[str, None]]:
+    """
+    Compress a request body; returns the body to send, and its Content-Encoding
+    - bodies smaller than min_bytes are sent as is, with Content-Encoding None
+    """
+    check_compression(method)
+    if method == "none" or len(body) < min_bytes:
+        return body, None
+    if level is None:
+        level = COMPRESSION_LEVELS[method]
+    if method == "gzip":
+        # mtime=0: same body, same bytes
+        return gzip.compress(body, compresslevel=level, mtime=0), "gzip"
+    return zstandard.ZstdCompressor(level=level).compress(body), "zstd"
+
+
+# Outcomes of chunks rejected by the backend; see SubmissionPipeline
+_SPLIT = "split"
+_REJECTED = "rejected"
+
+
+class SubmissionResult:
+    """Outcome of SubmissionPipeline.run()"""
+
+    def __init__(self):
+        """watermarks: timestamp up to which each device's data was acknowledged, by address"""
+        self.watermarks: Dict[str, int] = {}
+        self.samples = 0
+        self.chunks = 0
+        self.acknowledged = 0
+        self.failed = 0
+        """rejected: samples the backend rejected on their own, and that are dropped"""
+        self.rejected = 0
+        self.bytes = 0
+
+
+class SubmissionPipeline:
+    """
+    Submits samples in chunks of at most max_samples samples and max_bytes bytes
+    - chunks are cut in timestamp order; a chunk over max_bytes is split in half
+    - the next chunk is encoded while previous ones upload; at most max_in_flight upload at once
+    - after a failed chunk, no new chunks are started
+    - a device's watermark only covers chunks up to the first one that failed; its data from
+      there on is submitted again next time, also if later chunks were acknowledged
+    - a chunk the backend rejects for its content (see is_permanent_rejection) would fail every
+      time: it's split in half and submitted again, until the rejected samples are isolated
+      and dropped, so they don't hold back the rest
+    - a single sample is only dropped if another chunk was acknowledged in the same run;
+      if the backend rejects everything, the problem is likely not the data: it's a failure
+    """
+
+    def __init__(
+        self,
+        submit: Callable[[bytes], Awaitable],
+        max_samples: int = 1000,
+        max_bytes: int = 512 * 1024,
+        max_in_flight: int = 2,
+        encode: Callable[[list], bytes] = encode_iot_data,
+        permanent: Callable[[Exception], bool] = is_permanent_rejection,
+    ):
+        self.submit = submit
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.max_in_flight = max_in_flight
+        self.encode = encode
+        self.permanent = permanent
+
+    async def run(
+        self,
+        samples: Iterable[DataType],
+        registered_devices: List[BCMSDeviceInfoWithLastSeen],
+        to_time: int,
+    ) -> SubmissionResult:
+        """Submit samples up to to_time; returns what to record as watermarks."""
+        result = SubmissionResult()
+        registered = {device.address for device in registered_devices}
+        samples = sorted(
+            (sample for sample in samples if sample.address in registered),
+            key=lambda sample: sample.timestamp,
+        )
+        result.samples = len(samples)
+
+        pending = deque(
+            samples[i : i + self.max_samples]
+            for i in range(0, len(samples), self.max_samples)
+        )
+        sent: List[List[DataType]] = []
+        # None: in flight; True: acknowledged; False: failed; SPLIT / REJECTED: rejected,
+        # and submitted again in halves / dropped
+        outcomes: List[Union[bool, str, None]] = []
+        uploads = []
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def upload(index: int, body: bytes):
+            try:
+                await self.submit(body)
+                outcomes[index] = True
+            except Exception as err:
+                chunk = sent[index]
+                if not self.permanent(err):
+                    outcomes[index] = False
+                    log.error("Failed to submit chunk %s (%s bytes): %s", index, len(body), err)
+                elif len(chunk) > 1:
+                    outcomes[index] = _SPLIT
+                    log.warning(
+                        "Chunk %s (%s samples) rejected: %s; submitting it in halves",
+                        index,
+                        len(chunk),
+                        err,
+                    )
+                    half = len(chunk) // 2
+                    pending.appendleft(chunk[half:])
+                    pending.appendleft(chunk[:half])
+                elif True not in outcomes:
+                    outcomes[index] = False
+                    log.error(
+                        "Failed to submit chunk %s: rejected, and nothing was accepted: %s",
+                        index,
+                        err,
+                    )
+                else:
+                    outcomes[index] = _REJECTED
+                    result.rejected += 1
+                    log.error(
+                        "Dropping %s sample of %s at %s, rejected: %s",
+                        chunk[0].name,
+                        chunk[0].address,
+                        chunk[0].timestamp,
+                        err,
+                    )
+            finally:
+                semaphore.release()
+
+        while False not in outcomes:
+            if len(pending) == 0:
+                # rejected chunks in flight may come back as halves
+                running = [task for task in uploads if not task.done()]
+                if len(running) == 0:
+                    break
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            chunk = pending.popleft()
+            body = self.encode(dump_iot_data_for_api_submission(chunk, registered_devices))
+            if len(body) > self.max_bytes and len(chunk) > 1:
+                half = len(chunk) // 2
+                pending.appendleft(chunk[half:])
+                pending.appendleft(chunk[:half])
+                continue
+
+            await semaphore.acquire()
+            if False in outcomes:
+                semaphore.release()
+                pending.appendleft(chunk)
+                break
+            sent.append(chunk)
+            outcomes.append(None)
+            result.bytes += len(body)
+            uploads.append(asyncio.create_task(upload(len(sent) - 1, body)))
+
+        if uploads:
+            await asyncio.gather(*uploads)
+
+        result.chunks = sum(1 for outcome in outcomes if outcome != _SPLIT) + len(pending)
+        result.acknowledged = sum(1 for outcome in outcomes if outcome is True)
+        result.failed = sum(1 for outcome in outcomes if outcome is False)
+
+        # earliest sample of each device that wasn't acknowledged; halves of split chunks are
+        # sent after later chunks, and dropped samples don't count
+        first_failed = outcomes.index(False) if False in outcomes else len(sent)
+        unacknowledged = {}
+        remaining = [
+            chunk
+            for chunk, outcome in zip(sent[first_failed:], outcomes[first_failed:])
+            if outcome not in (_SPLIT, _REJECTED)
+        ]
+        for chunk in remaining + list(pending):
+            for sample in chunk:
+                if sample.timestamp < unacknowledged.get(sample.address, math.inf):
+                    unacknowledged[sample.address] = sample.timestamp
+        for address in registered:
+            if address in unacknowledged:
+                # from_time is inclusive; the sample is submitted again
+                result.watermarks[address] = math.floor(unacknowledged[address])
+            else:
+                result.watermarks[address] = to_time
+        return result
@@ -0,0 +1,152 @@
+"""
+Replays an advertisement stream through the previous callback and the decoder table
+
+Without a recording, a synthetic stream is generated. A recording is a JSON lines file,
+one advertisement per line:
+
+    {"address": "00:09:1F:8A:BC:21", "service_data": {"00002a37-...": "4800"}}
+
+Run with:
+
+    python3 -m benchmarks.bench_advertisement [recording.jsonl]
+"""
+
+import json
+import sys
+import time
+from types import SimpleNamespace
+
+from bcms.ble_utils import iot_advertisement_data_callback_wrapper
+from bcms.data_types import (
+    AlertData,
+    BatteryLevelData,
+    HeartRateData,
+    PressureData,
+    TemperatureData,
+)
+
+ADVERTISEMENTS = 100_000
+
+
+def legacy_callback_wrapper(store_data_callback=None, track_device_callback=None):
+    """Callback before the decoder table; debug logging left out"""
+
+    def iot_advertisement_data_callback(sender, advertisement_data):
+        all_data = []
+        TYPE_KEY_DICT = {
+            "HEART_RATE": "00002a37-0000-1000-8000-00805f9b34fb",
+            "PRESSURE": "00002a6d-0000-1000-8000-00805f9b34fb",
+            "TEMPERATURE": "00002a6e-0000-1000-8000-00805f9b34fb",
+            "BATTERY_LEVEL": "0000180f-0000-1000-8000-00805f9b34fb",
+            "ALERT": "00002a46-0000-1000-8000-00805f9b34fb",
+        }
+        if advertisement_data:
+            for data_type, uuid in TYPE_KEY_DICT.items():
+                match = False
+                for key in advertisement_data.service_data.keys():
+                    if key.startswith(uuid):
+                        match = True
+                        break
+                if match:
+
+                    def signed():
+                        return int.from_bytes(
+                            advertisement_data.service_data[uuid],
+                            byteorder="little",
+                            signed=True,
+                        )
+
+                    def unsigned():
+                        return int.from_bytes(
+                            advertisement_data.service_data[uuid],
+                            byteorder="little",
+                            signed=False,
+                        )
+
+                    def bytes_to_utf8():
+                        try:
+                            return advertisement_data.service_data[uuid].decode("utf-8")
+                        except UnicodeDecodeError:
+                            return None
+
+                    data = None
+                    if data_type == "HEART_RATE":
+                        data = HeartRateData({"rate": signed()}, sender.address, time.time())
+                    elif data_type == "PRESSURE":
+                        data = PressureData({"level": unsigned()}, sender.address, time.time())
+                    elif data_type == "TEMPERATURE":
+                        data = TemperatureData({"level": signed()}, sender.address, time.time())
+                    elif data_type == "BATTERY_LEVEL":
+                        data = BatteryLevelData({"level": signed()}, sender.address, time.time())
+                    elif data_type == "ALERT":
+                        data = AlertData({"id": bytes_to_utf8()}, sender.address, time.time())
+                    all_data.append(data)
+        if len(all_data) > 0:
+            if store_data_callback is not None:
+                for d in all_data:
+                    store_data_callback(d)
+        if track_device_callback is not None:
+            track_device_callback(sender)
+
+    return iot_advertisement_data_callback
+
+
+def synthetic_stream():
+    uuids = [
+        "00002a37-0000-1000-8000-00805f9b34fb",
+        "00002a6e-0000-1000-8000-00805f9b34fb",
+        "0000180f-0000-1000-8000-00805f9b34fb",
+        "00002a6d-0000-1000-8000-00805f9b34fb",
+    ]
+    stream = []
+    for i in range(ADVERTISEMENTS):
+        service_data = {}
+        # most advertisements carry one or two values, some none, some unknown UUIDs
+        if i % 4 != 3:
+            service_data[uuids[i % 4]] = (60 + i % 40).to_bytes(2, "little")
+        if i % 3 == 0:
+            service_data["0000180f-0000-1000-8000-00805f9b34fb"] = bytes([i % 100])
+        if i % 10 == 0:
+            service_data["0000feaa-0000-1000-8000-00805f9b34fb"] = b"\x00" * 18
+        if i % 50 == 0:
+            service_data["00002a46-0000-1000-8000-00805f9b34fb"] = b"fall"
+        stream.append((f"00:00:00:00:00:{i % 30:02X}", service_data))
+    return stream
+
+
+def recorded_stream(path: str):
+    stream = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            service_data = {k: bytes.fromhex(v) for k, v in entry["service_data"].items()}
+            stream.append((entry["address"], service_data))
+    return stream
+
+
+def replay(label: str, wrapper, stream):
+    stored = []
+    callback = wrapper(store_data_callback=stored.append)
+    events = [
+        (SimpleNamespace(address=address), SimpleNamespace(service_data=service_data))
+        for address, service_data in stream
+    ]
+    begin = time.perf_counter()
+    for sender, advertisement_data in events:
+        callback(sender, advertisement_data)
+    elapsed = time.perf_counter() - begin
+    print(
+        f"{label:<14} {len(stream) / elapsed:>10.0f} advertisements/s"
+        f"  {len(stored)} samples decoded"
+    )
+
+
+def main():
+    stream = recorded_stream(sys.argv[1]) if len(sys.argv) > 1 else synthetic_stream()
+    print(f"{len(stream)} advertisements")
+    replay("legacy", legacy_callback_wrapper, stream)
+    replay("decoder table", iot_advertisement_data_callback_wrapper, stream)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Decoding a stored blood pressure history: the previous per-record decode_data vs. decode_blood_pressure_reading
+(one record as it arrives) vs. decode_blood_pressure_records
+
+Run with:
+
+    python3 -m benchmarks.bench_bpm_decode [records]
+"""
+
+import struct
+import sys
+import time
+
+from bcms import codecs
+from bcms.codecs import decode_blood_pressure_reading, decode_blood_pressure_records
+
+
+def legacy_read_sfloat_le(buffer, index):
+    """SFLOAT before the lookup table; the exponent was read unsigned"""
+    data = struct.unpack_from("<H", buffer, index)[0]
+    mantissa = data & 0x0FFF
+    if (mantissa & 0x0800) > 0:
+        mantissa = -1 * (~(mantissa - 0x01) & 0x0FFF)
+    exponential = data >> 12
+    return mantissa * pow(10, exponential)
+
+
+def legacy_decode_data(data, battery):
+    """Per-record decoder before the batch decoder"""
+    buf = bytearray(data)
+    flags = buf[0]
+    result = {}
+    index = 1
+    if flags & 0x01:
+        result["SystolicPressure_kPa"] = legacy_read_sfloat_le(buf, index)
+        index += 2
+        result["DiastolicPressure_kPa"] = legacy_read_sfloat_le(buf, index)
+        index += 2
+        result["MeanArterialPressure_kPa"] = legacy_read_sfloat_le(buf, index)
+        index += 2
+    else:
+        result["SystolicPressure_mmHg"] = legacy_read_sfloat_le(buf, index)
+        index += 2
+        result["DiastolicPressure_mmHg"] = legacy_read_sfloat_le(buf, index)
+        index += 2
+        result["MeanArterialPressure_mmHg"] = legacy_read_sfloat_le(buf, index)
+        index += 2
+    if flags & 0x02:
+        result["date"] = {
+            "year": struct.unpack("<H", buf[index : index + 2])[0],
+            "month": buf[index + 2],
+            "day": buf[index + 3],
+            "hour": buf[index + 4],
+            "minute": buf[index + 5],
+            "second": buf[index + 6],
+        }
+        index += 7
+    if flags & 0x04:
+        result["PulseRate"] = legacy_read_sfloat_le(buf, index)
+        index += 2
+    if flags & 0x08:
+        index += 1
+    if flags & 0x10:
+        ms = buf[index]
+        result["bodyMoved"] = (ms & 0b1) != 0
+        result["cuffFitLoose"] = (ms & 0b10) != 0
+        result["irregularPulseDetected"] = (ms & 0b100) != 0
+        result["improperMeasurement"] = (ms & 0b100000) != 0
+        index += 1
+    result["battery"] = battery[0]
+    return result
+
+
+def make_records(count: int):
+    records = []
+    for i in range(count):
+        # most cuffs send mmHg with time stamp, pulse rate and status; some also a user id
+        flags = 0x16 if i % 4 else 0x1E
+        record = bytes([flags]) + struct.pack("<HHH", 110 + i % 40, 70 + i % 20, 85 + i % 25)
+        record += struct.pack("<HBBBBB", 2024, 1 + i % 12, 1 + i % 28, i % 24, i % 60, i % 60)
+        record += struct.pack("<H", 60 + i % 40)
+        if flags & 0x08:
+            record += bytes([1])
+        record += struct.pack("<H", i % 8)
+        records.append(record)
+    return records
+
+
+def bench(label: str, fn, records: list, rounds: int = 5):
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        fn(records)
+    elapsed = (time.perf_counter() - begin) / rounds
+    print(f"{label:<18} {elapsed * 1000:>8.2f} ms  {len(records) / elapsed:>10.0f} records/s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    records = make_records(count)
+    print(f"{count} records")
+
+    # build the lookup table outside of the measurement
+    codecs.sfloat_table()
+
+    bench("per record", lambda r: [legacy_decode_data(d, ["100"]) for d in r], records)
+    bench("on arrival", lambda r: [decode_blood_pressure_reading(d) for d in r], records)
+    bench("batch, python", lambda r: decode_blood_pressure_records(r, use_numpy=False), records)
+    if codecs.np is not None:
+        bench("batch, numpy", lambda r: decode_blood_pressure_records(r, use_numpy=True), records)
+    else:
+        print("batch, numpy       NumPy is not installed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Submission request bodies: encode time with json / orjson, and bytes on the wire with each compression
+
+Payloads are chunks of SUBMISSION_MAX_SAMPLES samples, built by dump_iot_data_for_api_submission,
+as the submission pipeline sends them.
+
+Run with:
+
+    python3 -m benchmarks.bench_compression [devices] [samples]
+"""
+
+import sys
+import time
+
+from bcms import submission
+from bcms.config import SUBMISSION_MAX_SAMPLES
+from bcms.data_store import dump_iot_data_for_api_submission
+from bcms.data_types import (
+    BatteryLevelData,
+    BloodPressureData,
+    HeartRateData,
+    TemperatureData,
+)
+from bcms.devices_classes import BCMSDeviceInfoWithLastSeen
+from bcms.submission import compress_body, encode_iot_data
+
+
+def address(i: int) -> str:
+    return f"00:00:00:00:{i // 256:02X}:{i % 256:02X}"
+
+
+def make_chunks(devices: int, count: int):
+    registered = [
+        BCMSDeviceInfoWithLastSeen(
+            address(i), f"device {i}", True, False, f"6f1c2a3e-0000-4000-8000-{i:012d}", True
+        )
+        for i in range(devices)
+    ]
+    start = 1700000000
+    samples = []
+    for i in range(count):
+        device = address(i % devices)
+        # a few seconds apart, with sub-second timestamps like time.time()
+        timestamp = start + (i // devices) * 5 + (i % 7) / 8
+        kind = i % 10
+        if kind < 6:
+            samples.append(HeartRateData({"rate": 60 + i % 40}, device, timestamp))
+        elif kind < 8:
+            samples.append(TemperatureData({"level": 3650 + i % 80}, device, timestamp))
+        elif kind < 9:
+            samples.append(BatteryLevelData({"level": 100 - i % 100}, device, timestamp))
+        else:
+            samples.append(
+                BloodPressureData({"sys": 110.0 + i % 40, "dias": 70.5 + i % 20}, device, timestamp)
+            )
+    samples.sort(key=lambda sample: sample.timestamp)
+    return [
+        dump_iot_data_for_api_submission(samples[i : i + SUBMISSION_MAX_SAMPLES], registered)
+        for i in range(0, len(samples), SUBMISSION_MAX_SAMPLES)
+    ]
+
+
+def timed(fn, items: list, rounds: int = 5):
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        results = [fn(item) for item in items]
+    return (time.perf_counter() - begin) / rounds, results
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    chunks = make_chunks(devices, count)
+    print(f"{devices} devices, {count} samples, {len(chunks)} chunks")
+
+    print("encode")
+    encoders = [("json", False)]
+    if submission.orjson is not None:
+        encoders.append(("orjson", True))
+    else:
+        print("  orjson             orjson is not installed")
+    bodies = None
+    for label, use_orjson in encoders:
+        elapsed, bodies = timed(lambda data: encode_iot_data(data, use_orjson=use_orjson), chunks)
+        print(f"  {label:<18} {elapsed * 1000:>8.1f} ms  {count / elapsed:>10.0f} samples/s")
+
+    raw = sum(len(body) for body in bodies)
+    print("compress")
+    print(f"  {'none':<18} {0:>8.1f} ms  {raw:>10} bytes  {raw / count:>6.1f} bytes/sample")
+    methods = [("gzip", 1), ("gzip", 6), ("gzip", 9)]
+    if submission.zstandard is not None:
+        methods += [("zstd", 1), ("zstd", 3), ("zstd", 9)]
+    else:
+        print("  zstd               zstandard is not installed")
+    for method, level in methods:
+        elapsed, results = timed(lambda body: compress_body(body, method, level=level), bodies)
+        size = sum(len(body) for body, _ in results)
+        print(
+            f"  {f'{method} {level}':<18} {elapsed * 1000:>8.1f} ms  {size:>10} bytes"
+            f"  {size / count:>6.1f} bytes/sample  {raw / size:>5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Insert and query throughput of BCMSDeviceDataDB
+
+Run with:
+
+    python3 -m benchmarks.bench_data_store [rows]
+"""
+
+import sys
+import time
+
+from bcms.data_store import BCMSDeviceDataDB
+from bcms.data_types import BatteryLevelData, HeartRateData
+from bcms.sampling import downsample
+
+DEVICES = 50
+
+
+def make_samples(rows: int, start: int):
+    samples = []
+    for i in range(rows):
+        address = f"00:00:00:00:{(i % DEVICES) // 256:02X}:{(i % DEVICES) % 256:02X}"
+        timestamp = start + i // DEVICES
+        if i % 2:
+            samples.append(HeartRateData({"rate": 60 + i % 40}, address, timestamp))
+        else:
+            samples.append(BatteryLevelData({"level": i % 100}, address, timestamp))
+    return samples
+
+
+def bench(label: str, db: BCMSDeviceDataDB, samples: list, start: int):
+    begin = time.perf_counter()
+    for sample in samples:
+        db.add(sample)
+    db.flush()
+    insert_s = time.perf_counter() - begin
+
+    end = samples[-1].timestamp
+    windows = 100
+    begin = time.perf_counter()
+    for i in range(windows):
+        from_time = start + (end - start) * i // windows
+        db.get(from_time=from_time, to_time=from_time + 30)
+    query_s = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    for i in range(windows):
+        from_time = start + (end - start) * i // windows
+        db.get(
+            from_time=from_time,
+            to_time=from_time + 30,
+            device_address=samples[i % DEVICES].address,
+        )
+    query_address_s = time.perf_counter() - begin
+
+    sampled = 10
+    begin = time.perf_counter()
+    for i in range(sampled):
+        from_time = start + (end - start) * i // sampled
+        downsample(db.iter_window(from_time, from_time + 600), 10, "first")
+    sample_python_s = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    for i in range(sampled):
+        from_time = start + (end - start) * i // sampled
+        db.get_buckets(from_time, from_time + 600, 10, "first")
+    sample_sql_s = time.perf_counter() - begin
+
+    # first submission after start: every device from its own watermark
+    addresses = sorted({sample.address for sample in samples[:DEVICES]})
+    watermarks = {address: end - 600 - i for i, address in enumerate(addresses)}
+    begin = time.perf_counter()
+    for address, from_time in watermarks.items():
+        db.get_buckets(from_time, end, 10, "first", device_address=address)
+    per_device_s = time.perf_counter() - begin
+    begin = time.perf_counter()
+    db.get_buckets(to_time=end, interval=10, strategy="first", windows=watermarks)
+    windows_s = time.perf_counter() - begin
+
+    print(
+        f"{label:<12} insert {len(samples) / insert_s:>10.0f} rows/s"
+        f" | window query {windows / query_s:>8.0f} q/s"
+        f" | window+address query {windows / query_address_s:>8.0f} q/s"
+        f" | 10 min window sampled in python {sample_python_s / sampled * 1000:>6.1f} ms"
+        f" / in SQL {sample_sql_s / sampled * 1000:>6.1f} ms"
+        f" | {DEVICES} watermarks per device {per_device_s * 1000:>6.1f} ms"
+        f" / in one query {windows_s * 1000:>6.1f} ms"
+    )
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    start = round(time.time()) - rows // DEVICES
+    samples = make_samples(rows, start)
+    print(f"{rows} rows, {DEVICES} devices")
+
+    bench("commit/row", BCMSDeviceDataDB(), samples, start)
+    bench("batch=100", BCMSDeviceDataDB(batch_size=100), samples, start)
+    bench("batch=1000", BCMSDeviceDataDB(batch_size=1000), samples, start)
+
+
+if __name__ == "__main__":
+    main()
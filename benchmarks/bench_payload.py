@@ -0,0 +1,81 @@
+"""
+Building the API submission payload: the previous list-scan implementation vs. dump_iot_data_for_api_submission
+
+Run with:
+
+    python3 -m benchmarks.bench_payload [devices] [samples]
+"""
+
+import sys
+import time
+
+from bcms.data_store import dump_iot_data_for_api_submission
+from bcms.data_types import BatteryLevelData, HeartRateData, TemperatureData
+from bcms.devices_classes import BCMSDeviceInfoWithLastSeen
+
+
+def legacy_dump_iot_data_for_api_submission(input_data, registered_devices):
+    """Implementation before the dict index; O(samples x devices)"""
+    registered_addresses = [d.address for d in registered_devices]
+    data_by_device = {}
+    for d in input_data:
+        if d.address not in registered_addresses:
+            continue
+        if d.address not in data_by_device:
+            data_by_device[d.address] = []
+        data_by_device[d.address].append(d)
+    data_by_device_and_type = []
+    for address, data in data_by_device.items():
+        device_id = None
+        for d in registered_devices:
+            if d.address == address:
+                device_id = d.id
+                break
+        data_by_type = {}
+        for d in data:
+            if d.name not in data_by_type:
+                data_by_type[d.name] = []
+            data_by_type[d.name].append({"timestamp": d.timestamp, "data": d.data})
+        for type, data in data_by_type.items():
+            data_by_device_and_type.append(
+                {"iotDeviceId": device_id, "dataType": type, "data": data}
+            )
+    return data_by_device_and_type
+
+
+def address(i: int) -> str:
+    return f"00:00:00:00:{i // 256:02X}:{i % 256:02X}"
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+
+    registered = [
+        BCMSDeviceInfoWithLastSeen(address(i), f"device {i}", True, False, f"id{i}", True)
+        for i in range(devices)
+    ]
+    start = round(time.time())
+    types = (BatteryLevelData, HeartRateData, TemperatureData)
+    samples = []
+    for i in range(count):
+        # every 10th sample comes from an unregistered device
+        device = i % (devices + devices // 10)
+        data_type = types[i % 3]
+        samples.append(
+            data_type({data_type.fields[0]: i % 100}, address(device), start + i // devices)
+        )
+    print(f"{devices} devices, {count} samples")
+
+    for label, fn in (
+        ("legacy", legacy_dump_iot_data_for_api_submission),
+        ("indexed", dump_iot_data_for_api_submission),
+    ):
+        begin = time.perf_counter()
+        result = fn(samples, registered)
+        elapsed = time.perf_counter() - begin
+        print(f"{label:<8} {elapsed * 1000:>9.1f} ms  {len(result)} groups")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Downsampling of mixed samples: the previous nested-dict implementation vs. sampling.downsample
+
+Run with:
+
+    python3 -m benchmarks.bench_sampling [samples]
+"""
+
+import sys
+import time
+
+from bcms.data_types import (
+    AlertData,
+    BatteryLevelData,
+    BloodPressureData,
+    HeartRateData,
+    TemperatureData,
+)
+from bcms.sampling import downsample
+
+DEVICES = 20
+
+
+def legacy_limit_iot_data_sample_rate(data, samples_every_seconds=2):
+    """Implementation before the single-pass rewrite; expects ascending input"""
+    if len(data) == 0:
+        return data
+    data_by_device = {}
+    for d in data:
+        if d.address not in data_by_device:
+            data_by_device[d.address] = []
+        data_by_device[d.address].append(d)
+    data_by_device_and_type = {}
+    for address, data in data_by_device.items():
+        data_by_type = {}
+        for d in data:
+            if d.__class__.__name__ not in data_by_type:
+                data_by_type[d.__class__.__name__] = []
+            data_by_type[d.__class__.__name__].append(d)
+        data_by_device_and_type[address] = data_by_type
+    filtered_data = []
+    for address, data_by_type in data_by_device_and_type.items():
+        for type, data in data_by_type.items():
+            last_timestamp = None
+            for d in data:
+                if (
+                    last_timestamp is None
+                    or d.timestamp - last_timestamp > samples_every_seconds
+                ):
+                    filtered_data.append(d)
+                    last_timestamp = d.timestamp
+    return filtered_data
+
+
+def make_samples(count: int):
+    start = round(time.time()) - count // DEVICES
+    samples = []
+    for i in range(count):
+        address = f"00:00:00:00:00:{i % DEVICES:02X}"
+        timestamp = start + i // DEVICES // 4
+        kind = i % 5
+        if kind == 0:
+            samples.append(HeartRateData({"rate": 60 + i % 40}, address, timestamp))
+        elif kind == 1:
+            samples.append(BatteryLevelData({"level": i % 100}, address, timestamp))
+        elif kind == 2:
+            samples.append(TemperatureData({"level": 20 + i % 5}, address, timestamp))
+        elif kind == 3:
+            samples.append(
+                BloodPressureData({"sys": 120, "dias": 80}, address, timestamp)
+            )
+        else:
+            samples.append(AlertData({"id": "1"}, address, timestamp))
+    return samples
+
+
+def bench(label: str, fn, samples: list, rounds: int = 5):
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        result = fn(samples)
+    elapsed = (time.perf_counter() - begin) / rounds
+    print(f"{label:<24} {elapsed * 1000:>8.1f} ms  {len(result):>7} kept")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    ascending = make_samples(count)
+    descending = list(reversed(ascending))
+    print(f"{count} samples, {DEVICES} devices, 5 types")
+
+    bench("legacy, ascending", legacy_limit_iot_data_sample_rate, ascending)
+    bench("legacy, descending", legacy_limit_iot_data_sample_rate, descending)
+    bench("gap, ascending", lambda d: downsample(d, 2), ascending)
+    bench("gap, descending", lambda d: downsample(d, 2), descending)
+    for strategy in ("first", "last", "mean", "min", "max"):
+        bench(strategy, lambda d: downsample(d, 2, strategy), ascending)
+    bench(
+        "first, per-type intervals",
+        lambda d: downsample(d, 2, "first", {"battery_level": 60}),
+        ascending,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,13 @@ INSTALL_REQUIRES = [
     "sentry_sdk"
 ]
 
+# Optional; used when installed
+EXTRAS_REQUIRE = {
+    "numpy": ["numpy"],
+    "orjson": ["orjson"],
+    "zstd": ["zstandard"],
+}
+
 setup(
     name=PACKAGE_NAME,
     version=VERSION,
@@ -32,6 +39,7 @@ setup(
     author_email=AUTHOR_EMAIL,
     url=URL,
     install_requires=INSTALL_REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
     include_package_data=True,
     package_data={"": ["rpc/bcms.capnp", "logging.json"]},
     entry_points={
@@ -0,0 +1,72 @@
+import unittest
+from bcms.advertisement import AdvertisementRate, decode_service_data
+from bcms.codecs import normalize_uuid
+from bcms.data_types import (
+    AlertData,
+    BatteryLevelData,
+    HeartRateData,
+    PressureData,
+    TemperatureData,
+)
+
+
+class TestDecodeServiceData(unittest.TestCase):
+    def test_normalize_uuid(self):
+        full = "00002a37-0000-1000-8000-00805f9b34fb"
+        self.assertEqual(normalize_uuid("2a37"), full)
+        self.assertEqual(normalize_uuid("00002A37"), full)
+        self.assertEqual(normalize_uuid(full.upper()), full)
+
+    def test_decode(self):
+        service_data = {
+            "00002a37-0000-1000-8000-00805f9b34fb": (72).to_bytes(2, "little"),
+            "00002a6d-0000-1000-8000-00805f9b34fb": (101325).to_bytes(4, "little"),
+            "00002a6e-0000-1000-8000-00805f9b34fb": (-5).to_bytes(2, "little", signed=True),
+            "0000180f-0000-1000-8000-00805f9b34fb": bytes([87]),
+            "00002a46-0000-1000-8000-00805f9b34fb": b"fall",
+            "0000feaa-0000-1000-8000-00805f9b34fb": b"unknown",
+        }
+
+        data = decode_service_data("00:09:1F:8A:BC:21", service_data, 1700000000.4)
+
+        self.assertEqual(
+            [(type(d), d.data) for d in data],
+            [
+                (HeartRateData, {"rate": 72}),
+                (PressureData, {"level": 101325}),
+                (TemperatureData, {"level": -5}),
+                (BatteryLevelData, {"level": 87}),
+                (AlertData, {"id": "fall"}),
+            ],
+        )
+        self.assertTrue(all(d.address == "00:09:1F:8A:BC:21" for d in data))
+        self.assertTrue(all(d.timestamp == 1700000000 for d in data))
+
+    def test_invalid_utf8(self):
+        data = decode_service_data(
+            "00:09:1F:8A:BC:21",
+            {"00002a46-0000-1000-8000-00805f9b34fb": b"\xff\xfe"},
+            1700000000,
+        )
+        self.assertEqual(data[0].data, {"id": None})
+
+
+class TestAdvertisementRate(unittest.TestCase):
+    def test_rate_per_window(self):
+        now = [100.0]
+        counter = AdvertisementRate(clock=lambda: now[0])
+        for _ in range(20):
+            counter.hit()
+        now[0] += 4
+        self.assertEqual(counter.rate(), 5.0)
+
+        # a new window starts with every call
+        counter.hit()
+        now[0] += 2
+        self.assertEqual(counter.rate(), 0.5)
+        self.assertEqual(counter.count, 21)
+        self.assertEqual(counter.rate(), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
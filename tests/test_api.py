@@ -0,0 +1,116 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+try:
+    from bcms.api import BackendAPI
+except ImportError:
+    BackendAPI = None
+
+# Backend latency of the stub server
+LATENCY = 0.5
+
+
+class StubBackend(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, body: dict):
+        time.sleep(LATENCY)
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.clients.add(self.client_address)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.encodings.append(self.headers.get("Content-Encoding"))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        self.server.bodies.append(json.loads(body))
+        self.server.requests += 1
+        self.reply({})
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.reply({"timestamp": 1700000000, "createdAt": "2023-11-14T22:13:20Z"})
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(BackendAPI is None, "px_python_shared / px_device_identity are not installed")
+class TestBackendAPI(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubBackend)
+        self.server.requests = 0
+        self.server.bodies = []
+        self.server.encodings = []
+        self.server.clients = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.api = BackendAPI("identifier")
+        self.api.app_host = f"http://127.0.0.1:{self.server.server_port}"
+        patches = [
+            mock.patch.object(self.api, "ready_api"),
+            mock.patch.object(self.api, "access_token", return_value="token"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    async def test_event_loop_stays_responsive(self):
+        ticks = []
+
+        async def ticker():
+            while len(ticks) < 40:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        _, _, timestamp = await asyncio.gather(
+            ticker(),
+            self.api.submit_iot_data([{"iotDeviceId": "id1", "data": []}]),
+            self.api.last_iot_device_data_submission("id1"),
+        )
+
+        self.assertEqual(timestamp, 1700000000)
+        self.assertEqual(self.server.requests, 2)
+        longest_gap = max(b - a for a, b in zip(ticks, ticks[1:]))
+        self.assertLess(longest_gap, LATENCY / 2)
+
+    async def test_connections_are_reused(self):
+        for _ in range(3):
+            await self.api.submit_iot_data([])
+        self.api.submit_iot_data_sync([])
+
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(len(self.server.clients), 1)
+
+
+    async def test_compressed_submission(self):
+        self.api.compression = "gzip"
+        self.api.compression_min_bytes = 100
+        small = [{"iotDeviceId": "id1", "dataType": "heart_rate", "data": []}]
+        large = [{**small[0], "data": [{"timestamp": i, "data": {"rate": 60}} for i in range(50)]}]
+
+        await self.api.submit_iot_data(small)
+        await self.api.submit_iot_data(large)
+
+        self.assertEqual(self.server.encodings, [None, "gzip"])
+        self.assertEqual(self.server.bodies, [{"data": small}, {"data": large}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import base64
+import json
+import threading
+import time
+import unittest
+from bcms.auth import ExpiringCache, token_expiry
+
+
+def jwt(claims: dict) -> str:
+    def encode(part: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+
+    return f"{encode({'alg': 'none'})}.{encode(claims)}.signature"
+
+
+class TestTokenExpiry(unittest.TestCase):
+    def test_expiry(self):
+        self.assertEqual(token_expiry({"expires_in": 600}, 1000, 300), 1600)
+        self.assertEqual(token_expiry({"expires_at": 5000}, 1000, 300), 5000)
+        self.assertEqual(token_expiry({"access_token": jwt({"exp": 4000})}, 1000, 300), 4000)
+        self.assertEqual(token_expiry({"access_token": "opaque"}, 1000, 300), 1300)
+        self.assertEqual(token_expiry({"access_token": "a.b%.c"}, 1000, 300), 1300)
+
+
+class TestExpiringCache(unittest.TestCase):
+    def test_refresh_before_expiry(self):
+        now = [1000.0]
+        values = iter(["token1", "token2"])
+        cache = ExpiringCache(
+            lambda: (next(values), now[0] + 300), refresh_margin=60, clock=lambda: now[0]
+        )
+
+        self.assertEqual(cache.get(), "token1")
+        now[0] += 200
+        self.assertEqual(cache.get(), "token1")
+        now[0] += 50
+        self.assertEqual(cache.get(), "token2")
+        self.assertEqual(cache.stats(), {"hits": 1, "fetches": 2})
+
+    def test_invalidate(self):
+        values = iter(["token1", "token2"])
+        cache = ExpiringCache(lambda: (next(values), time.time() + 300))
+
+        self.assertEqual(cache.get(), "token1")
+        cache.invalidate()
+        self.assertEqual(cache.get(), "token2")
+
+    def test_invalidate_during_get(self):
+        # another thread invalidates (for ex. on a 401) while get() checks the expiry
+        invalidate = []
+
+        def clock():
+            if invalidate:
+                invalidate.clear()
+                cache.invalidate()
+            return 1000.0
+
+        cache = ExpiringCache(lambda: ("token", 1300.0), clock=clock)
+
+        self.assertEqual(cache.get(), "token")
+        invalidate.append(True)
+        self.assertEqual(cache.get(), "token")
+        self.assertEqual(cache.stats(), {"hits": 1, "fetches": 1})
+
+    def test_single_flight(self):
+        calls = []
+
+        def fetch():
+            calls.append(None)
+            time.sleep(0.05)
+            return "token", time.time() + 300
+
+        cache = ExpiringCache(fetch)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get())) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["token"] * 8)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
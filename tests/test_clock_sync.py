@@ -0,0 +1,51 @@
+import unittest
+from bcms.clock_sync import ClockDriftModel
+
+HOUR = 60 * 60
+
+
+class TestClockDriftModel(unittest.TestCase):
+    def test_unknown_device_is_checked(self):
+        model = ClockDriftModel()
+        self.assertTrue(model.needs_check("address1", 0))
+
+    def test_skip_while_in_sync(self):
+        model = ClockDriftModel(threshold=60, min_interval=600)
+        # drifts 1 second per hour
+        model.record("address1", 0, 0, corrected=False)
+        self.assertTrue(model.needs_check("address1", 60))
+        model.record("address1", 60, 0, corrected=False)
+        model.record("address1", HOUR, 1, corrected=False)
+
+        self.assertFalse(model.needs_check("address1", 2 * HOUR))
+        self.assertFalse(model.needs_check("address1", 20 * HOUR))
+        self.assertEqual(model.stats(), {"checked": 1, "skipped": 2})
+
+    def test_check_when_drift_may_exceed_threshold(self):
+        model = ClockDriftModel(threshold=60, margin=2, min_interval=600)
+        # drifts 30 seconds per hour
+        model.record("address1", 0, 0, corrected=False)
+        model.record("address1", HOUR, 30, corrected=True)
+
+        self.assertFalse(model.needs_check("address1", 2 * HOUR))
+        self.assertTrue(model.needs_check("address1", 3 * HOUR))
+
+    def test_max_age(self):
+        model = ClockDriftModel(max_age=24 * HOUR)
+        model.record("address1", 0, 0, corrected=False)
+        model.record("address1", HOUR, 0, corrected=False)
+
+        self.assertFalse(model.needs_check("address1", 24 * HOUR))
+        self.assertTrue(model.needs_check("address1", 25 * HOUR))
+
+    def test_forget(self):
+        model = ClockDriftModel()
+        model.record("address1", 0, 0, corrected=False)
+        model.record("address1", HOUR, 0, corrected=False)
+        model.forget("address1")
+
+        self.assertTrue(model.needs_check("address1", HOUR + 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import math
+import struct
+import unittest
+from bcms import codecs
+from bcms.codecs import (
+    decode_blood_pressure_reading,
+    decode_blood_pressure_records,
+    decode_sfloat,
+)
+
+
+def sfloat(mantissa, exponent=0):
+    return ((exponent & 0xF) << 12) | (mantissa & 0x0FFF)
+
+
+# mmHg, with time stamp, pulse rate, user id and status
+RECORD_MMHG = (
+    bytes([0x1E])
+    + struct.pack("<HHH", sfloat(120), sfloat(80), sfloat(93))
+    + struct.pack("<HBBBBB", 2024, 5, 6, 7, 8, 9)
+    + struct.pack("<H", sfloat(725, -1))
+    + bytes([1])
+    + struct.pack("<H", 0x0004)
+)
+# kPa, no optional fields
+RECORD_KPA = bytes([0x01]) + struct.pack(
+    "<HHH", sfloat(160, -1), sfloat(107, -1), sfloat(124, -1)
+)
+
+
+class TestSfloat(unittest.TestCase):
+    def test_values(self):
+        self.assertEqual(decode_sfloat(sfloat(120)), 120.0)
+        self.assertEqual(decode_sfloat(sfloat(-5)), -5.0)
+        self.assertEqual(decode_sfloat(sfloat(1234, -1)), 123.4)
+        self.assertEqual(decode_sfloat(sfloat(3, 2)), 300.0)
+
+    def test_special_values(self):
+        self.assertTrue(math.isnan(decode_sfloat(0x07FF)))
+        self.assertTrue(math.isnan(decode_sfloat(0x0800)))
+        self.assertEqual(decode_sfloat(0x07FE), math.inf)
+        self.assertEqual(decode_sfloat(0x0802), -math.inf)
+
+
+class TestDecodeBloodPressureRecords(unittest.TestCase):
+    def check(self, use_numpy):
+        records = decode_blood_pressure_records(
+            [RECORD_MMHG, b"\x1e\x00", RECORD_KPA], use_numpy=use_numpy
+        )
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records.invalid, 1)
+        self.assertEqual(list(records.positions), [0, 2])
+        self.assertEqual(list(records.systolic), [120.0, 16.0])
+        self.assertEqual(list(records.diastolic), [80.0, 10.7])
+        self.assertEqual(list(records.kpa), [0, 1])
+        self.assertEqual(records.pulse_rate[0], 72.5)
+        self.assertTrue(math.isnan(records.pulse_rate[1]))
+        self.assertEqual(
+            [records.year[0], records.month[0], records.second[0]], [2024, 5, 9]
+        )
+        self.assertEqual(list(records.status), [4, 0])
+
+    def test_python(self):
+        self.check(use_numpy=False)
+
+    @unittest.skipIf(codecs.np is None, "NumPy is not installed")
+    def test_numpy(self):
+        self.check(use_numpy=True)
+
+
+class TestDecodeBloodPressureReading(unittest.TestCase):
+    def test_reading(self):
+        self.assertEqual(decode_blood_pressure_reading(RECORD_MMHG), (120.0, 80.0))
+        self.assertEqual(decode_blood_pressure_reading(RECORD_KPA), (16.0, 10.7))
+
+    def test_invalid(self):
+        self.assertIsNone(decode_blood_pressure_reading(b"\x1e\x00"))
+        # NaN / infinity instead of a reading
+        for raw in (0x07FF, 0x07FE, 0x0802):
+            record = bytes([0x00]) + struct.pack("<HHH", raw, sfloat(80), sfloat(93))
+            self.assertIsNone(decode_blood_pressure_reading(record))
+
+
+if __name__ == "__main__":
+    unittest.main()
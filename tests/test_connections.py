@@ -0,0 +1,137 @@
+import asyncio
+import unittest
+from bcms.connections import ConnectionScheduler, NotificationWaiter
+from bcms.retry import CircuitBreaker
+
+
+class TestConnectionScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_limit(self):
+        scheduler = ConnectionScheduler(limit=2)
+        running = 0
+        most = 0
+
+        def session():
+            async def run():
+                nonlocal running, most
+                running += 1
+                most = max(most, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+            return run
+
+        results = await scheduler.run_all({f"address{i}": session() for i in range(5)})
+
+        self.assertEqual(most, 2)
+        self.assertTrue(all(results.values()))
+        self.assertEqual(len(scheduler.report()), 5)
+        self.assertEqual(scheduler.report()["address0"]["sessions"], 1)
+
+    async def test_timeout_and_failure(self):
+        scheduler = ConnectionScheduler(limit=2, timeout=0.01)
+
+        async def slow():
+            await asyncio.sleep(1)
+
+        async def failing():
+            raise Exception("Connection failed")
+
+        results = await scheduler.run_all({"address1": slow, "address2": failing})
+
+        self.assertEqual(results, {"address1": False, "address2": False})
+        report = scheduler.report()
+        self.assertEqual(report["address1"]["timeouts"], 1)
+        self.assertEqual(report["address2"]["failures"], 1)
+
+    async def test_timeout_counts_as_failure(self):
+        # a hanging session is cancelled; it has to count that itself, for ex. with a CircuitBreaker
+        scheduler = ConnectionScheduler(limit=1, timeout=0.01)
+        breaker = CircuitBreaker(threshold=2, cooldown=1)
+
+        async def hanging():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                breaker.failure("address1")
+                raise
+
+        for _ in range(2):
+            await scheduler.run("address1", hanging)
+
+        self.assertFalse(breaker.allow("address1"))
+
+    async def test_one_session_per_device(self):
+        scheduler = ConnectionScheduler(limit=2)
+        calls = 0
+
+        async def session():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+
+        results = await asyncio.gather(
+            scheduler.run("address1", session), scheduler.run("address1", session)
+        )
+
+        self.assertEqual(results, [True, False])
+        self.assertEqual(calls, 1)
+
+    def test_invalid_limit(self):
+        with self.assertRaises(ValueError):
+            ConnectionScheduler(limit=0)
+
+
+class TestNotificationWaiter(unittest.IsolatedAsyncioTestCase):
+    async def test_idle(self):
+        waiter = NotificationWaiter(idle=0.05, max_wait=5)
+
+        async def notify():
+            for _ in range(3):
+                await asyncio.sleep(0.01)
+                waiter.notified()
+
+        _, reason = await asyncio.gather(notify(), waiter.wait())
+
+        self.assertEqual(reason, "idle")
+        self.assertEqual(waiter.notifications, 3)
+
+    async def test_idle_starts_at_first_notification(self):
+        waiter = NotificationWaiter(idle=0.05, max_wait=5)
+
+        async def notify():
+            # slower to start than idle
+            await asyncio.sleep(0.15)
+            waiter.notified()
+
+        _, reason = await asyncio.gather(notify(), waiter.wait())
+
+        self.assertEqual(reason, "idle")
+        self.assertEqual(waiter.notifications, 1)
+
+    async def test_no_notifications(self):
+        waiter = NotificationWaiter(idle=0.01, max_wait=0.1)
+        waiter.start()
+
+        self.assertEqual(await waiter.wait(), "max_wait")
+
+    async def test_disconnected(self):
+        waiter = NotificationWaiter(idle=5, max_wait=5)
+        asyncio.get_running_loop().call_later(0.01, waiter.disconnected)
+
+        self.assertEqual(await waiter.wait(), "disconnected")
+
+    async def test_max_wait(self):
+        waiter = NotificationWaiter(idle=0.5, max_wait=0.1)
+
+        async def notify():
+            for _ in range(10):
+                await asyncio.sleep(0.02)
+                waiter.notified()
+
+        _, reason = await asyncio.gather(notify(), waiter.wait())
+
+        self.assertEqual(reason, "max_wait")
+
+
+if __name__ == "__main__":
+    unittest.main()
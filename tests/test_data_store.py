@@ -1,11 +1,19 @@
 import unittest
+import os
+import tempfile
 import time
+from unittest import mock
 from bcms.data_store import (
     BCMSDeviceDataDB,
     BatteryLevelData,
     HeartRateData,
+    BloodPressureData,
+    AlertData,
     limit_iot_data_sample_rate,
+    dump_iot_data_for_api_submission,
 )
+from bcms.devices_classes import BCMSDeviceInfoWithLastSeen
+from bcms.sampling import downsample
 
 
 class TestBCMSDeviceDataDB(unittest.TestCase):
@@ -76,6 +84,242 @@ class TestBCMSDeviceDataDB(unittest.TestCase):
         self.assertEqual(data[0].data, data2.data)
         self.assertEqual(data[0].address, data2.address)
 
+    def test_batched_add(self):
+        db = BCMSDeviceDataDB(batch_size=3, flush_interval=60)
+        now = round(time.time())
+        db.add(BatteryLevelData({"level": 80}, "00:09:1F:8A:BC:21", now))
+        db.add(BatteryLevelData({"level": 70}, "00:09:1F:8A:BC:21", now))
+
+        # Nothing written yet; both samples are pending
+        self.assertEqual(len(db.pending), 2)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM data").fetchone()[0], 0)
+
+        # Third sample reaches the batch size
+        db.add(BatteryLevelData({"level": 60}, "00:09:1F:8A:BC:21", now))
+        self.assertEqual(len(db.pending), 0)
+        self.assertEqual(db.conn.execute("SELECT COUNT(*) FROM data").fetchone()[0], 3)
+
+        # Reads flush pending samples
+        db.add(HeartRateData({"rate": 70}, "C5:DF:AE:FC:44:CB", now))
+        self.assertEqual(len(db.get()), 4)
+
+    def test_typed_values_round_trip(self):
+        now = round(time.time())
+        samples = [
+            BatteryLevelData({"level": 80}, "00:09:1F:8A:BC:21", now),
+            BloodPressureData({"sys": 120.5, "dias": 80}, "00:09:1F:8A:BC:21", now),
+            AlertData({"id": "123"}, "C5:DF:AE:FC:44:CB", now),
+        ]
+        for sample in samples:
+            self.db.add(sample)
+
+        data = self.db.get()
+
+        self.assertEqual([type(d) for d in data], [type(d) for d in samples])
+        self.assertEqual([d.data for d in data], [d.data for d in samples])
+        self.assertIsInstance(data[0].level, int)
+        self.assertIsInstance(data[2].id, str)
+        self.assertEqual(data[1], samples[1])
+
+    def test_iter_window(self):
+        now = round(time.time())
+        for i in range(120):
+            self.db.add(
+                BatteryLevelData({"level": i}, "00:09:1F:8A:BC:21", now - 120 + i // 2)
+            )
+        self.db.add(HeartRateData({"rate": 70}, "C5:DF:AE:FC:44:CB", now))
+
+        # More rows than page_size, and more than get()'s default limit
+        data = list(
+            self.db.iter_window(
+                to_time=now - 1, device_address="00:09:1F:8A:BC:21", page_size=7
+            )
+        )
+
+        self.assertEqual([d.level for d in data], list(range(120)))
+        self.assertEqual(len(list(self.db.iter_window(from_time=now))), 1)
+        self.assertEqual(list(self.db.iter_window(from_time=now + 1)), [])
+
+    def test_get_buckets_matches_downsample(self):
+        now = round(time.time())
+        now -= now % 60
+        samples = []
+        # unique timestamps per address and type; ties within a bucket may pick any row
+        for i in range(40):
+            samples.append(
+                BatteryLevelData({"level": i % 7}, "00:09:1F:8A:BC:21", now + i)
+            )
+            samples.append(HeartRateData({"rate": 60 + i}, "C5:DF:AE:FC:44:CB", now + i))
+            samples.append(
+                BloodPressureData(
+                    {"sys": 120 + i % 3, "dias": 80 - i % 5},
+                    "C5:DF:AE:FC:44:CB",
+                    now + i * 2,
+                )
+            )
+        for sample in samples:
+            self.db.add(sample)
+
+        def as_tuples(data):
+            return sorted(
+                (d.address, d.name, d.timestamp, tuple(d.values())) for d in data
+            )
+
+        for strategy in ("first", "last", "mean", "min", "max"):
+            with self.subTest(strategy=strategy):
+                self.assertEqual(
+                    as_tuples(self.db.get_buckets(now, now + 100, 4, strategy)),
+                    as_tuples(downsample(samples, 4, strategy)),
+                )
+
+        intervals = {"heart_rate": 10}
+        self.assertEqual(
+            as_tuples(
+                self.db.get_buckets(now, now + 100, 4, "first", intervals=intervals)
+            ),
+            as_tuples(downsample(samples, 4, "first", intervals)),
+        )
+        self.assertEqual(
+            len(self.db.get_buckets(now, now + 100, 4, device_address="00:09:1F:8A:BC:21")),
+            10,
+        )
+
+    def test_get_buckets_windows(self):
+        now = round(time.time())
+        now -= now % 60
+        for i in range(20):
+            self.db.add(BatteryLevelData({"level": i}, "00:09:1F:8A:BC:21", now + i))
+            self.db.add(HeartRateData({"rate": 60 + i}, "C5:DF:AE:FC:44:CB", now + i))
+            self.db.add(HeartRateData({"rate": 60 + i}, "E4:5F:01:8B:CF:22", now + i))
+        windows = {
+            "00:09:1F:8A:BC:21": now + 10,
+            "C5:DF:AE:FC:44:CB": None,
+            "unknown": now,
+        }
+
+        result = self.db.get_buckets(to_time=now + 15, interval=4, windows=windows)
+
+        expected = []
+        for address, from_time in windows.items():
+            expected.extend(
+                self.db.get_buckets(from_time, now + 15, 4, device_address=address)
+            )
+        self.assertEqual(
+            sorted((d.address, d.timestamp, d.values()) for d in result),
+            sorted((d.address, d.timestamp, d.values()) for d in expected),
+        )
+        timestamps = [d.timestamp for d in result]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual({d.address for d in result}, set(list(windows)[:2]))
+        self.assertEqual(self.db.get_buckets(windows={}), [])
+
+    def test_get_buckets_limit(self):
+        now = round(time.time())
+        for i in range(20):
+            self.db.add(BatteryLevelData({"level": i}, "00:09:1F:8A:BC:21", now + i))
+            self.db.add(HeartRateData({"rate": 60 + i}, "C5:DF:AE:FC:44:CB", now + i))
+        windows = {"00:09:1F:8A:BC:21": None, "C5:DF:AE:FC:44:CB": now + 10}
+
+        everything = self.db.get_buckets(to_time=now + 20, interval=1, windows=windows)
+        limited = self.db.get_buckets(to_time=now + 20, interval=1, windows=windows, limit=15)
+
+        self.assertEqual(len(limited), 15)
+        # the earliest samples; all of them before the last one's timestamp
+        last = limited[-1].timestamp
+        self.assertEqual(
+            sorted((d.address, d.timestamp) for d in limited if d.timestamp < last),
+            sorted((d.address, d.timestamp) for d in everything if d.timestamp < last),
+        )
+        with mock.patch("bcms.data_store._MAX_WINDOWS", 1):
+            self.assertEqual(
+                len(self.db.get_buckets(to_time=now + 20, interval=1, windows=windows, limit=15)),
+                15,
+            )
+
+
+class TestBCMSDeviceDataDBFile(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_file = os.path.join(self.temp_dir.name, "data.sqlite")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_survives_reopen(self):
+        now = round(time.time())
+        db = BCMSDeviceDataDB(path=self.temp_file, batch_size=10)
+        self.assertEqual(
+            db.conn.execute("PRAGMA journal_mode").fetchone()[0], "wal"
+        )
+        db.add(BatteryLevelData({"level": 80}, "00:09:1F:8A:BC:21", now))
+        db.set_watermarks({"00:09:1F:8A:BC:21": now - 10})
+        db.close()
+
+        db = BCMSDeviceDataDB(path=self.temp_file)
+        data = db.get()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0].data, {"level": 80})
+        self.assertEqual(db.get_watermark("00:09:1F:8A:BC:21"), now - 10)
+        self.assertIsNone(db.get_watermark("C5:DF:AE:FC:44:CB"))
+        db.close()
+
+    def test_evicts_oldest(self):
+        now = round(time.time())
+        db = BCMSDeviceDataDB(path=self.temp_file, max_rows=5)
+        for i in range(8):
+            db.add(BatteryLevelData({"level": i}, "00:09:1F:8A:BC:21", now + i))
+
+        data = list(db.iter_window())
+        self.assertEqual([d.level for d in data], [3, 4, 5, 6, 7])
+        self.assertEqual(db.row_count, 5)
+        db.close()
+
+    def test_clear_old_data_keeps_unsubmitted(self):
+        now = round(time.time())
+        db = BCMSDeviceDataDB(path=self.temp_file)
+        db.add(BatteryLevelData({"level": 80}, "00:09:1F:8A:BC:21", now - 300))
+        db.add(HeartRateData({"rate": 70}, "C5:DF:AE:FC:44:CB", now - 300))
+        db.set_watermarks({"00:09:1F:8A:BC:21": now, "C5:DF:AE:FC:44:CB": now - 400})
+
+        db.clear_old_data(60, keep_unsubmitted=True)
+
+        data = db.get()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0].address, "C5:DF:AE:FC:44:CB")
+        db.close()
+
+    def test_unknown_data_type_is_skipped(self):
+        # for ex. stored by a plugin that's no longer installed
+        now = round(time.time())
+        db = BCMSDeviceDataDB(path=self.temp_file)
+        db.add(BatteryLevelData({"level": 80}, "00:09:1F:8A:BC:21", now))
+        db.flush()
+        db.conn.execute(
+            "INSERT INTO data (type_id, address, timestamp) VALUES (999, '00:09:1F:8A:BC:21', ?)",
+            (now,),
+        )
+        db.conn.commit()
+        db.close()
+
+        db = BCMSDeviceDataDB(path=self.temp_file)
+        self.assertEqual(len(db.get()), 1)
+        self.assertEqual(len(list(db.iter_window())), 1)
+        self.assertEqual(len(db.get_buckets(to_time=now)), 1)
+        self.assertEqual(len(db.get_buckets(windows={"00:09:1F:8A:BC:21": None})), 1)
+        db.close()
+
+    def test_clear_old_data_without_watermark(self):
+        # devices that aren't registered have no watermark; their data ages out
+        now = round(time.time())
+        db = BCMSDeviceDataDB(path=self.temp_file)
+        db.add(BatteryLevelData({"level": 80}, "00:09:1F:8A:BC:21", now - 300))
+        db.add(BatteryLevelData({"level": 80}, "00:09:1F:8A:BC:21", now - 10))
+
+        db.clear_old_data(60, keep_unsubmitted=True)
+
+        self.assertEqual([sample.timestamp for sample in db.get()], [now - 10])
+        db.close()
+
 
 class DataTypeTest(unittest.TestCase):
     def test_limit_iot_data_sample_rate(self):
@@ -99,3 +343,42 @@ class DataTypeTest(unittest.TestCase):
         # (i.e., at least 2 seconds apart)
         for i in range(1, len(result)):
             self.assertGreaterEqual(result[i].timestamp - result[i - 1].timestamp, 2)
+
+    def test_dump_iot_data_for_api_submission(self):
+        registered = [
+            BCMSDeviceInfoWithLastSeen("address1", "one", True, False, "id1", True),
+            BCMSDeviceInfoWithLastSeen("address2", "two", True, False, "id2", True),
+        ]
+        data = [
+            BatteryLevelData({"level": 90}, "address1", 1),
+            HeartRateData({"rate": 60}, "address2", 1),
+            BatteryLevelData({"level": 80}, "address3", 2),
+            HeartRateData({"rate": 70}, "address1", 2),
+            BatteryLevelData({"level": 70}, "address1", 3),
+        ]
+
+        result = dump_iot_data_for_api_submission(data, registered)
+
+        self.assertEqual(
+            result,
+            [
+                {
+                    "iotDeviceId": "id1",
+                    "dataType": "battery_level",
+                    "data": [
+                        {"timestamp": 1, "data": {"level": 90}},
+                        {"timestamp": 3, "data": {"level": 70}},
+                    ],
+                },
+                {
+                    "iotDeviceId": "id1",
+                    "dataType": "heart_rate",
+                    "data": [{"timestamp": 2, "data": {"rate": 70}}],
+                },
+                {
+                    "iotDeviceId": "id2",
+                    "dataType": "heart_rate",
+                    "data": [{"timestamp": 1, "data": {"rate": 60}}],
+                },
+            ],
+        )
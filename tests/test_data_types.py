@@ -0,0 +1,95 @@
+import unittest
+from bcms.advertisement import decode_service_data
+from bcms.codecs import decode_unsigned, normalize_uuid
+from bcms.data_store import BCMSDeviceDataDB, dump_iot_data_for_api_submission
+from bcms.data_types import (
+    ADVERTISEMENT_DECODERS,
+    DATA_TYPES,
+    DataType,
+    HumidityData,
+    register_data_type,
+)
+from bcms.devices_classes import BCMSDeviceInfoWithLastSeen
+
+
+class TestRegisterDataType(unittest.TestCase):
+    def tearDown(self):
+        DATA_TYPES.pop(1001, None)
+        ADVERTISEMENT_DECODERS.pop(normalize_uuid("ffe1"), None)
+
+    def test_plugin_data_type(self):
+        def decode_co2(raw: bytes) -> dict:
+            return {"ppm": decode_unsigned(raw[:2]), "quality": "good" if raw[2] else "poor"}
+
+        @register_data_type(1001, "co2", ("ppm", "quality"), uuid="ffe1", decode=decode_co2)
+        class CO2Data(DataType):
+            def __init__(self, data: dict, address: str, timestamp: int):
+                super().__init__(data, address, timestamp, self.name)
+
+        # Decoded from advertisements, with every field
+        data = decode_service_data(
+            "00:09:1F:8A:BC:21",
+            {normalize_uuid("ffe1"): (812).to_bytes(2, "little") + bytes([1])},
+            1700000000,
+        )
+        self.assertIsInstance(data[0], CO2Data)
+        self.assertEqual(data[0].data, {"ppm": 812, "quality": "good"})
+
+        # Stored and restored
+        db = BCMSDeviceDataDB()
+        db.add(CO2Data({"ppm": 812, "quality": "good"}, "00:09:1F:8A:BC:21", 1700000000))
+        restored = db.get()
+        self.assertIsInstance(restored[0], CO2Data)
+        self.assertEqual(restored[0].data, {"ppm": 812, "quality": "good"})
+
+        # Submitted by name
+        registered = [
+            BCMSDeviceInfoWithLastSeen("00:09:1F:8A:BC:21", "co2", True, False, "id1", True)
+        ]
+        payload = dump_iot_data_for_api_submission(restored, registered)
+        self.assertEqual(payload[0]["dataType"], "co2")
+
+    def test_decoder_missing_fields(self):
+        @register_data_type(
+            1001, "co2", ("ppm", "quality"), uuid="ffe1", decode=decode_unsigned
+        )
+        class CO2Data(DataType):
+            def __init__(self, data: dict, address: str, timestamp: int):
+                super().__init__(data, address, timestamp, self.name)
+
+        # a multi-field type whose decoder returns one value is skipped, not half stored
+        raw = {normalize_uuid("ffe1"): (812).to_bytes(2, "little")}
+        data = decode_service_data("00:09:1F:8A:BC:21", raw, 1700000000)
+        self.assertEqual(data, [])
+
+        db = BCMSDeviceDataDB()
+        db.add_many(
+            data
+            + [
+                CO2Data({"ppm": 812}, "00:09:1F:8A:BC:21", 1700000000),
+                CO2Data({"ppm": 640, "quality": "good"}, "00:09:1F:8A:BC:21", 1700000001),
+            ]
+        )
+        db.flush()
+        self.assertEqual([d.data for d in db.get()], [{"ppm": 640, "quality": "good"}])
+
+    def test_invalid_registrations(self):
+        with self.assertRaises(ValueError):
+            register_data_type(1, "taken", ("level",))(type("Taken", (DataType,), {}))
+        with self.assertRaises(ValueError):
+            register_data_type(1001, "too_many", ("a", "b", "c", "d"))
+        with self.assertRaises(ValueError):
+            register_data_type(1001, "no_decode", ("a",), uuid="ffe1")
+
+    def test_humidity_is_decoded(self):
+        data = decode_service_data(
+            "00:09:1F:8A:BC:21",
+            {normalize_uuid("2a6f"): (4550).to_bytes(2, "little")},
+            1700000000,
+        )
+        self.assertIsInstance(data[0], HumidityData)
+        self.assertEqual(data[0].level, 4550)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 import tempfile
 import os
@@ -55,6 +56,62 @@ class TestBCMDeviceMemory(unittest.TestCase):
         # Check that the device was removed
         self.assertEqual(self.memory.get_all(), [])
 
+    def test_update_only_on_change(self):
+        device = BCMSDeviceInfo("00:09:1F:8A:BC:21", "A&D_UA-651BLE_8ABC21", True, False)
+        self.memory.add(device)
+        self.memory.get(device.address).last_seen = 0
+
+        # Same name; only last seen changes
+        self.assertFalse(self.memory.update(device.address, name="A&D_UA-651BLE_8ABC21"))
+        self.assertGreater(self.memory.get(device.address).last_seen, 0)
+        self.assertEqual(self.memory.updates_skipped, 1)
+
+        # Equal, but not identical string
+        self.assertFalse(
+            self.memory.update(device.address, name="".join(["A&D_UA-651BLE_", "8ABC21"]))
+        )
+        self.assertEqual(self.memory.updates_skipped, 2)
+
+        self.assertTrue(self.memory.update(device.address, name="New name"))
+        self.assertEqual(self.memory.get(device.address).name, "New name")
+        self.assertEqual(self.memory.updates_applied, 2)
+
+        # Replacing with the same values is skipped as well
+        self.memory.replace(BCMSDeviceInfo("00:09:1F:8A:BC:21", "New name", True, False))
+        self.assertEqual(self.memory.updates_skipped, 3)
+
+        # Unknown device
+        self.assertFalse(self.memory.update("C5:DF:AE:FC:44:CB", name="Unknown"))
+
+    def test_views(self):
+        self.memory.add(BCMSDeviceInfo("00:09:1F:8A:BC:21", "A", True, False, "id", True))
+        self.memory.add(BCMSDeviceInfo("C5:DF:AE:FC:44:CB", "B"))
+        self.memory.add(BCMSDeviceInfo("C5:DF:AE:FC:44:CC", "C", False, True))
+
+        self.assertTrue(self.memory.exists("C5:DF:AE:FC:44:CB"))
+        self.assertEqual(
+            [d.address for d in self.memory.get_registered()], ["00:09:1F:8A:BC:21"]
+        )
+        self.assertEqual(
+            [d.address for d in self.memory.get_approved_or_paired()],
+            ["00:09:1F:8A:BC:21", "C5:DF:AE:FC:44:CC"],
+        )
+
+        # Views follow replace, mark_paired and remove
+        self.memory.replace(BCMSDeviceInfo("00:09:1F:8A:BC:21", "A"))
+        self.memory.mark_paired("C5:DF:AE:FC:44:CB")
+        self.memory.remove("C5:DF:AE:FC:44:CC")
+
+        self.assertEqual(self.memory.get_registered(), [])
+        self.assertEqual(
+            [d.address for d in self.memory.get_approved_or_paired()],
+            ["C5:DF:AE:FC:44:CB"],
+        )
+        self.assertEqual(
+            [d.address for d in self.memory.get_all()],
+            ["C5:DF:AE:FC:44:CB", "00:09:1F:8A:BC:21"],
+        )
+
 
 class TestBCMSDeviceDB(unittest.TestCase):
     def setUp(self):
@@ -157,5 +214,49 @@ class TestBCMSDeviceDB(unittest.TestCase):
         self.assertEqual(db.get_all(), [])
 
 
+class TestBCMDeviceMemorySaveInterval(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_file = os.path.join(self.temp_dir.name, "devices.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read(self):
+        with open(self.temp_file, "r") as f:
+            return json.load(f)
+
+    async def test_rapid_updates_write_once(self):
+        db = BCMDeviceMemory(file_path=self.temp_file, save_interval=0.05)
+        for i in range(20):
+            db.replace(BCMSDeviceInfo("00:09:1F:8A:BC:21", f"Name {i}", True, False))
+
+        # Nothing written yet
+        self.assertEqual(db.writer.writes, 0)
+        self.assertFalse(os.path.exists(self.temp_file))
+
+        await asyncio.sleep(0.2)
+
+        self.assertEqual(db.writer.writes, 1)
+        self.assertEqual(self.read()[0]["name"], "Name 19")
+
+        # No temporary files are left behind
+        self.assertEqual(os.listdir(self.temp_dir.name), ["devices.json"])
+
+    async def test_flush(self):
+        db = BCMDeviceMemory(file_path=self.temp_file, save_interval=60)
+        db.add(BCMSDeviceInfo("00:09:1F:8A:BC:21", "A&D_UA-651BLE_8ABC21", True, False))
+        db.add(BCMSDeviceInfo("C5:DF:AE:FC:44:CB", "Bangle.js 44cb", True, False))
+        db.flush()
+
+        self.assertEqual(db.writer.writes, 1)
+        self.assertEqual(len(self.read()), 2)
+
+        # Unchanged state is not written again
+        db.replace(BCMSDeviceInfo("C5:DF:AE:FC:44:CB", "Bangle.js 44cb", True, False))
+        db.flush()
+        self.assertEqual(db.writer.writes, 1)
+
+
 if __name__ == "__main__":
     unittest.main()
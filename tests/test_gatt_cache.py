@@ -0,0 +1,68 @@
+import unittest
+from types import SimpleNamespace
+from bcms.gatt_cache import (
+    BLOOD_PRESSURE_MEASUREMENT_UUID,
+    DATE_TIME_UUID,
+    GattCache,
+    GattProfile,
+    device_model,
+)
+
+
+def service(uuid, *characteristics):
+    return SimpleNamespace(
+        uuid=uuid,
+        characteristics=[
+            SimpleNamespace(uuid=char_uuid, handle=handle, properties=properties)
+            for char_uuid, handle, properties in characteristics
+        ],
+    )
+
+
+SERVICES = [
+    service(
+        "0000180f-0000-1000-8000-00805f9b34fb",
+        ("00002a19-0000-1000-8000-00805f9b34fb", 3, ["read"]),
+    ),
+    service(
+        "00001810-0000-1000-8000-00805f9b34fb",
+        (BLOOD_PRESSURE_MEASUREMENT_UUID, 10, ["indicate"]),
+        (DATE_TIME_UUID, 14, ["read", "write"]),
+    ),
+]
+
+
+class TestGattCache(unittest.TestCase):
+    def test_discover(self):
+        profile = GattProfile.discover(SERVICES)
+
+        self.assertEqual(profile.services, ["00001810-0000-1000-8000-00805f9b34fb"])
+        self.assertEqual(
+            profile.handles, {BLOOD_PRESSURE_MEASUREMENT_UUID: 10, DATE_TIME_UUID: 14}
+        )
+        self.assertTrue(profile.has(DATE_TIME_UUID, "write"))
+        self.assertFalse(profile.has(BLOOD_PRESSURE_MEASUREMENT_UUID, "read"))
+        self.assertFalse(profile.has("00002a19-0000-1000-8000-00805f9b34fb"))
+
+    def test_by_address_and_model(self):
+        cache = GattCache()
+        profile = GattProfile.discover(SERVICES)
+        cache.put("address1", "A&D_UA-651BLE_1234", profile)
+
+        self.assertIs(cache.get("address1", "A&D_UA-651BLE_5678"), profile)
+        self.assertIsNone(cache.get("address1", "BLESmart_0001"))
+        self.assertIsNone(cache.get("address2", "A&D_UA-651BLE_1234"))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        cache.invalidate("address1")
+        self.assertIsNone(cache.get("address1", "A&D_UA-651BLE_1234"))
+        self.assertEqual(len(cache), 0)
+
+    def test_device_model(self):
+        self.assertEqual(device_model("BLESmart_00000001"), "BLESmart_")
+        self.assertIsNone(device_model("Unknown"))
+        self.assertIsNone(device_model(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
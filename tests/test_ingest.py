@@ -0,0 +1,45 @@
+import unittest
+from bcms.data_types import BatteryLevelData
+from bcms.ingest import IngestBuffer
+
+
+def sample(i):
+    return BatteryLevelData({"level": i}, "address1", 10 + i)
+
+
+class TestIngestBuffer(unittest.TestCase):
+    def test_drain_in_batches(self):
+        buffer = IngestBuffer(maxlen=10)
+        for i in range(5):
+            self.assertTrue(buffer.put(sample(i)))
+
+        self.assertEqual([d.level for d in buffer.drain(3)], [0, 1, 2])
+        self.assertEqual([d.level for d in buffer.drain(3)], [3, 4])
+        self.assertEqual(buffer.drain(), [])
+        self.assertEqual(buffer.stats()["drained"], 5)
+        self.assertEqual(buffer.high_watermark, 5)
+
+    def test_drop_oldest(self):
+        buffer = IngestBuffer(maxlen=3)
+        results = [buffer.put(sample(i)) for i in range(5)]
+
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual([d.level for d in buffer.drain()], [2, 3, 4])
+        self.assertEqual(buffer.dropped, 2)
+
+    def test_drop_newest(self):
+        buffer = IngestBuffer(maxlen=3, drop="newest")
+        for i in range(5):
+            buffer.put(sample(i))
+
+        self.assertEqual([d.level for d in buffer.drain()], [0, 1, 2])
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual(buffer.accepted, 3)
+
+    def test_unknown_drop_policy(self):
+        with self.assertRaises(ValueError):
+            IngestBuffer(drop="random")
+
+
+if __name__ == "__main__":
+    unittest.main()
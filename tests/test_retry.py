@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+from bcms.retry import CircuitBreaker, RetryPolicy
+
+
+class TestRetryPolicy(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.delays = []
+
+    async def sleep(self, delay):
+        self.delays.append(delay)
+        self.now += delay
+
+    def policy(self, **kwargs):
+        return RetryPolicy(sleep=self.sleep, clock=lambda: self.now, **kwargs)
+
+    def failing(self, failures, error=TimeoutError):
+        calls = []
+
+        async def operation():
+            calls.append(None)
+            if len(calls) <= failures:
+                raise error("failed")
+            return "ok"
+
+        return operation, calls
+
+    async def test_backoff(self):
+        policy = self.policy(attempts=5, base_delay=1, max_delay=3, jitter=0)
+        operation, calls = self.failing(4)
+
+        self.assertEqual(await policy.run(operation), "ok")
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(self.delays, [1, 2, 3, 3])
+        self.assertEqual(policy.stats()["retries"], 4)
+
+    async def test_jitter(self):
+        policy = self.policy(attempts=2, base_delay=2, jitter=0.5)
+        with mock.patch("bcms.retry.random.random", return_value=1.0):
+            self.assertEqual(policy.delay(0), 1.0)
+        with mock.patch("bcms.retry.random.random", return_value=0.0):
+            self.assertEqual(policy.delay(1), 4.0)
+
+    async def test_give_up(self):
+        policy = self.policy(attempts=3, base_delay=1, jitter=0)
+        operation, calls = self.failing(10)
+
+        with self.assertRaises(TimeoutError):
+            await policy.run(operation)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(policy.stats()["gave_up"], 1)
+
+    async def test_deadline(self):
+        policy = self.policy(attempts=10, base_delay=1, jitter=0, deadline=5)
+        operation, calls = self.failing(10)
+
+        with self.assertRaises(TimeoutError):
+            await policy.run(operation)
+        # 1 + 2 seconds of delay fit in the deadline; another 4 don't
+        self.assertEqual(self.delays, [1, 2])
+        self.assertEqual(len(calls), 3)
+
+    async def test_not_retried(self):
+        policy = self.policy(retry_on=(TimeoutError,))
+        operation, calls = self.failing(1, ValueError)
+
+        with self.assertRaises(ValueError):
+            await policy.run(operation)
+        self.assertEqual(len(calls), 1)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_close(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=2)
+        breaker.failure("address1")
+        self.assertTrue(breaker.allow("address1"))
+        breaker.failure("address1")
+
+        self.assertEqual(breaker.stats()["open"], ["address1"])
+        self.assertFalse(breaker.allow("address1"))
+        self.assertFalse(breaker.allow("address1"))
+        self.assertTrue(breaker.allow("address1"))
+        self.assertEqual(breaker.stats(), {"opened": 1, "skipped": 2, "open": []})
+
+    def test_success_resets(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=2)
+        breaker.failure("address1")
+        breaker.success("address1")
+        breaker.failure("address1")
+
+        self.assertTrue(breaker.allow("address1"))
+        self.assertEqual(breaker.opened, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
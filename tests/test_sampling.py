@@ -0,0 +1,80 @@
+import unittest
+from bcms.data_types import AlertData, BatteryLevelData, BloodPressureData, HeartRateData
+from bcms.sampling import downsample
+
+
+class TestDownsample(unittest.TestCase):
+    def setUp(self):
+        self.data = [
+            BatteryLevelData({"level": 90}, "address1", 10),
+            HeartRateData({"rate": 60}, "address1", 10),
+            BatteryLevelData({"level": 80}, "address1", 11),
+            BatteryLevelData({"level": 70}, "address2", 11),
+            BatteryLevelData({"level": 60}, "address1", 12),
+            HeartRateData({"rate": 70}, "address1", 13),
+            BatteryLevelData({"level": 50}, "address1", 13),
+            BatteryLevelData({"level": 40}, "address1", 16),
+        ]
+
+    def levels(self, result, address="address1"):
+        return [
+            (d.timestamp, d.level)
+            for d in result
+            if d.address == address and isinstance(d, BatteryLevelData)
+        ]
+
+    def test_gap_ascending_and_descending(self):
+        ascending = downsample(self.data, 2)
+        self.assertEqual(self.levels(ascending), [(10, 90), (13, 50), (16, 40)])
+
+        # descending input keeps the newest sample, and walks back from there
+        descending = downsample(list(reversed(self.data)), 2)
+        self.assertEqual(self.levels(descending), [(16, 40), (13, 50), (10, 90)])
+
+    def test_first_and_last(self):
+        # buckets of 4 seconds: 8-11, 12-15, 16-19
+        self.assertEqual(
+            self.levels(downsample(self.data, 4, "first")),
+            [(10, 90), (12, 60), (16, 40)],
+        )
+        self.assertEqual(
+            self.levels(downsample(list(reversed(self.data)), 4, "first")),
+            [(10, 90), (12, 60), (16, 40)],
+        )
+        self.assertEqual(
+            self.levels(downsample(self.data, 4, "last")),
+            [(11, 80), (13, 50), (16, 40)],
+        )
+
+    def test_aggregates(self):
+        self.assertEqual(
+            self.levels(downsample(self.data, 4, "mean")),
+            [(10, 85), (12, 55), (16, 40)],
+        )
+        self.assertEqual(
+            self.levels(downsample(self.data, 4, "min")),
+            [(10, 80), (12, 50), (16, 40)],
+        )
+        self.assertEqual(
+            self.levels(downsample(self.data, 4, "max")),
+            [(10, 90), (12, 60), (16, 40)],
+        )
+
+    def test_aggregate_multiple_and_text_fields(self):
+        data = [
+            BloodPressureData({"sys": 120, "dias": 80}, "address1", 10),
+            BloodPressureData({"sys": 130, "dias": 70}, "address1", 11),
+            AlertData({"id": "a"}, "address1", 10),
+            AlertData({"id": "b"}, "address1", 11),
+        ]
+        result = downsample(data, 4, "max")
+        self.assertEqual([d.data for d in result], [{"sys": 130, "dias": 80}, {"id": "b"}])
+
+    def test_per_type_intervals(self):
+        result = downsample(self.data, 2, "first", intervals={"battery_level": 100})
+        self.assertEqual(self.levels(result), [(10, 90)])
+        self.assertEqual(len([d for d in result if isinstance(d, HeartRateData)]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+import asyncio
+import gzip
+import json
+import unittest
+from types import SimpleNamespace
+from bcms import submission
+from bcms.data_store import dump_iot_data_for_api_submission
+from bcms.data_types import BatteryLevelData, HeartRateData
+from bcms.devices_classes import BCMSDeviceInfoWithLastSeen
+from bcms.submission import (
+    SubmissionPipeline,
+    compress_body,
+    encode_iot_data,
+    is_permanent_rejection,
+)
+
+DEVICES = [
+    BCMSDeviceInfoWithLastSeen("address1", "device 1", True, True, "id1", True),
+    BCMSDeviceInfoWithLastSeen("address2", "device 2", True, True, "id2", True),
+]
+
+
+def make_samples():
+    samples = []
+    for i in range(10):
+        samples.append(BatteryLevelData({"level": i}, "address1", 100 + i))
+        samples.append(HeartRateData({"rate": 60 + i}, "address2", 100 + i))
+    samples.append(BatteryLevelData({"level": 1}, "unregistered", 100))
+    return samples
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"{status_code} Error")
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+class Backend:
+    def __init__(self, fail_on=(), delay=0.0, reject=None, status=422):
+        self.bodies = []
+        self.fail_on = fail_on
+        self.delay = delay
+        """reject: rejects bodies with a sample for which this returns True, with status"""
+        self.reject = reject
+        self.status = status
+        self.accepted = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def submit(self, body: bytes):
+        index = len(self.bodies)
+        self.bodies.append(json.loads(body))
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if index in self.fail_on:
+                raise Exception("Internal Server Error")
+            samples = [
+                sample for group in self.bodies[index]["data"] for sample in group["data"]
+            ]
+            if self.reject and any(self.reject(sample) for sample in samples):
+                raise HTTPError(self.status)
+            self.accepted.extend(samples)
+        finally:
+            self.in_flight -= 1
+
+    def samples(self):
+        return sum(len(group["data"]) for body in self.bodies for group in body["data"])
+
+
+class TestSubmissionPipeline(unittest.IsolatedAsyncioTestCase):
+    async def test_chunks_by_samples(self):
+        backend = Backend(delay=0.01)
+        pipeline = SubmissionPipeline(backend.submit, max_samples=6, max_in_flight=2)
+
+        result = await pipeline.run(make_samples(), DEVICES, 200)
+
+        self.assertEqual((result.samples, result.chunks, result.acknowledged), (20, 4, 4))
+        self.assertEqual(backend.samples(), 20)
+        self.assertEqual(backend.most_in_flight, 2)
+        self.assertEqual(result.watermarks, {"address1": 200, "address2": 200})
+
+    async def test_chunks_by_bytes(self):
+        backend = Backend()
+        pipeline = SubmissionPipeline(backend.submit, max_samples=100, max_bytes=300)
+
+        result = await pipeline.run(make_samples(), DEVICES, 200)
+
+        self.assertGreater(result.chunks, 1)
+        self.assertEqual(backend.samples(), 20)
+        for body in backend.bodies:
+            self.assertLessEqual(len(encode_iot_data(body["data"])), 300)
+
+    async def test_watermarks_stop_at_first_failure(self):
+        # chunk 1 fails, chunk 2 is already in flight and succeeds
+        backend = Backend(fail_on=(1,), delay=0.01)
+        pipeline = SubmissionPipeline(backend.submit, max_samples=6, max_in_flight=2)
+
+        result = await pipeline.run(make_samples(), DEVICES, 200)
+
+        self.assertEqual(result.failed, 1)
+        # chunk 0 holds timestamps 100 to 102; chunk 1 starts at 103
+        self.assertEqual(result.watermarks, {"address1": 103, "address2": 103})
+        self.assertLess(len(backend.bodies), 4)
+
+    async def test_rejected_sample_is_isolated(self):
+        # the backend rejects one sample; the rest is submitted, and watermarks move on
+        backend = Backend(reject=lambda sample: sample["data"] == {"level": 5})
+        pipeline = SubmissionPipeline(backend.submit, max_samples=6, max_in_flight=2)
+
+        result = await pipeline.run(make_samples(), DEVICES, 200)
+
+        self.assertEqual(result.rejected, 1)
+        self.assertEqual(result.failed, 0)
+        self.assertEqual(len(backend.accepted), 19)
+        self.assertEqual(result.watermarks, {"address1": 200, "address2": 200})
+
+    async def test_transient_failure_after_split(self):
+        # a later chunk fails transiently while a rejected one is split; watermarks stay
+        # at the earliest sample that wasn't acknowledged
+        backend = Backend(fail_on=(3,), reject=lambda sample: sample["data"] == {"level": 1})
+        pipeline = SubmissionPipeline(backend.submit, max_samples=6, max_in_flight=1)
+
+        result = await pipeline.run(make_samples(), DEVICES, 200)
+
+        self.assertEqual(result.failed, 1)
+        acknowledged = {
+            (sample["timestamp"], json.dumps(sample["data"])) for sample in backend.accepted
+        }
+        for address, watermark in result.watermarks.items():
+            for sample in make_samples():
+                if sample.address == address and sample.timestamp < watermark:
+                    self.assertIn(
+                        (sample.timestamp, json.dumps(sample.data)), acknowledged, sample.data
+                    )
+
+    async def test_everything_rejected(self):
+        # nothing is dropped if the backend rejects every request, whether it blames the body or not
+        for status in (404, 400):
+            backend = Backend(reject=lambda sample: True, status=status)
+            pipeline = SubmissionPipeline(backend.submit, max_samples=6, max_in_flight=2)
+
+            result = await pipeline.run(make_samples(), DEVICES, 200)
+
+            self.assertEqual((result.rejected, result.acknowledged), (0, 0))
+            self.assertGreater(result.failed, 0)
+            self.assertEqual(result.watermarks, {"address1": 100, "address2": 100})
+            self.assertLess(len(backend.bodies), 10)
+
+    def test_permanent_rejection(self):
+        for status in (400, 413, 422):
+            self.assertTrue(is_permanent_rejection(HTTPError(status)))
+        for status in (401, 403, 404, 405, 408, 415, 429, 500, 503):
+            self.assertFalse(is_permanent_rejection(HTTPError(status)))
+        self.assertFalse(is_permanent_rejection(Exception("Connection refused")))
+
+    async def test_nothing_to_submit(self):
+        backend = Backend()
+        pipeline = SubmissionPipeline(backend.submit)
+
+        result = await pipeline.run([], DEVICES, 200)
+
+        self.assertEqual(result.chunks, 0)
+        self.assertEqual(backend.bodies, [])
+        self.assertEqual(result.watermarks, {"address1": 200, "address2": 200})
+
+
+class TestRequestBody(unittest.TestCase):
+    def setUp(self):
+        self.data = dump_iot_data_for_api_submission(make_samples(), DEVICES)
+
+    @unittest.skipIf(submission.orjson is None, "orjson is not installed")
+    def test_encoders_agree(self):
+        self.assertEqual(
+            encode_iot_data(self.data, use_orjson=True),
+            encode_iot_data(self.data, use_orjson=False),
+        )
+
+    def test_small_bodies_are_not_compressed(self):
+        body = encode_iot_data(self.data)
+
+        self.assertEqual(compress_body(body, "gzip", min_bytes=len(body) + 1), (body, None))
+        self.assertEqual(compress_body(body, "none"), (body, None))
+
+    def test_gzip(self):
+        body = encode_iot_data(self.data)
+
+        compressed, encoding = compress_body(body, "gzip", min_bytes=len(body))
+
+        self.assertEqual(encoding, "gzip")
+        self.assertLess(len(compressed), len(body))
+        self.assertEqual(gzip.decompress(compressed), body)
+
+    @unittest.skipIf(submission.zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        body = encode_iot_data(self.data)
+
+        compressed, encoding = compress_body(body, "zstd")
+
+        self.assertEqual(encoding, "zstd")
+        self.assertEqual(submission.zstandard.ZstdDecompressor().decompress(compressed), body)
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            compress_body(b"{}", "brotli")
+
+
+if __name__ == "__main__":
+    unittest.main()